@@ -5,10 +5,12 @@ import joblib
 from huggingface_hub import login, hf_hub_download
 from dotenv import load_dotenv
 from bert_model import BERTWithExtraFeature, round_to_nearest_half_np, preprocess_inputs_pt
+from metrics import observe
 # from transformers import AutoConfig
 load_dotenv()
 login(os.getenv("IELTS_HUGGINGFACE_API_KEY"))
-bert_tokenizer = BertTokenizer.from_pretrained("Tiennhat123/IELTS_BERT_FINETUNE")
+BERT_MODEL_ID = "Tiennhat123/IELTS_BERT_FINETUNE"
+bert_tokenizer = BertTokenizer.from_pretrained(BERT_MODEL_ID)
 model = BERTWithExtraFeature()
 device = "cpu"
 model_path = hf_hub_download(
@@ -24,10 +26,12 @@ scaler = joblib.load(scaler_path)
 
 def get_overall_score(question, answer):
     # preprocess the input
-    input_ids, attention_mask, extra_number = preprocess_inputs_pt(question, answer, bert_tokenizer, scaler, device, max_length=512)
+    with observe("bert_tokenization", {"model": BERT_MODEL_ID}) as span:
+        input_ids, attention_mask, extra_number = preprocess_inputs_pt(question, answer, bert_tokenizer, scaler, device, max_length=512)
+        span.set_attribute("essay.tokens", int(attention_mask.sum()))
 
     model.eval()  # Set the model to evaluation mode
-    with torch.no_grad():  # No gradient computation during testing
+    with torch.no_grad(), observe("bert_inference", {"model": BERT_MODEL_ID, "batch_size": 1}):  # No gradient computation during testing
         output = model(input_ids, attention_mask, extra_number)
         output = output.cpu().numpy()
         score = round_to_nearest_half_np(output, method='nearest')
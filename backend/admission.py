@@ -0,0 +1,338 @@
+"""
+Per-stage admission control.
+Each expensive stage (BERT scoring, grammar correction, Ollama, Gemini) has a
+concurrency limit and a bounded wait queue. A request is checked once, up front,
+by admit(), which reserves the slots it will take in every stage; work beyond both
+is rejected at once with Overloaded, which the API turns into 429 (queue full) or
+503 (the backend behind the stage is unavailable) with a Retry-After estimated
+from the stage's observed service time. Reserved slots count against the queue
+until the request's stage calls use them or the request finishes, so a burst
+cannot pass admit() before reaching its stages and then queue without bound.
+Admitted stage calls wait for a slot instead of being rejected halfway through
+(the request deadline bounds the wait); stage calls made without a reservation
+are checked when they take their slot.
+
+Requests belong to a priority lane ("interactive" for users waiting in the UI,
+"bulk" for batch uploads and re-scoring jobs), carried in a context variable.
+Each lane has its own bounded queue, and freed slots are handed out by weighted
+fair queueing (stride scheduling over PRIORITY_WEIGHTS), so interactive work
+stays fast while bulk work uses the spare capacity without starving.
+"""
+
+import asyncio
+import contextvars
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+from ollama_pool import get_ollama_pool
+import usage
+
+load_dotenv()
+
+# Weight of the newest sample in the service time moving average
+SERVICE_TIME_ALPHA = 0.2
+MIN_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 300
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)
+
+
+def load_priority_weights(spec: str) -> dict:
+    """"interactive:4,bulk:1" -> {"interactive": 4.0, "bulk": 1.0}; lanes left out keep weight 1."""
+    weights = {lane: 1.0 for lane in LANES}
+    for item in spec.split(","):
+        if ":" in item:
+            lane, weight = item.split(":", 1)
+            if lane.strip() in weights:
+                weights[lane.strip()] = max(float(weight), 0.01)
+    return weights
+
+
+# Share of freed slots each lane gets while both have work waiting
+PRIORITY_WEIGHTS = load_priority_weights(os.getenv("PRIORITY_WEIGHTS", "interactive:4,bulk:1"))
+
+_priority = contextvars.ContextVar("request_priority", default=INTERACTIVE)
+
+
+def parse_priority(value: str, default: str = INTERACTIVE) -> str:
+    value = (value or "").strip().lower()
+    return value if value in LANES else default
+
+
+def set_priority(lane: str):
+    """Put the current context (request or job) in a lane; returns a token for reset_priority."""
+    return _priority.set(parse_priority(lane))
+
+
+def reset_priority(token) -> None:
+    _priority.reset(token)
+
+
+def current_priority() -> str:
+    return _priority.get()
+
+
+class Overloaded(Exception):
+    def __init__(self, stage: str, retry_after: int, status_code: int = 429, reason: str = "queue full"):
+        super().__init__(f"{stage} stage overloaded: {reason}")
+        self.stage = stage
+        self.retry_after = retry_after
+        self.status_code = status_code
+        self.reason = reason
+
+
+def clamp_retry_after(seconds: float) -> int:
+    return int(min(MAX_RETRY_AFTER, max(MIN_RETRY_AFTER, math.ceil(seconds))))
+
+
+class StageLimiter:
+    """
+    `availability` is an optional callable returning None while the stage's
+    backend can take work, or the seconds until it is expected to recover.
+    """
+
+    def __init__(self, name: str, concurrency: int, queue_max: int, default_service_time: float,
+                 availability=None, weights: dict = PRIORITY_WEIGHTS):
+        self.name = name
+        self.concurrency = max(concurrency, 1)
+        self.queue_max = max(queue_max, 0)
+        self.availability = availability
+        self.weights = weights
+        self.service_time = default_service_time
+        self.in_flight = 0
+        # Slots admitted requests reserved but have not taken yet, per lane
+        self.reserved = {lane: 0 for lane in LANES}
+        self._waiters = {lane: deque() for lane in LANES}
+        # Stride scheduling: a lane's pass advances by 1/weight per granted slot
+        self._pass = {lane: 0.0 for lane in LANES}
+        self._virtual_time = 0.0
+        self.counters = {"admitted": 0, "rejected": 0, "unavailable": 0, "completed": 0, "total_wait": 0.0}
+        self.lane_counters = {lane: {"admitted": 0, "rejected": 0, "total_wait": 0.0} for lane in LANES}
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def retry_after(self, lane: str = INTERACTIVE, extra: int = 1) -> int:
+        """Time for the lane's queue (plus `extra` requests) to drain at its share of the observed service rate."""
+        share = self.weights[lane] / sum(self.weights.values()) if self.waiting else 1.0
+        ahead = len(self._waiters[lane]) + self.reserved[lane] + extra
+        return clamp_retry_after(ahead * self.service_time / (self.concurrency * share))
+
+    def capacity(self, extra: int) -> int:
+        """Slots a request needing `extra` may reserve: a request needing more than the stage can ever hold is capped."""
+        return min(extra, self.concurrency + self.queue_max)
+
+    def check(self, extra: int = 1, lane: str = None) -> None:
+        """Raise Overloaded unless `extra` more requests of the lane could run or wait right now."""
+        lane = lane or current_priority()
+        extra = self.capacity(extra)
+        if self.availability is not None:
+            recover_in = self.availability()
+            if recover_in is not None:
+                self.counters["unavailable"] += 1
+                raise Overloaded(self.name, clamp_retry_after(recover_in), 503, "backend unavailable")
+        # Reserved slots are as good as queued: they will run or wait here soon
+        free = self.concurrency - self.in_flight - self.waiting - sum(self.reserved.values())
+        if len(self._waiters[lane]) + self.reserved[lane] + extra > self.queue_max + max(free, 0):
+            self.counters["rejected"] += 1
+            self.lane_counters[lane]["rejected"] += 1
+            raise Overloaded(self.name, self.retry_after(lane, extra), reason=f"{lane} queue full")
+
+    def record_service_time(self, seconds: float) -> None:
+        self.service_time += SERVICE_TIME_ALPHA * (seconds - self.service_time)
+
+    def _enqueue(self, lane: str) -> asyncio.Future:
+        if not self._waiters[lane]:
+            # A lane that was idle does not bank credit for the time it had nothing queued
+            self._pass[lane] = max(self._pass[lane], self._virtual_time)
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[lane].append(future)
+        return future
+
+    def _grant_next(self) -> None:
+        while self.in_flight < self.concurrency:
+            lanes = [lane for lane in LANES if self._waiters[lane]]
+            if not lanes:
+                return
+            lane = min(lanes, key=lambda l: self._pass[l])
+            future = self._waiters[lane].popleft()
+            if future.done():
+                continue
+            self._virtual_time = self._pass[lane]
+            self._pass[lane] += 1.0 / self.weights[lane]
+            self.in_flight += 1
+            future.set_result(None)
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        self._grant_next()
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Run one unit of work in this stage, waiting in the lane's queue if needed. Work the
+        current request reserved in admit() is never rejected here; other work is checked first.
+        """
+        lane = current_priority()
+        reservation = _reservation.get()
+        if reservation is None or not reservation.take(self.name):
+            self.check(lane=lane)
+        self.counters["admitted"] += 1
+        self.lane_counters[lane]["admitted"] += 1
+        queued_at = time.monotonic()
+        if self.in_flight < self.concurrency and not self.waiting:
+            self.in_flight += 1
+        else:
+            future = self._enqueue(lane)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Granted just as we were cancelled: pass the slot on
+                    self._release()
+                elif future in self._waiters[lane]:
+                    self._waiters[lane].remove(future)
+                raise
+        waited = time.monotonic() - queued_at
+        usage.add_queue_time(waited)
+        self.counters["total_wait"] += waited
+        self.lane_counters[lane]["total_wait"] += waited
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record_service_time(time.monotonic() - start)
+            self.counters["completed"] += 1
+            self._release()
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "total_wait": round(self.counters["total_wait"], 3),
+            "concurrency": self.concurrency,
+            "queue_max": self.queue_max,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "reserved": sum(self.reserved.values()),
+            "service_time": round(self.service_time, 3),
+            "lanes": {
+                lane: {**counters, "total_wait": round(counters["total_wait"], 3),
+                       "waiting": len(self._waiters[lane]), "reserved": self.reserved[lane],
+                       "weight": self.weights[lane]}
+                for lane, counters in self.lane_counters.items()
+            },
+        }
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, str(default)))
+
+
+_limiters = None
+
+
+def _gemini_availability():
+    # Imported here: gemini_pool schedules its token waits by this module's lanes
+    from gemini_pool import get_gemini_pool
+    return get_gemini_pool().seconds_until_available()
+
+
+def get_limiters() -> dict:
+    """Process-wide limiters, built lazily from the environment (STAGE_<NAME>_CONCURRENCY / _QUEUE)."""
+    global _limiters
+    if _limiters is None:
+        ollama = get_ollama_pool()
+        ollama_slots = sum(replica.slots for replica in ollama.replicas) or 1
+        _limiters = {
+            "bert": StageLimiter("bert", _env_int("STAGE_BERT_CONCURRENCY", 2), _env_int("STAGE_BERT_QUEUE", 16), 1.0),
+            "grammar": StageLimiter("grammar", _env_int("STAGE_GRAMMAR_CONCURRENCY", 1),
+                                    _env_int("STAGE_GRAMMAR_QUEUE", 8), 20.0),
+            # Defaults to the total parallel slots of the Ollama replicas
+            "ollama": StageLimiter("ollama", _env_int("STAGE_OLLAMA_CONCURRENCY", ollama_slots),
+                                   _env_int("STAGE_OLLAMA_QUEUE", 4 * ollama_slots), 60.0,
+                                   ollama.seconds_until_available),
+            # The key pool (and google-genai) is only built once a Gemini stage is checked
+            "gemini": StageLimiter("gemini", _env_int("STAGE_GEMINI_CONCURRENCY", 8),
+                                   _env_int("STAGE_GEMINI_QUEUE", 32), 5.0, _gemini_availability),
+        }
+    return _limiters
+
+
+def get_limiter(name: str) -> StageLimiter:
+    return get_limiters()[name]
+
+
+_reservation = contextvars.ContextVar("admission_reservation", default=None)
+
+
+class Reservation:
+    """
+    Stage slots an admitted request holds until its stage calls take them. Use as a
+    context manager around the request's work (tasks started inside inherit it);
+    leaving it, or release(), gives back whatever was not used.
+    """
+
+    def __init__(self, slots: dict, lane: str):
+        self.lane = lane
+        # Calls the request will make per stage, and how many of them hold a reserved slot
+        self.calls = dict(slots)
+        self.held = {name: get_limiter(name).capacity(n) for name, n in slots.items()}
+        for name, n in self.held.items():
+            get_limiter(name).reserved[lane] += n
+        self._token = None
+
+    def take(self, name: str) -> bool:
+        """Use one of the request's slots for `name`; False if the request was not admitted to that stage."""
+        if name not in self.calls:
+            return False
+        if self.held[name] > 0:
+            self.held[name] -= 1
+            get_limiter(name).reserved[self.lane] -= 1
+        # Calls beyond the estimate (e.g. retries) were admitted with the request too
+        return True
+
+    def release(self) -> None:
+        for name, n in self.held.items():
+            get_limiter(name).reserved[self.lane] -= n
+            self.held[name] = 0
+
+    def activate(self):
+        """Make the current context's stage calls use this reservation; returns the context variable token."""
+        return _reservation.set(self)
+
+    def __enter__(self):
+        self._token = self.activate()
+        return self
+
+    def __exit__(self, *exc):
+        _reservation.reset(self._token)
+        self.release()
+
+
+def admit(stages) -> Reservation:
+    """
+    Up-front check for a request that will use `stages` ({name: slots it takes},
+    or names taking one slot each): raises Overloaded (with the largest Retry-After)
+    before any work starts if one of them is full, else reserves the slots.
+    """
+    slots = stages if isinstance(stages, dict) else dict.fromkeys(stages, 1)
+    rejections = []
+    for name, extra in slots.items():
+        try:
+            get_limiter(name).check(extra)
+        except Overloaded as e:
+            rejections.append(e)
+    if rejections:
+        # A down backend (503) is reported over a full queue (429)
+        raise max(rejections, key=lambda e: (e.status_code, e.retry_after))
+    return Reservation(slots, current_priority())
+
+
+def stats() -> dict:
+    return {name: limiter.stats() for name, limiter in get_limiters().items()}
@@ -0,0 +1,59 @@
+"""
+Per-criterion, per-band descriptor snippets for prompt context.
+Loads band_descriptors.json (generated once from the PDF by
+extract_band_descriptors.py) and renders only the bands adjacent to the
+BERT-predicted overall score, instead of sending the whole PDF to Gemini.
+"""
+
+import json
+import math
+import os
+from functools import lru_cache
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BAND_DESCRIPTORS_JSON = os.getenv(
+    "BAND_DESCRIPTORS_JSON",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "band_descriptors.json"),
+)
+# Bands included on each side of the predicted score (1 -> e.g. 5, 6, 7 for a 6.0)
+BAND_DESCRIPTOR_RADIUS = int(os.getenv("BAND_DESCRIPTOR_RADIUS", "1"))
+
+CRITERION_TITLES = {
+    "task_response": "Task Response",
+    "coherence_and_cohesion": "Coherence and Cohesion",
+    "lexical_resource": "Lexical Resource",
+    "grammatical_range_and_accuracy": "Grammatical Range and Accuracy",
+}
+
+
+@lru_cache(maxsize=1)
+def load_band_descriptors(path: str = BAND_DESCRIPTORS_JSON) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def adjacent_bands(overall_score: float, radius: int = BAND_DESCRIPTOR_RADIUS) -> list:
+    """Whole bands around the score, highest first; a half band includes both neighbours."""
+    low = max(0, math.floor(overall_score) - radius)
+    high = min(9, math.ceil(overall_score) + radius)
+    return list(range(high, low - 1, -1))
+
+
+def descriptor_context(overall_score: float, criteria: list = None, radius: int = BAND_DESCRIPTOR_RADIUS) -> str:
+    """
+    Render the official band descriptors for the given criteria (all four by
+    default), restricted to the bands adjacent to overall_score.
+    """
+    descriptors = load_band_descriptors()
+    bands = adjacent_bands(overall_score, radius)
+    lines = ["IELTS Writing Task 2 band descriptors (public version), relevant bands only:"]
+    for criterion in criteria or list(CRITERION_TITLES):
+        lines.append(f"\n{CRITERION_TITLES[criterion]}:")
+        for band in bands:
+            items = descriptors[criterion].get(str(band), [])
+            if items:
+                lines.append(f"Band {band}:")
+                lines.extend(f"- {item}" for item in items)
+    return "\n".join(lines)
@@ -115,30 +115,38 @@ def extract_scores(evaluation_json: dict) -> dict:
     }
 
 
+def extract_available_scores(evaluation_json: dict) -> dict:
+    """
+    extract_scores when both feedback parts are present. For partial results
+    (an LLM stage ran out of time) only the BERT overall band is returned.
+    """
+    if "evaluation_feedback" in evaluation_json and "constructive_feedback" in evaluation_json:
+        return extract_scores(evaluation_json)
+    overall_score = evaluation_json.get("overall_score")
+    return {
+        "overall_score": round_ielts(overall_score) if overall_score is not None else None,
+        "criteria_scores": {}
+    }
+
+
 def postprocess_feedback(evaluation_json: dict) -> dict:
-    ''' Xóa các cột overall_score, suggested_band_score, suggested_overall_band_score, score trong feedback trả về '''
+    ''' Xóa các cột overall_score, suggested_band_score, suggested_overall_band_score, score trong feedback trả về.
+    Mỗi phần được xử lý riêng, nên kết quả partial (thiếu evaluation hoặc constructive) vẫn được xóa điểm '''
     data = evaluation_json
-    try:
-        if "overall_score" in data:
-            del data["overall_score"]
-        
-        evaluation_feedback = data["evaluation_feedback"]
-        for criterion, details in evaluation_feedback.items():
-            if "suggested_band_score" in details:
-                del details["suggested_band_score"]
-        if "Overall Band Score" in evaluation_feedback:
-            del evaluation_feedback["Overall Band Score"]
-        
-        constructive_feedback = data["constructive_feedback"]
-        criteria = constructive_feedback["criteria"]
-        for criterion, details in criteria.items():
-            if "score" in details:
-                del details["score"]
-    except KeyError as e:
-        print(f"Key error while postprocessing feedback: {e}")
-    
-    return data
+    data.pop("overall_score", None)
 
-    
+    evaluation_feedback = data.get("evaluation_feedback")
+    if isinstance(evaluation_feedback, dict):
+        for criterion, details in evaluation_feedback.items():
+            if isinstance(details, dict):
+                details.pop("suggested_band_score", None)
+        evaluation_feedback.pop("Overall Band Score", None)
 
+    constructive_feedback = data.get("constructive_feedback")
+    criteria = constructive_feedback.get("criteria") if isinstance(constructive_feedback, dict) else None
+    if isinstance(criteria, dict):
+        for criterion, details in criteria.items():
+            if isinstance(details, dict):
+                details.pop("score", None)
 
+    return data
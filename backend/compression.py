@@ -0,0 +1,107 @@
+"""
+Negotiated response compression.
+ASGI middleware that compresses complete (non-streaming) responses above
+COMPRESS_MIN_SIZE with brotli or gzip, whichever the client accepts (brotli
+preferred when the optional `brotli` package is installed). Streaming responses
+such as the SSE endpoint pass through untouched so events are not buffered.
+"""
+
+import gzip
+import os
+from dotenv import load_dotenv
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+load_dotenv()
+
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+# 4-5 is the usual sweet spot for dynamic responses; 11 is for static assets
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+
+def accepted_encodings(accept_encoding: str) -> dict:
+    """Accept-Encoding header -> {encoding: q}."""
+    encodings = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        encodings[name.strip().lower()] = q
+    return encodings
+
+
+def negotiate(accept_encoding: str):
+    """Best supported encoding the client accepts ("br", "gzip") or None."""
+    encodings = accepted_encodings(accept_encoding)
+    wildcard = encodings.get("*", 0.0)
+    supported = ["br", "gzip"] if brotli is not None else ["gzip"]
+    ranked = [(encodings.get(name, wildcard), -i, name) for i, name in enumerate(supported)]
+    q, _, name = max(ranked)
+    return name if q > 0 else None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                start_message = message
+                headers = Headers(raw=message["headers"])
+                passthrough = ("content-encoding" in headers
+                               or headers.get("content-type", "").startswith("text/event-stream"))
+                if passthrough:
+                    await send(message)
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+            body = message.get("body", b"")
+            if message.get("more_body", False):
+                # Streaming response: send it as produced, uncompressed
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+            headers = MutableHeaders(raw=start_message["headers"])
+            if len(body) >= self.minimum_size:
+                body = compress(body, encoding)
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start_message)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_wrapper)
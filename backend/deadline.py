@@ -0,0 +1,53 @@
+"""
+Request-level deadline budget.
+The deadline is an absolute time.monotonic() value kept in a context variable,
+so it follows the request into pipeline tasks and worker threads (asyncio.to_thread
+and the pipeline executors copy the context). Stages read the remaining budget
+to size their own timeouts and stop work nobody will read.
+"""
+
+import contextvars
+import os
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Budget for a request that does not set deadline_seconds; the frontend gives up after 300 s
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "240"))
+
+_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Raised by blocking stages that notice the request budget is spent."""
+
+
+def set_deadline(seconds: float = REQUEST_DEADLINE_SECONDS):
+    """Start a budget of `seconds` for the current context; returns a token for reset_deadline."""
+    return _deadline.set(time.monotonic() + seconds if seconds else None)
+
+
+def reset_deadline(token) -> None:
+    _deadline.reset(token)
+
+
+def remaining():
+    """Seconds left in the budget (never negative), or None without a deadline."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+def timeout_for(default: float) -> float:
+    """`default` capped by the remaining budget."""
+    left = remaining()
+    return default if left is None else min(default, left)
+
+
+def check_deadline(stage: str = "request") -> None:
+    """Raise DeadlineExceeded once the budget is spent; for loops in worker threads."""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"{stage} exceeded the request deadline")
@@ -0,0 +1,162 @@
+"""
+Idempotent essay submissions.
+Each submission is keyed by a content hash of (question, answer, pipeline
+version, user_id). A unique index on `submissions.content_hash` lets one replica
+claim the computation; identical requests in the same process await the same
+task, requests on other replicas wait for the claimed run, and completed runs are
+answered from the stored session within a freshness window. Every result not
+computed for the request itself (coalesced or stored) carries "deduplicated": true.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import socket
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from pymongo.errors import DuplicateKeyError
+from deadline import DeadlineExceeded, check_deadline, remaining
+import tracing
+
+load_dotenv()
+
+# Bump when prompts/models change so old results are not served for new pipelines
+PIPELINE_VERSION = os.getenv("PIPELINE_VERSION", "1")
+# Completed results younger than this are returned instead of recomputing
+DEDUP_FRESHNESS_SECONDS = float(os.getenv("DEDUP_FRESHNESS_SECONDS", str(24 * 3600)))
+# A claimed run older than this is assumed dead and may be taken over
+DEDUP_RUNNING_TIMEOUT = float(os.getenv("DEDUP_RUNNING_TIMEOUT", "900"))
+DEDUP_POLL_INTERVAL = float(os.getenv("DEDUP_POLL_INTERVAL", "1.0"))
+# How long a completed run's documents may take to become readable (write-behind flush)
+DEDUP_STORE_GRACE = float(os.getenv("DEDUP_STORE_GRACE", "5"))
+
+RUNNING = "running"
+DONE = "done"
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def as_utc(value: datetime) -> datetime:
+    # MongoDB returns naive UTC datetimes
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def content_hash(question: str, answer: str, pipeline_version: str = PIPELINE_VERSION, user_id: str = None) -> str:
+    """user_id is part of the key so a user's history only ever holds their own sessions."""
+    canonical = json.dumps(
+        {"question": question.strip(), "answer": answer.strip(), "pipeline_version": pipeline_version,
+         "user_id": user_id},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class SubmissionDeduplicator:
+    """
+    `collection` is an async MongoDB collection. run() takes `compute`, an async
+    callable returning a result dict with a session_id, and `load`, an async
+    callable returning the stored result for a session_id (or None).
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.owner = f"{socket.gethostname()}-{os.getpid()}"
+        self._in_flight = {}
+        self.counters = {"computed": 0, "coalesced": 0, "stored_hits": 0, "wait_polls": 0, "takeovers": 0}
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index("content_hash", unique=True)
+
+    async def run(self, key: str, compute, load) -> dict:
+        # Identical request already running in this process: share its result
+        task = self._in_flight.get(key)
+        coalesced = task is not None
+        if coalesced:
+            self.counters["coalesced"] += 1
+        else:
+            task = asyncio.create_task(self._run(key, compute, load))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # A coalesced request waits no longer than its own deadline
+        try:
+            result = await asyncio.wait_for(asyncio.shield(task), remaining())
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("Identical submission did not finish before the deadline")
+        return {**result, "deduplicated": True} if coalesced else result
+
+    async def _claim(self, key: str) -> bool:
+        try:
+            await self.collection.insert_one(
+                {"content_hash": key, "status": RUNNING, "owner": self.owner, "started_at": utcnow(),
+                 "trace_id": tracing.current_trace_id()}
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+
+    async def _take_over(self, existing: dict) -> bool:
+        """Atomically replace a stale or expired record with our own claim."""
+        result = await self.collection.update_one(
+            {"_id": existing["_id"], "status": existing["status"], "started_at": existing.get("started_at")},
+            {"$set": {"status": RUNNING, "owner": self.owner, "started_at": utcnow()},
+             "$unset": {"session_id": "", "completed_at": ""}},
+        )
+        if result.modified_count:
+            self.counters["takeovers"] += 1
+        return bool(result.modified_count)
+
+    async def _compute(self, key: str, compute) -> dict:
+        try:
+            result = await compute()
+        except BaseException:
+            await self.collection.delete_one({"content_hash": key, "owner": self.owner, "status": RUNNING})
+            raise
+        self.counters["computed"] += 1
+        if result.get("status") == "partial":
+            # Cut short by the request deadline: let the next identical submission try again
+            await self.collection.delete_one({"content_hash": key, "owner": self.owner, "status": RUNNING})
+            return result
+        await self.collection.update_one(
+            {"content_hash": key, "owner": self.owner},
+            {"$set": {"status": DONE, "session_id": result["session_id"], "completed_at": utcnow()}},
+        )
+        return result
+
+    async def _poll_wait(self) -> None:
+        """Sleep before polling again, within the request deadline (DeadlineExceeded once it is spent)."""
+        check_deadline("Waiting for an identical submission")
+        self.counters["wait_polls"] += 1
+        left = remaining()
+        await asyncio.sleep(DEDUP_POLL_INTERVAL if left is None else min(DEDUP_POLL_INTERVAL, left))
+
+    async def _run(self, key: str, compute, load) -> dict:
+        while True:
+            if await self._claim(key):
+                return await self._compute(key, compute)
+            existing = await self.collection.find_one({"content_hash": key})
+            if existing is None:
+                continue
+            now = utcnow()
+            if existing["status"] == DONE:
+                fresh = now - as_utc(existing["completed_at"]) < timedelta(seconds=DEDUP_FRESHNESS_SECONDS)
+                stored = await load(existing["session_id"]) if fresh else None
+                if stored is not None:
+                    self.counters["stored_hits"] += 1
+                    return {**stored, "deduplicated": True}
+                if fresh and now - as_utc(existing["completed_at"]) < timedelta(seconds=DEDUP_STORE_GRACE):
+                    # Just finished; its documents may still be in the write-behind buffer
+                    await self._poll_wait()
+                    continue
+            elif now - as_utc(existing["started_at"]) < timedelta(seconds=DEDUP_RUNNING_TIMEOUT):
+                # Another replica is computing the same submission
+                await self._poll_wait()
+                continue
+            if await self._take_over(existing):
+                return await self._compute(key, compute)
+
+    def stats(self) -> dict:
+        return {**self.counters, "in_flight": len(self._in_flight)}
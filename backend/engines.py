@@ -0,0 +1,257 @@
+"""
+Worker roles and lazily loaded engines.
+WORKER_ROLE picks what a backend process serves: scoring (BERT), grammar (CoEdIT),
+llm (Ollama/Gemini feedback orchestration) or all (default); combine with commas,
+e.g. "scoring,llm". Only the engines of the role are imported and loaded, at startup
+and in parallel, so torch/transformers stay out of an llm replica and google-genai
+out of a scoring or grammar one. An llm replica without the scoring or grammar role
+sends those stages to a replica that has it (SCORING_URL / GRAMMAR_URL).
+
+Startup is timed phase by phase (interpreter and server, app import, framework
+imports, each engine, index creation) for the report served at /stats/startup.
+"""
+
+import asyncio
+import importlib
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+import httpx
+from dotenv import load_dotenv
+from admission import Overloaded, current_priority
+from deadline import DeadlineExceeded, REQUEST_DEADLINE_SECONDS, remaining
+import tracing
+
+load_dotenv()
+
+ENGINES = ("scoring", "grammar", "llm")
+
+
+def parse_roles(spec: str) -> tuple:
+    """"scoring,llm" -> ("scoring", "llm"); "all" or empty -> every engine."""
+    roles = [r.strip().lower() for r in (spec or "").split(",") if r.strip()]
+    if not roles or "all" in roles:
+        return ENGINES
+    unknown = [r for r in roles if r not in ENGINES]
+    if unknown:
+        raise ValueError(f"Unknown WORKER_ROLE {unknown}, expected {list(ENGINES)} or all")
+    return tuple(r for r in ENGINES if r in roles)
+
+
+WORKER_ROLE = os.getenv("WORKER_ROLE", "all")
+WORKER_ROLES = parse_roles(WORKER_ROLE)
+# Replicas serving the engines this process does not load (base URLs, e.g. http://scoring:8000)
+REMOTE_URLS = {"scoring": os.getenv("SCORING_URL"), "grammar": os.getenv("GRAMMAR_URL")}
+# Heavy frameworks imported up front (one thread) before the engines load in parallel
+FRAMEWORKS = {"scoring": ("torch", "transformers"), "grammar": ("torch", "transformers"),
+              "llm": ("google.genai",)}
+
+
+def _seconds_since_process_start() -> float:
+    """Process age from /proc (0 where unavailable, so times count from this import)."""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+# perf_counter() value of the process start
+_PROCESS_START = time.perf_counter() - _seconds_since_process_start()
+_IMPORTED_AT = time.perf_counter()
+_phases = [{"phase": "interpreter_and_server", "started_at": 0.0,
+            "seconds": round(_IMPORTED_AT - _PROCESS_START, 3)}]
+_engines = {name: {"status": "not_loaded"} for name in ENGINES}
+_modules = {}
+_load_locks = {name: threading.Lock() for name in ENGINES}
+_ready_at = None
+_client = None
+
+
+def serves(engine: str) -> bool:
+    """The engine runs in this process."""
+    return engine in WORKER_ROLES
+
+
+def available(engine: str) -> bool:
+    """The engine runs here or on a configured remote replica."""
+    return serves(engine) or bool(REMOTE_URLS.get(engine))
+
+
+def _since_start() -> float:
+    return round(time.perf_counter() - _PROCESS_START, 3)
+
+
+@contextmanager
+def phase(name: str):
+    """Time a startup step for the report."""
+    started_at = _since_start()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases.append({"phase": name, "started_at": started_at, "seconds": round(time.perf_counter() - start, 3)})
+
+
+def app_imported() -> None:
+    """Called at the end of main.py: everything imported after this module counts as the app import."""
+    _phases.append({"phase": "app_import", "started_at": round(_IMPORTED_AT - _PROCESS_START, 3),
+                    "seconds": round(time.perf_counter() - _IMPORTED_AT, 3)})
+
+
+def mark_ready() -> None:
+    global _ready_at
+    _ready_at = _since_start()
+    loaded = ", ".join(f"{name} {info['seconds']}s" for name, info in _engines.items() if "seconds" in info)
+    print(f"✅ Ready {_ready_at}s after process start (role {','.join(WORKER_ROLES)}; {loaded or 'no models'})")
+
+
+# ===========================
+# Engines
+# ===========================
+def _load_scoring():
+    import bert_setup
+    return bert_setup
+
+
+def _load_grammar():
+    import grammar
+    return grammar
+
+
+def _load_llm():
+    import mistral_model
+    from gemini_pool import get_gemini_pool
+    # Builds the per-key Gemini clients
+    get_gemini_pool()
+    return mistral_model
+
+
+LOADERS = {"scoring": _load_scoring, "grammar": _load_grammar, "llm": _load_llm}
+
+
+def load(engine: str):
+    """Import and initialize an engine once (thread-safe); returns its module."""
+    module = _modules.get(engine)
+    if module is not None:
+        return module
+    with _load_locks[engine]:
+        if engine in _modules:
+            return _modules[engine]
+        info = _engines[engine]
+        info.update(status="loading", started_at=_since_start(), on_demand=_ready_at is not None)
+        start = time.perf_counter()
+        try:
+            module = LOADERS[engine]()
+        except BaseException as e:
+            info.update(status="failed", error=f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            info["seconds"] = round(time.perf_counter() - start, 3)
+        info["status"] = "loaded"
+        _modules[engine] = module
+        return module
+
+
+def scoring():
+    """bert_setup: tokenizer, BERTWithExtraFeature and scaler."""
+    return load("scoring")
+
+
+def grammar():
+    """grammar: CoEdIT tokenizer and model."""
+    return load("grammar")
+
+
+def llm():
+    """mistral_model, with the Gemini key pool built."""
+    return load("llm")
+
+
+def _import_frameworks(names: list) -> None:
+    for name in names:
+        with phase(f"import {name}"):
+            importlib.import_module(name)
+
+
+async def load_role() -> None:
+    """
+    Load this role's engines: the shared frameworks first on one thread (concurrent
+    first imports of torch are not safe), then every engine on its own thread, so
+    startup takes as long as the slowest model rather than the sum.
+    """
+    frameworks = list(dict.fromkeys(f for engine in WORKER_ROLES for f in FRAMEWORKS[engine]))
+    with phase("models"):
+        await asyncio.to_thread(_import_frameworks, frameworks)
+        await asyncio.gather(*(asyncio.to_thread(load, engine) for engine in WORKER_ROLES))
+
+
+def startup_report() -> dict:
+    frameworks = sorted({f for names in FRAMEWORKS.values() for f in names})
+    return {
+        "role": list(WORKER_ROLES),
+        "remote": {engine: url for engine, url in REMOTE_URLS.items() if url and not serves(engine)},
+        "ready_after": _ready_at,
+        "phases": _phases,
+        "engines": _engines,
+        # Which heavy frameworks ended up in this process at all
+        "frameworks_imported": {name: name in sys.modules for name in frameworks},
+    }
+
+
+# ===========================
+# Remote engines
+# ===========================
+def _http() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(timeout=httpx.Timeout(REQUEST_DEADLINE_SECONDS, connect=10.0))
+    return _client
+
+
+async def close() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def _post_remote(engine: str, path: str, **kwargs) -> dict:
+    """
+    POST to the replica serving `engine` within the request's remaining budget,
+    carrying the trace context and priority lane. Its 429/503 answers (and an
+    unreachable replica) surface as Overloaded, an expired budget as DeadlineExceeded.
+    """
+    budget = remaining()
+    timeout = httpx.Timeout(budget, connect=min(10.0, budget)) if budget is not None else httpx.USE_CLIENT_DEFAULT
+    headers = {**tracing.propagation_headers(), "X-Priority": current_priority()}
+    try:
+        response = await _http().post(REMOTE_URLS[engine].rstrip("/") + path, headers=headers, timeout=timeout,
+                                      **kwargs)
+    except httpx.TimeoutException:
+        raise DeadlineExceeded(f"Remote {engine} did not answer before the deadline")
+    except httpx.TransportError as e:
+        raise Overloaded(engine, 5, 503, f"{engine} replica unreachable ({type(e).__name__})")
+    if response.status_code in (429, 503):
+        raise Overloaded(engine, int(response.headers.get("Retry-After", "5")), response.status_code,
+                         f"{engine} replica busy")
+    response.raise_for_status()
+    return response.json()
+
+
+async def remote_score(question: str, answer: str) -> float:
+    """BERT overall band from the scoring replica's /score."""
+    with tracing.span("remote scoring", {"peer.url": REMOTE_URLS["scoring"]}):
+        result = await _post_remote("scoring", "/score", json={"question": question, "answer": answer})
+    return float(result["overall_score"])
+
+
+async def remote_annotate(answer: str) -> dict:
+    """annotate_essay result from the grammar replica's /grammar_correction."""
+    with tracing.span("remote grammar", {"peer.url": REMOTE_URLS["grammar"]}):
+        return await _post_remote("grammar", "/grammar_correction", params={"answer": answer})
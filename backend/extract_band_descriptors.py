@@ -0,0 +1,84 @@
+"""
+One-off preprocessing: extract Writing-Band-descriptors-Task-2.pdf into
+band_descriptors.json, structured as {criterion: {band: [descriptor, ...]}}.
+
+The PDF is a single table (band rows x four criterion columns), so text runs are
+assigned to a column by their x position and to a band row by the band label
+above them. Requires pypdf, which is only needed to regenerate the JSON:
+
+    pip install pypdf
+    python extract_band_descriptors.py [pdf_path] [output_path]
+"""
+
+import json
+import sys
+
+# Left edge of each criterion column in the PDF (points)
+COLUMN_STARTS = [
+    ("task_response", 0),
+    ("coherence_and_cohesion", 215),
+    ("lexical_resource", 400),
+    ("grammatical_range_and_accuracy", 585),
+]
+BAND_LABEL_MAX_X = 35
+TABLE_BOTTOM_Y = 30
+
+
+def column_for(x: float) -> str:
+    name = COLUMN_STARTS[0][0]
+    for column, start in COLUMN_STARTS:
+        if x >= start:
+            name = column
+    return name
+
+
+def extract(pdf_path: str) -> dict:
+    from pypdf import PdfReader
+
+    runs = []
+
+    def visitor(text, cm, tm, font_dict, font_size):
+        if text.strip():
+            runs.append((tm[4], tm[5], text.strip()))
+
+    PdfReader(pdf_path).pages[0].extract_text(visitor_text=visitor)
+
+    # Band labels are single digits in the first column; rows run top to bottom
+    labels = sorted(
+        ((y, text) for x, y, text in runs if x < BAND_LABEL_MAX_X and text.isdigit()),
+        reverse=True,
+    )
+    descriptors = {column: {band: [] for _, band in labels} for column, _ in COLUMN_STARTS}
+
+    def band_for(y: float):
+        # A row runs from its label (bullets sit ~1pt above it) down to the next label
+        for label_y, band in reversed(labels):
+            if y <= label_y + 2:
+                return band
+        return labels[0][1]
+
+    top_y = labels[0][0] + 5
+    for x, y, text in sorted(runs, key=lambda r: (-r[1], r[0])):
+        if x < BAND_LABEL_MAX_X or y > top_y or y < TABLE_BOTTOM_Y:
+            continue
+        items = descriptors[column_for(x)][band_for(y)]
+        if text == "•":
+            items.append("")
+        elif items:
+            items[-1] = f"{items[-1]} {text}".strip()
+        else:
+            items.append(text)
+    return descriptors
+
+
+def main():
+    pdf_path = sys.argv[1] if len(sys.argv) > 1 else "Writing-Band-descriptors-Task-2.pdf"
+    output_path = sys.argv[2] if len(sys.argv) > 2 else "band_descriptors.json"
+    descriptors = extract(pdf_path)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(descriptors, f, ensure_ascii=False, indent=2)
+    print(f"Wrote {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+"""
+Gemini API key pool.
+Spreads Gemini calls over every configured API key with per-key token buckets,
+least-loaded key selection, jittered exponential backoff and a circuit breaker
+that takes a failing key out of rotation for a cooldown period. Only retryable
+errors (429, 5xx, transport) count toward the breaker; after the cooldown a single
+probe call decides whether the key is back.
+
+Calls waiting for a token are served in priority-lane order (the same stride
+scheduling over PRIORITY_WEIGHTS as the stage limiters), since the per-key RPM is
+the real Gemini bottleneck. A caller's admission slot is only taken once it has a
+token, so calls queued for quota do not hold slots.
+"""
+
+import asyncio
+import contextlib
+import os
+import random
+import time
+from collections import deque
+import httpx
+from dotenv import load_dotenv
+from admission import LANES, PRIORITY_WEIGHTS, current_priority
+from deadline import DeadlineExceeded, remaining
+from metrics import observe
+import usage
+
+load_dotenv()
+
+RETRY_DELAY = int(os.getenv("RETRY_DELAY", "3"))
+MAX_RETRIES = int(os.getenv("MAX_RETRIES", "3"))
+# Requests per minute allowed for each key (free tier gemini-2.5-flash-lite = 15)
+GEMINI_RPM_PER_KEY = float(os.getenv("GEMINI_RPM_PER_KEY", "15"))
+GEMINI_BURST_PER_KEY = float(os.getenv("GEMINI_BURST_PER_KEY", "3"))
+# Consecutive retryable failures before a key is taken out of rotation, and for how long
+GEMINI_BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "3"))
+GEMINI_BREAKER_COOLDOWN = float(os.getenv("GEMINI_BREAKER_COOLDOWN", "60"))
+# Alternative API root, e.g. the local stand-in from mock_llm.py for load tests
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class NoGeminiKeyAvailable(RuntimeError):
+    """Raised when every key is out of rotation or no key is configured."""
+
+
+def load_api_keys() -> list:
+    """
+    Collect Gemini keys from GEMINI_API_KEYS (comma separated) and the legacy
+    GEMINI_API_KEY / GEMINI_API_KEY_2 variables, without duplicates.
+    """
+    keys = [k.strip() for k in os.getenv("GEMINI_API_KEYS", "").split(",") if k.strip()]
+    for name in ("GEMINI_API_KEY", "GEMINI_API_KEY_2"):
+        value = os.getenv(name)
+        if value and value not in keys:
+            keys.append(value)
+    return keys
+
+
+def is_retryable(error: Exception) -> bool:
+    """Rate limits, transient 5xx and network errors are retried; everything else is not."""
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if isinstance(code, int):
+        return code in RETRYABLE_STATUS_CODES
+    # google-genai talks httpx, whose transport errors are not OSErrors
+    return isinstance(error, (ConnectionError, TimeoutError, OSError, httpx.TransportError))
+
+
+def backoff_delay(attempt: int, base: float = RETRY_DELAY, cap: float = 60.0) -> float:
+    """Full-jitter exponential backoff: uniform(0, min(cap, base * 2**attempt))."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class GeminiKeySlot:
+    """Client, token bucket, breaker state and counters for one API key."""
+
+    def __init__(self, name: str, api_key: str, rpm: float, burst: float):
+        # Imported here so processes that never call Gemini (scoring/grammar roles) skip google-genai
+        from google import genai
+        self.name = name
+        self.client = genai.Client(api_key=api_key,
+                                   http_options={"base_url": GEMINI_BASE_URL} if GEMINI_BASE_URL else None)
+        self.rate = rpm / 60.0
+        self.capacity = max(burst, 1.0)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        # After a cooldown the key takes one probe call before rejoining the rotation
+        self.half_open = False
+        self.counters = {
+            "requests": 0,
+            "successes": 0,
+            "failures": 0,
+            "rate_limited": 0,
+            "retries": 0,
+            "breaker_opens": 0,
+            "total_latency": 0.0,
+        }
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def cooled_down(self, now: float) -> bool:
+        return now >= self.open_until
+
+    def available(self, now: float) -> bool:
+        """Schedulable: circuit closed, or cooled down with no probe in flight."""
+        return self.cooled_down(now) and not (self.half_open and self.in_flight)
+
+    def seconds_until_token(self) -> float:
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else GEMINI_BREAKER_COOLDOWN
+
+    def record_success(self, latency: float) -> None:
+        self.consecutive_failures = 0
+        self.half_open = False
+        self.counters["successes"] += 1
+        self.counters["total_latency"] += latency
+
+    def record_failure(self, error: Exception, now: float) -> None:
+        self.counters["failures"] += 1
+        if not is_retryable(error):
+            # The key answered; the request itself was bad (e.g. 400 for an oversized prompt)
+            self.consecutive_failures = 0
+            self.half_open = False
+            return
+        self.consecutive_failures += 1
+        code = getattr(error, "code", None) or getattr(error, "status_code", None)
+        if code == 429:
+            self.counters["rate_limited"] += 1
+            # Drain the bucket so the scheduler prefers other keys for a while
+            self.tokens = min(self.tokens, 0.0)
+        # A failed probe reopens the circuit straight away
+        if self.half_open or self.consecutive_failures >= GEMINI_BREAKER_THRESHOLD:
+            self.open_until = now + GEMINI_BREAKER_COOLDOWN
+            self.consecutive_failures = 0
+            self.half_open = True
+            self.counters["breaker_opens"] += 1
+            print(f"Gemini key {self.name} taken out of rotation for {GEMINI_BREAKER_COOLDOWN:.0f}s")
+
+    def stats(self, now: float) -> dict:
+        successes = self.counters["successes"]
+        return {
+            **self.counters,
+            "in_flight": self.in_flight,
+            "tokens": round(self.tokens, 2),
+            "circuit_open": not self.cooled_down(now),
+            "circuit_half_open": self.half_open and self.cooled_down(now),
+            "avg_latency": round(self.counters["total_latency"] / successes, 3) if successes else None,
+        }
+
+
+class GeminiKeyPool:
+    """Schedules Gemini calls on the least-loaded key that has quota left."""
+
+    def __init__(self, api_keys: list, rpm: float = GEMINI_RPM_PER_KEY, burst: float = GEMINI_BURST_PER_KEY,
+                 max_retries: int = MAX_RETRIES):
+        # Keys are never exposed; slots are named by index and the last 4 characters
+        self.slots = [
+            GeminiKeySlot(f"key{i}-{key[-4:]}", key, rpm, burst)
+            for i, key in enumerate(api_keys)
+        ]
+        self.max_retries = max_retries
+        self.weights = PRIORITY_WEIGHTS
+        # (future, excluded key) per lane, granted by stride scheduling as in StageLimiter
+        self._waiters = {lane: deque() for lane in LANES}
+        self._pass = {lane: 0.0 for lane in LANES}
+        self._virtual_time = 0.0
+        self._timer = None
+
+    def _take_token(self, exclude=None) -> tuple:
+        """(slot, 0) with a token taken from the least-loaded ready key, or (None, seconds to wait)."""
+        now = time.monotonic()
+        candidates = [s for s in self.slots if s.available(now)]
+        # Prefer a different key than the one that just failed, if possible
+        if exclude is not None and len(candidates) > 1:
+            candidates = [s for s in candidates if s is not exclude]
+        if not candidates:
+            return None, min(s.open_until for s in self.slots) - now
+        for slot in candidates:
+            slot.refill(now)
+        ready = [s for s in candidates if s.tokens >= 1]
+        if not ready:
+            return None, min(s.seconds_until_token() for s in candidates)
+        slot = min(ready, key=lambda s: (s.in_flight, -s.tokens))
+        slot.tokens -= 1
+        slot.in_flight += 1
+        slot.counters["requests"] += 1
+        return slot, 0.0
+
+    def _dispatch(self) -> None:
+        """Hand out tokens to waiters in lane order; when none is left, run again once the next is due."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while True:
+            lanes = [lane for lane in LANES if self._waiters[lane]]
+            if not lanes:
+                return
+            lane = min(lanes, key=lambda l: self._pass[l])
+            future, exclude = self._waiters[lane][0]
+            if future.done():
+                self._waiters[lane].popleft()
+                continue
+            slot, wait = self._take_token(exclude)
+            if slot is None:
+                self._timer = asyncio.get_running_loop().call_later(max(wait, 0.05), self._dispatch)
+                return
+            self._waiters[lane].popleft()
+            self._virtual_time = self._pass[lane]
+            self._pass[lane] += 1.0 / self.weights[lane]
+            future.set_result(slot)
+
+    async def acquire(self, exclude=None) -> GeminiKeySlot:
+        """Wait (in the current priority lane) for a token on the least-loaded key whose circuit is closed."""
+        if not self.slots:
+            raise NoGeminiKeyAvailable("No Gemini API key configured")
+        lane = current_priority()
+        if not self._waiters[lane]:
+            # A lane that was idle does not bank credit for the time it had nothing queued
+            self._pass[lane] = max(self._pass[lane], self._virtual_time)
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[lane].append((future, exclude))
+        self._dispatch()
+        try:
+            return await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just as we were cancelled: give the token back
+                slot = future.result()
+                slot.tokens += 1
+                slot.counters["requests"] -= 1
+                self.release(slot)
+            raise
+
+    def release(self, slot: GeminiKeySlot) -> None:
+        slot.in_flight -= 1
+        if any(self._waiters.values()):
+            # A half-open key may have finished its probe
+            self._dispatch()
+
+    async def call(self, fn, gate=None):
+        """
+        Run fn(client) in a worker thread on a pooled key, retrying retryable
+        errors with jittered exponential backoff on the next best key. `gate` is
+        an optional async context manager factory (the admission slot) entered
+        for each attempt once its token is granted.
+        """
+        last_slot = None
+        for attempt in range(self.max_retries + 1):
+            waiting_since = time.monotonic()
+            slot = await self.acquire(exclude=last_slot)
+            usage.add_queue_time(time.monotonic() - waiting_since)
+            usage.record(key=slot.name, retries=attempt)
+            try:
+                async with gate() if gate is not None else contextlib.nullcontext():
+                    start = time.monotonic()
+                    with observe("gemini_call", {"gemini.key": slot.name, "attempt": attempt}):
+                        result = await asyncio.to_thread(fn, slot.client)
+                slot.record_success(time.monotonic() - start)
+                usage.record(generation_seconds=time.monotonic() - start)
+                return result
+            except Exception as e:
+                left = remaining()
+                if left is not None and left <= 0 and is_retryable(e):
+                    # The HTTP timeout hit the request deadline: not the key's fault
+                    raise DeadlineExceeded(f"Gemini call on {slot.name} did not finish before the deadline") from e
+                slot.record_failure(e, time.monotonic())
+                if not is_retryable(e) or attempt == self.max_retries:
+                    raise
+                delay = backoff_delay(attempt)
+                left = remaining()
+                if left is not None and delay >= left:
+                    # The request deadline would pass before the retry could even start
+                    raise
+                slot.counters["retries"] += 1
+                last_slot = slot
+                print(f"Gemini call failed on {slot.name} ({e}); retrying in {delay:.1f}s")
+            finally:
+                self.release(slot)
+            await asyncio.sleep(delay)
+
+    def seconds_until_available(self):
+        """None while some key's circuit is closed or probing, else seconds until the first one reopens."""
+        if not self.slots:
+            return GEMINI_BREAKER_COOLDOWN
+        now = time.monotonic()
+        if any(slot.cooled_down(now) for slot in self.slots):
+            return None
+        return min(slot.open_until for slot in self.slots) - now
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {slot.name: slot.stats(now) for slot in self.slots}
+
+
+_pool = None
+
+
+def get_gemini_pool() -> GeminiKeyPool:
+    """Process-wide pool built lazily from the environment."""
+    global _pool
+    if _pool is None:
+        _pool = GeminiKeyPool(load_api_keys())
+    return _pool
@@ -3,17 +3,22 @@ Grammar correction module using COEDIT T5 model.
 Fixes grammar errors in essay text and returns corrected text.
 """
 
+import asyncio
 import re
 import difflib
 import torch
 from transformers import AutoTokenizer, T5ForConditionalGeneration
+from deadline import check_deadline
+from metrics import observe
+import profiling
 
 # ===========================
 # Initialize Model & Tokenizer
 # ===========================
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-tokenizer = AutoTokenizer.from_pretrained("grammarly/coedit-large")
-model = T5ForConditionalGeneration.from_pretrained("grammarly/coedit-large").to(device)
+COEDIT_MODEL_ID = "grammarly/coedit-large"
+tokenizer = AutoTokenizer.from_pretrained(COEDIT_MODEL_ID)
+model = T5ForConditionalGeneration.from_pretrained(COEDIT_MODEL_ID).to(device)
 print(f"✅ COEDIT Model loaded. Running on device: {device}")
 
 
@@ -70,27 +75,27 @@ def split_text_into_chunks(text: str, max_tokens: int = 64) -> list:
     return chunks
 
 
-def process_document(text: str, max_tokens: int = 64) -> str:
+def iter_process_document(text: str, max_tokens: int = 64):
     """
-    Process document and return corrected text.
+    Correct a document paragraph by paragraph.
     
-    Preserves paragraph structure (blank lines) and fixes grammar per chunk.
+    Yields each corrected paragraph (and each paragraph separator, unchanged)
+    as soon as it is ready, so callers can stream partial results.
     
     Args:
         text: Document text to process
         max_tokens: Maximum tokens per chunk for processing
         
-    Returns:
-        Corrected document text
+    Yields:
+        Corrected segments; "".join() of them is the corrected document
     """
     # Split by paragraph separators (double newlines)
     segments = re.split(r'(\n\s*\n)', text)
-    corrected_segments = []
     
     for segment in segments:
         # Keep paragraph separators as-is
         if re.fullmatch(r'\n\s*\n', segment):
-            corrected_segments.append(segment)
+            yield segment
             continue
         
         # Process text segment
@@ -99,23 +104,42 @@ def process_document(text: str, max_tokens: int = 64) -> str:
             continue
         
         # Check if needs chunking
-        tokens = tokenizer.tokenize(text_segment)
-        if len(tokens) > max_tokens:
-            chunks = split_text_into_chunks(text_segment, max_tokens)
-        else:
-            chunks = [text_segment]
+        with observe("coedit_tokenization") as span:
+            tokens = tokenizer.tokenize(text_segment)
+            if len(tokens) > max_tokens:
+                chunks = split_text_into_chunks(text_segment, max_tokens)
+            else:
+                chunks = [text_segment]
+            span.set_attribute("paragraph.tokens", len(tokens))
+            span.set_attribute("chunks", len(chunks))
         
         # Fix grammar for each chunk
         corrected_chunks = []
         for chunk in chunks:
-            corrected_chunk = fix_grammar(chunk)
+            # Stop early once the request deadline is spent; nobody will read the result
+            check_deadline("Grammar correction")
+            with observe("coedit_chunk", {"model": COEDIT_MODEL_ID, "batch_size": 1}):
+                corrected_chunk = fix_grammar(chunk)
             corrected_chunks.append(corrected_chunk)
         
         # Join chunks with space
-        corrected_text = " ".join(corrected_chunks)
-        corrected_segments.append(corrected_text)
+        yield " ".join(corrected_chunks)
+
+
+def process_document(text: str, max_tokens: int = 64) -> str:
+    """
+    Process document and return corrected text.
+    
+    Preserves paragraph structure (blank lines) and fixes grammar per chunk.
     
-    return "".join(corrected_segments)
+    Args:
+        text: Document text to process
+        max_tokens: Maximum tokens per chunk for processing
+        
+    Returns:
+        Corrected document text
+    """
+    return "".join(iter_process_document(text, max_tokens))
 
 
 # ===========================
@@ -250,6 +274,14 @@ def wrap_corrected_with_html(text: str) -> str:
 
 
 async def get_annotated_fixed_essay(answer: str) -> dict:
+    """
+    Async wrapper around annotate_essay; the model runs in a worker thread
+    so the event loop stays free.
+    """
+    return await asyncio.to_thread(profiling.profiled(annotate_essay), answer)
+
+
+def annotate_essay(answer: str) -> dict:
     """
     Correct grammar in the essay and return both error+fix view and fixed-only view.
     
@@ -272,6 +304,20 @@ async def get_annotated_fixed_essay(answer: str) -> dict:
     original_text = answer.strip()
     corrected_text = process_document(original_text, max_tokens=64)
     
+    return build_annotated_result(original_text, corrected_text)
+
+
+def build_annotated_result(original_text: str, corrected_text: str) -> dict:
+    """
+    Build the get_annotated_fixed_essay result from original and corrected text.
+    
+    Args:
+        original_text: Stripped original essay
+        corrected_text: Corrected essay
+        
+    Returns:
+        Dictionary with 'corrected_text', 'with_errors' and 'fixed_only'
+    """
     # Generate different views
     html_with_errors = wrap_errors_and_fixes(original_text, corrected_text)
     html_fixed_only = wrap_only_fixes(corrected_text)
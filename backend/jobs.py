@@ -0,0 +1,238 @@
+"""
+MongoDB-backed job queue for long-running essay evaluations.
+Jobs are documents in the `jobs` collection. Workers in any backend replica
+claim queued jobs atomically with find_one_and_update, run the handler, store
+the result (or error) and optionally POST it to a webhook. Jobs left "running"
+by a crashed worker are re-queued once their heartbeat goes stale.
+
+Webhook URLs come from clients, so they must be http(s) and point at a public
+address (or a host in JOB_WEBHOOK_ALLOWED_HOSTS); they are checked on submit and
+resolved again before the POST.
+"""
+
+import asyncio
+import ipaddress
+import json
+import os
+import socket
+import time
+import traceback
+import uuid
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+import httpx
+from dotenv import load_dotenv
+from pymongo import ASCENDING, ReturnDocument
+
+load_dotenv()
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "15"))
+# A running job whose heartbeat is older than this is considered abandoned
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "2"))
+JOB_WEBHOOK_TIMEOUT = float(os.getenv("JOB_WEBHOOK_TIMEOUT", "10"))
+# Comma separated host names; when set, webhooks may only go to these hosts (internal ones included)
+JOB_WEBHOOK_ALLOWED_HOSTS = {h.strip().lower() for h in os.getenv("JOB_WEBHOOK_ALLOWED_HOSTS", "").split(",")
+                             if h.strip()}
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class InvalidWebhookURL(ValueError):
+    """The webhook URL is not http(s) or points at a private, loopback or link-local address."""
+
+
+async def check_webhook_url(url: str) -> None:
+    """Raise InvalidWebhookURL unless `url` may receive job results."""
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise InvalidWebhookURL("webhook_url must be an http or https URL")
+    host = parts.hostname.lower()
+    if JOB_WEBHOOK_ALLOWED_HOSTS:
+        if host not in JOB_WEBHOOK_ALLOWED_HOSTS:
+            raise InvalidWebhookURL(f"webhook host {host} is not allowed")
+        return
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (OSError, ValueError) as e:
+        raise InvalidWebhookURL(f"webhook host {host} cannot be resolved: {e}")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%", 1)[0])
+        if not address.is_global or address.is_multicast:
+            raise InvalidWebhookURL(f"webhook host {host} resolves to a non-public address")
+
+
+class JobQueue:
+    """
+    Persistent job queue. `handler` is an async callable taking the stored
+    request payload (dict) and returning a JSON-serializable result dict.
+    """
+
+    def __init__(self, collection, handler, workers: int = JOB_WORKERS):
+        self.collection = collection
+        self.handler = handler
+        self.workers = workers
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self._tasks = []
+        self._stopping = asyncio.Event()
+        self._wakeup = asyncio.Event()
+
+    def ensure_indexes(self) -> None:
+        self.collection.create_index("job_id", unique=True)
+        self.collection.create_index([("status", ASCENDING), ("created_at", ASCENDING)])
+
+    async def submit(self, payload: dict, webhook_url: str = None) -> dict:
+        now = utcnow()
+        job = {
+            "job_id": str(uuid.uuid4()),
+            "status": QUEUED,
+            "request": payload,
+            "webhook_url": webhook_url,
+            "attempts": 0,
+            "created_at": now,
+            "updated_at": now,
+        }
+        await asyncio.to_thread(self.collection.insert_one, dict(job))
+        self._wakeup.set()
+        return {"job_id": job["job_id"], "status": QUEUED, "created_at": now}
+
+    async def get(self, job_id: str):
+        return await asyncio.to_thread(self.collection.find_one, {"job_id": job_id}, {"_id": 0})
+
+    def _claim(self):
+        now = utcnow()
+        return self.collection.find_one_and_update(
+            {"status": QUEUED},
+            {
+                "$set": {"status": RUNNING, "worker": self.worker_id, "started_at": now, "heartbeat_at": now,
+                         "updated_at": now},
+                "$inc": {"attempts": 1},
+            },
+            sort=[("created_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def _requeue_stale(self) -> int:
+        """Return abandoned running jobs to the queue, or fail them after JOB_MAX_ATTEMPTS."""
+        cutoff = utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+        stale = {"status": RUNNING, "heartbeat_at": {"$lt": cutoff}}
+        self.collection.update_many(
+            {**stale, "attempts": {"$gte": JOB_MAX_ATTEMPTS}},
+            {"$set": {"status": FAILED, "error": "worker lost", "updated_at": utcnow()}},
+        )
+        result = self.collection.update_many(
+            stale, {"$set": {"status": QUEUED, "updated_at": utcnow()}, "$unset": {"worker": ""}}
+        )
+        return result.modified_count
+
+    async def _heartbeat(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_INTERVAL)
+            await asyncio.to_thread(
+                self.collection.update_one, {"job_id": job_id, "status": RUNNING},
+                {"$set": {"heartbeat_at": utcnow()}}
+            )
+
+    async def _finish(self, job: dict, update: dict) -> None:
+        update["updated_at"] = utcnow()
+        update["finished_at"] = update["updated_at"]
+        await asyncio.to_thread(self.collection.update_one, {"job_id": job["job_id"]}, {"$set": update})
+        if job.get("webhook_url"):
+            await self._notify(job["webhook_url"], {"job_id": job["job_id"], **update})
+
+    async def _notify(self, url: str, body: dict) -> None:
+        try:
+            # Resolved again: the name may point elsewhere by now
+            await check_webhook_url(url)
+        except InvalidWebhookURL as e:
+            print(f"Webhook {url} refused: {e}")
+            return
+        try:
+            async with httpx.AsyncClient(timeout=JOB_WEBHOOK_TIMEOUT) as client:
+                response = await client.post(
+                    url, content=json.dumps(body, default=str), headers={"Content-Type": "application/json"}
+                )
+                response.raise_for_status()
+        except Exception as e:
+            # A failing webhook never changes the job's outcome
+            print(f"Webhook {url} failed: {e}")
+
+    async def _run(self, job: dict) -> None:
+        heartbeat = asyncio.create_task(self._heartbeat(job["job_id"]))
+        start = time.monotonic()
+        try:
+            result = await self.handler(job["request"])
+            await self._finish(job, {"status": SUCCEEDED, "result": result,
+                                     "duration": round(time.monotonic() - start, 3)})
+        except Exception as e:
+            traceback.print_exc()
+            try:
+                await self._finish(job, {"status": FAILED, "error": str(e),
+                                         "duration": round(time.monotonic() - start, 3)})
+            except Exception as finish_error:
+                # Left "running": the reaper re-queues it once its heartbeat goes stale
+                print(f"Could not record the failure of job {job['job_id']}: {finish_error}")
+        finally:
+            heartbeat.cancel()
+
+    async def _worker(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                job = await asyncio.to_thread(self._claim)
+            except Exception as e:
+                print(f"Job claim failed: {e}")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._run(job)
+            except Exception as e:
+                # One bad job must not end this worker and shrink the pool
+                print(f"Job {job.get('job_id')} could not be completed: {e}")
+
+    async def _reaper(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                requeued = await asyncio.to_thread(self._requeue_stale)
+                if requeued:
+                    print(f"Re-queued {requeued} abandoned job(s)")
+                    self._wakeup.set()
+            except Exception as e:
+                print(f"Stale job check failed: {e}")
+            await asyncio.sleep(JOB_STALE_SECONDS / 2)
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._reaper()))
+
+    async def stop(self) -> None:
+        """Stop the workers and hand this worker's unfinished jobs back to the queue."""
+        self._stopping.set()
+        self._wakeup.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await asyncio.to_thread(
+            self.collection.update_many,
+            {"status": RUNNING, "worker": self.worker_id},
+            {"$set": {"status": QUEUED, "updated_at": utcnow()}, "$unset": {"worker": ""}},
+        )
+
+    def stats(self) -> dict:
+        counts = {s: self.collection.count_documents({"status": s}) for s in (QUEUED, RUNNING, SUCCEEDED, FAILED)}
+        return {"worker_id": self.worker_id, "workers": self.workers, **counts}
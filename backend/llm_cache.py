@@ -0,0 +1,127 @@
+"""
+Persistent LLM response cache.
+Content-addressed by (model, prompt, options): identical requests to Ollama or
+Gemini are answered from a local SQLite file instead of calling the model again.
+Entries expire after a TTL and the table is bounded to a maximum number of rows
+(least recently used entries are evicted first).
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+
+
+def make_cache_key(model: str, prompt, options: dict = None) -> str:
+    """sha256 over a canonical JSON encoding of the request."""
+    canonical = json.dumps(
+        {"model": model, "prompt": prompt, "options": options or {}},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """SQLite-backed key/value store with TTL, size bound and hit/miss counters."""
+
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl: float = LLM_CACHE_TTL,
+                 max_entries: int = LLM_CACHE_MAX_ENTRIES, enabled: bool = LLM_CACHE_ENABLED):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.counters = {"hits": 0, "misses": 0, "bypassed": 0, "writes": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        self._conn = None
+        if self.enabled:
+            # One connection shared by the worker threads, serialized by self._lock
+            self._conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            with self._conn as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    " key TEXT PRIMARY KEY,"
+                    " model TEXT,"
+                    " response TEXT NOT NULL,"
+                    " created_at REAL NOT NULL,"
+                    " last_access REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON responses(last_access)")
+
+    def get_sync(self, key: str):
+        now = time.time()
+        with self._lock, self._conn as conn:
+            row = conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.counters["misses"] += 1
+                return None
+            conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self.counters["hits"] += 1
+            return row[0]
+
+    def set_sync(self, key: str, model: str, response: str) -> None:
+        now = time.time()
+        with self._lock, self._conn as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, model, response, now, now),
+            )
+            self.counters["writes"] += 1
+            count = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            overflow = count - self.max_entries
+            if overflow > 0:
+                conn.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_access LIMIT ?)",
+                    (overflow,),
+                )
+                self.counters["evictions"] += overflow
+
+    async def get(self, key: str, use_cache: bool = True):
+        if not self.enabled or not use_cache:
+            self.counters["bypassed"] += 1
+            return None
+        return await asyncio.to_thread(self.get_sync, key)
+
+    async def set(self, key: str, model: str, response: str, use_cache: bool = True) -> None:
+        if not self.enabled or not use_cache:
+            return
+        await asyncio.to_thread(self.set_sync, key, model, response)
+
+    def stats(self) -> dict:
+        lookups = self.counters["hits"] + self.counters["misses"]
+        entries = None
+        if self.enabled:
+            with self._lock, self._conn as conn:
+                entries = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {
+            **self.counters,
+            "enabled": self.enabled,
+            "entries": entries,
+            "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else None,
+        }
+
+
+_cache = None
+
+
+def get_llm_cache() -> LLMResponseCache:
+    """Process-wide cache built lazily from the environment."""
+    global _cache
+    if _cache is None:
+        _cache = LLMResponseCache()
+    return _cache
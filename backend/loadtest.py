@@ -0,0 +1,234 @@
+"""
+Open-loop load generator for the evaluation API.
+Sends requests at a target rate (constant or Poisson arrivals) to a mix of
+/essay_process, /evaluate_essay and /grammar_correction for a fixed duration,
+then reports throughput, status codes and latency percentiles per endpoint,
+plus per-stage wall/queue time percentiles from the responses' metadata.pipeline.
+Pair with mock_llm.py to load-test without Gemini quota or an Ollama GPU.
+
+Usage:
+    python loadtest.py --rps 2 --duration 60
+    python loadtest.py --mix essay_process:3,grammar_correction:1 --rps 5 --essays essays.json --output report.json
+
+Requests send use_cache=false (unless --use-cache) so neither the LLM cache nor
+submission deduplication hides the work being measured.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter, defaultdict
+import httpx
+
+ENDPOINTS = ("essay_process", "evaluate_essay", "grammar_correction")
+
+SAMPLE_ESSAYS = [{
+    "question": "Some people believe that technology has made our lives more complicated. "
+                "To what extent do you agree or disagree?",
+    "answer": "In recent decades, technology has become an integral part of our daily lives. Some people argue "
+              "that it has made life more complicated, while others believe it has simplified many tasks. "
+              "In my opinion, although technology brings some new challenges, it has made our lives easier "
+              "overall.\n\nOn the one hand, technology can be overwhelming. People are expected to reply to "
+              "messages at all hours, and learning to use new devices and applications takes time. Older "
+              "people in particular often find it hard to keep up with constant updates.\n\nOn the other hand, "
+              "technology saves a great deal of time and effort. Online banking, shopping and communication "
+              "allow us to complete in minutes what once took hours. Furthermore, access to information has "
+              "never been easier, which helps students and workers alike.\n\nIn conclusion, while technology "
+              "can sometimes complicate our lives, its benefits clearly outweigh its drawbacks.",
+}]
+
+
+def parse_mix(spec: str) -> dict:
+    """"essay_process:3,grammar_correction:1" -> {endpoint: weight}"""
+    mix = {}
+    for item in spec.split(","):
+        name, _, weight = item.strip().partition(":")
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint {name!r}, expected one of {ENDPOINTS}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(values: list, p: float):
+    """Linear-interpolated percentile of an unsorted list (None when empty)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    low = int(k)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (k - low)
+
+
+def summarize(values: list) -> dict:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 4),
+        "p50": round(percentile(values, 50), 4),
+        "p95": round(percentile(values, 95), 4),
+        "p99": round(percentile(values, 99), 4),
+        "max": round(max(values), 4),
+    }
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.essays = SAMPLE_ESSAYS
+        if args.essays:
+            with open(args.essays, encoding="utf-8") as f:
+                self.essays = json.load(f)
+        self.results = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.dropped = 0
+
+    async def send(self, client: httpx.AsyncClient, endpoint: str, scheduled: float) -> None:
+        essay = random.choice(self.essays)
+        headers = {"X-Priority": self.args.priority} if self.args.priority else {}
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        start = time.perf_counter()
+        result = {"endpoint": endpoint, "lag": start - scheduled}
+        try:
+            if endpoint == "grammar_correction":
+                response = await client.post(f"/{endpoint}", params={"answer": essay["answer"]}, headers=headers)
+            else:
+                body = {"question": essay["question"], "answer": essay["answer"], "use_cache": self.args.use_cache}
+                if self.args.deadline:
+                    body["deadline_seconds"] = self.args.deadline
+                response = await client.post(f"/{endpoint}", json=body, headers=headers)
+            result["status"] = response.status_code
+            if response.status_code == 200:
+                data = response.json()
+                result["result_status"] = data.get("status", "complete")
+                result["stages"] = data.get("metadata", {}).get("pipeline", {}).get("stages", {})
+        except httpx.HTTPError as e:
+            result["status"] = type(e).__name__
+        finally:
+            self.in_flight -= 1
+        result["latency"] = time.perf_counter() - start
+        self.results.append(result)
+
+    async def run(self) -> dict:
+        args = self.args
+        names, weights = zip(*args.mix.items())
+        limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+        timeout = httpx.Timeout(args.timeout, connect=10.0)
+        tasks = []
+        async with httpx.AsyncClient(base_url=args.url, timeout=timeout, limits=limits) as client:
+            start = time.perf_counter()
+            next_at = start
+            while next_at - start < args.duration:
+                await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+                if self.in_flight >= args.max_in_flight:
+                    # The client is saturated; count it instead of queueing without bound
+                    self.dropped += 1
+                else:
+                    endpoint = random.choices(names, weights)[0]
+                    tasks.append(asyncio.create_task(self.send(client, endpoint, next_at)))
+                gap = random.expovariate(args.rps) if args.arrivals == "poisson" else 1.0 / args.rps
+                next_at += gap
+            sent_for = time.perf_counter() - start
+            await asyncio.gather(*tasks)
+            elapsed = time.perf_counter() - start
+            admission = None
+            try:
+                admission = (await client.get("/stats/admission")).json()
+            except (httpx.HTTPError, ValueError):
+                pass
+        return self.report(sent_for, elapsed, admission)
+
+    def report(self, sent_for: float, elapsed: float, admission) -> dict:
+        by_endpoint = defaultdict(list)
+        for result in self.results:
+            by_endpoint[result["endpoint"]].append(result)
+        endpoints = {}
+        for endpoint, results in by_endpoint.items():
+            ok = [r for r in results if r["status"] == 200]
+            stage_wall, stage_queue, stage_status = defaultdict(list), defaultdict(list), defaultdict(Counter)
+            for r in ok:
+                for stage, timing in r.get("stages", {}).items():
+                    stage_status[stage][timing.get("status")] += 1
+                    if "wall_time" in timing:
+                        stage_wall[stage].append(timing["wall_time"])
+                    if "queue_time" in timing:
+                        stage_queue[stage].append(timing["queue_time"])
+            endpoints[endpoint] = {
+                "requests": len(results),
+                "ok": len(ok),
+                "partial": sum(1 for r in ok if r.get("result_status") == "partial"),
+                "status_codes": dict(Counter(str(r["status"]) for r in results)),
+                "throughput_rps": round(len(ok) / elapsed, 3),
+                "latency": summarize([r["latency"] for r in ok]),
+                "stages": {
+                    stage: {"wall_time": summarize(stage_wall[stage]), "queue_time": summarize(stage_queue[stage]),
+                            "status": dict(stage_status[stage])}
+                    for stage in stage_status
+                },
+            }
+        return {
+            "config": {"url": self.args.url, "rps": self.args.rps, "duration": self.args.duration,
+                       "arrivals": self.args.arrivals, "mix": self.args.mix},
+            "sent": len(self.results),
+            "dropped_client_side": self.dropped,
+            "offered_rps": round(len(self.results) / sent_for, 3) if sent_for else None,
+            "elapsed": round(elapsed, 3),
+            "max_in_flight": self.max_in_flight,
+            "max_send_lag": round(max((r["lag"] for r in self.results), default=0.0), 4),
+            "endpoints": endpoints,
+            "admission": admission,
+        }
+
+
+def print_report(report: dict) -> None:
+    print(f"sent {report['sent']} requests in {report['elapsed']}s "
+          f"(offered {report['offered_rps']} rps, {report['dropped_client_side']} dropped client-side, "
+          f"max in flight {report['max_in_flight']})")
+    for endpoint, stats in report["endpoints"].items():
+        latency = stats["latency"]
+        print(f"\n/{endpoint}: {stats['ok']}/{stats['requests']} ok, {stats['partial']} partial, "
+              f"{stats['throughput_rps']} rps, status {stats['status_codes']}")
+        if latency["count"]:
+            print(f"  latency  p50={latency['p50']}s p95={latency['p95']}s p99={latency['p99']}s "
+                  f"max={latency['max']}s")
+        for stage, timing in stats["stages"].items():
+            wall, queue = timing["wall_time"], timing["queue_time"]
+            if wall["count"]:
+                print(f"  {stage:<24} wall p50={wall['p50']} p95={wall['p95']} p99={wall['p99']}"
+                      f"  queue p50={queue.get('p50')} p95={queue.get('p95')}  {timing['status']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--mix", type=parse_mix, default="essay_process:1",
+                        help="endpoint weights, e.g. essay_process:3,evaluate_essay:1,grammar_correction:1")
+    parser.add_argument("--rps", type=float, default=1.0, help="target request rate")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds of sending")
+    parser.add_argument("--arrivals", choices=("poisson", "constant"), default="poisson")
+    parser.add_argument("--max-in-flight", type=int, default=256)
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--essays", help="JSON list of {question, answer}")
+    parser.add_argument("--use-cache", action="store_true", help="let the LLM cache and deduplication answer")
+    parser.add_argument("--deadline", type=float, help="deadline_seconds sent with each request")
+    parser.add_argument("--priority", choices=("interactive", "bulk"))
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--output", help="write the full report as JSON")
+    args = parser.parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    report = asyncio.run(LoadTest(args).run())
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,51 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, ORJSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
+from typing import List, Optional
 import uvicorn
 import os
 from dotenv import load_dotenv
 from pymongo import MongoClient
 import asyncio
+import contextvars
+import weakref
+import orjson
 import uuid
+import time
+import hmac
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 # Import from our modules
-from mistral_model import get_feedback
-from grammar import get_annotated_fixed_essay
-from caculate_score import extract_scores, postprocess_feedback
+# BERT (bert_setup) and CoEdIT (grammar) are loaded through engines, per WORKER_ROLE
+from mistral_model import get_evaluation_mistral, get_constructive_feedback, parse_feedback_json, run_feedback_pipeline, FEEDBACK_KEYS, GEMINI_CALLS_PER_ESSAY
+from caculate_score import extract_scores, extract_available_scores, postprocess_feedback
+from gemini_pool import get_gemini_pool
+from llm_cache import get_llm_cache
+from ollama_pool import get_ollama_pool
+from jobs import InvalidWebhookURL, JobQueue, JOB_WORKERS, check_webhook_url
+from persistence import SessionWriter
+from sessions import ensure_indexes, get_session, list_sessions
+from dedup import SubmissionDeduplicator, content_hash, PIPELINE_VERSION
+from pipeline import Stage
+from deadline import DeadlineExceeded, REQUEST_DEADLINE_SECONDS, set_deadline, reset_deadline, remaining, timeout_for
+import admission
+import engines
+from compression import CompressionMiddleware
+import metrics
+import profiling
+import tracing
+import usage
+from starlette.routing import Match
+from admission import Overloaded, admit, get_limiter, set_priority, reset_priority, parse_priority, BULK
 load_dotenv()
 
 OLLAMA_GEN_ENDPOINT = os.getenv("OLLAMA_GEN_ENDPOINT")
 OLLAMA_CHAT_ENDPOINT = os.getenv("OLLAMA_CHAT_ENDPOINT")
 MONGO_URI = os.getenv("MONGO_URI")
 PORT = int(os.getenv("PORT", 8000))
+OLLAMA_PRELOAD = os.getenv("OLLAMA_PRELOAD", "1") == "1"
+# Shared secret for the /admin endpoints (profiling); they stay closed while unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 # async def get_evaluation_mistral(overall_score: float, question: str , answer: str, client) -> str:
 #     """Get detailed evaluation feedback from Mistral model via Ollama."""
 #     evaluation_prompt = await PromptMistral(band=overall_score, question=question, essay=answer)
@@ -61,12 +90,180 @@ annotation = db.annotations
 class EssayEvaluationRequest(BaseModel):
     question: str
     answer: str
+    use_cache: bool = True
+    user_id: Optional[str] = None
+    # Time budget for the whole request; stages still running when it runs out are dropped
+    deadline_seconds: Optional[float] = None
+
+# Response models document the endpoints; handlers return ORJSONResponse directly, so results
+# built by the pipeline are serialized once by orjson instead of being re-validated by FastAPI
+class GrammarCorrectionResponse(BaseModel):
+    corrected_text: Optional[str] = None
+    with_errors: Optional[str] = None
+    fixed_only: Optional[str] = None
+
+class EvaluationResponse(BaseModel):
+    status: str = "complete"
+    stage_status: dict = {}
+    detailed_feedback: dict
+    overall_criteria_scores: dict
+    metadata: dict = {}
+
+class EssayProcessResponse(EvaluationResponse, GrammarCorrectionResponse):
+    session_id: str
+    deduplicated: bool = False
+
+class EssayJobRequest(EssayEvaluationRequest):
+    webhook_url: Optional[str] = None
+
+class ScoreRequest(BaseModel):
+    question: str
+    answer: str
+
+class ProfileRequest(BaseModel):
+    modes: List[str] = ["cprofile"]
+    requests: Optional[int] = None
+    seconds: Optional[float] = None
+    memory: bool = False
+    interval: float = profiling.SAMPLE_INTERVAL
+
+# Admission-controlled stages each endpoint uses, with the slots one request takes in each
+FEEDBACK_STAGES = {"bert": 1, "ollama": 1, "gemini": GEMINI_CALLS_PER_ESSAY}
+ESSAY_STAGES = {**FEEDBACK_STAGES, "grammar": 1}
+# Engines (local or on a remote replica) each endpoint needs, see engines.py
+FEEDBACK_ENGINES = ("scoring", "llm")
+ESSAY_ENGINES = FEEDBACK_ENGINES + ("grammar",)
+
+async def run_essay_job(payload: dict) -> dict:
+    """Job handler: the /essay_process pipeline on a stored request."""
+    payload = dict(payload)
+    # Jobs run in the bulk lane unless submitted with X-Priority: interactive
+    token = set_priority(payload.pop("priority", BULK))
+    try:
+        # The job's trace continues the one of the request that submitted it
+        with tracing.span("job essay_process", parent=payload.pop("traceparent", None)):
+            # Queued jobs wait for room instead of being rejected
+            while True:
+                try:
+                    reservation = admit(ESSAY_STAGES)
+                    break
+                except Overloaded as e:
+                    await asyncio.sleep(e.retry_after)
+            with reservation:
+                return await run_essay_process(EssayEvaluationRequest(**payload))
+    finally:
+        reset_priority(token)
+
+# Background workers claim jobs from MongoDB, so queued work survives restarts and spreads over replicas
+job_queue = JobQueue(db.jobs, run_essay_job)
+# Evaluation/grammar documents go through the async driver (optionally write-behind batched)
+session_writer = SessionWriter(MONGO_URI)
+# Identical submissions share one computation / the stored result
+deduplicator = SubmissionDeduplicator(session_writer.db.submissions)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load and pin the Mistral model in the background so the first essay does not pay for it
+    preload_task = asyncio.create_task(get_ollama_pool().preload()) \
+        if OLLAMA_PRELOAD and engines.serves("llm") else None
+    # Only this replica's models (WORKER_ROLE), in parallel with the index creation below
+    models_task = asyncio.create_task(engines.load_role())
+    with engines.phase("indexes"):
+        try:
+            await asyncio.to_thread(job_queue.ensure_indexes)
+            await ensure_indexes(session_writer.db)
+            await deduplicator.ensure_indexes()
+            await usage.ensure_indexes(session_writer.db)
+        except Exception as e:
+            print(f"Failed to create indexes: {e}")
+    await models_task
+    session_writer.start()
+    # Jobs run the whole /essay_process pipeline; replicas that cannot serve it leave them to others
+    serves_jobs = all(engines.available(engine) for engine in ESSAY_ENGINES)
+    if JOB_WORKERS > 0 and serves_jobs:
+        job_queue.start()
+    engines.mark_ready()
+    yield
+    await job_queue.stop()
+    # Flush buffered documents and spans before the process exits
+    await session_writer.stop()
+    await engines.close()
+    await asyncio.to_thread(tracing.shutdown)
+    if profiling.active():
+        profiling.stop()
+    if preload_task and not preload_task.done():
+        preload_task.cancel()
 
 app = FastAPI(
     title="IELTS Writing Task 2 Evaluation API",
     description="API for evaluating IELTS Writing Task 2 essays using BERT and Mistral models",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
+# Large JSON/HTML responses are sent brotli or gzip compressed when the client accepts it
+app.add_middleware(CompressionMiddleware)
+
+@app.middleware("http")
+async def priority_lane(request: Request, call_next):
+    """X-Priority: interactive|bulk picks the scheduling lane for the request's stages (default interactive)."""
+    token = set_priority(parse_priority(request.headers.get("x-priority")))
+    try:
+        return await call_next(request)
+    finally:
+        reset_priority(token)
+
+# Requests that count toward a profiling session's "next N requests"; health checks,
+# metrics scrapes and stats calls would otherwise end it before any essay work ran
+PROFILED_ENDPOINTS = {"/essay_process", "/essay_process/stream", "/evaluate_essay", "/grammar_correction", "/score"}
+
+def route_template(request: Request) -> str:
+    """Path template of the matching route (/sessions/{session_id}), keeping metric labels bounded."""
+    for route in app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+@app.middleware("http")
+async def http_metrics(request: Request, call_next):
+    """Request metrics, plus the root trace span (continuing an incoming traceparent header)."""
+    endpoint = route_template(request)
+    in_flight = metrics.HTTP_IN_FLIGHT.labels(request.method, endpoint)
+    in_flight.inc()
+    start = time.perf_counter()
+    status = 500
+    try:
+        with tracing.span(f"{request.method} {endpoint}", {"http.method": request.method, "http.route": endpoint},
+                          parent=request.headers.get("traceparent")) as span:
+            response = await call_next(request)
+            status = response.status_code
+            span.set_attribute("http.status_code", status)
+            response.headers["traceparent"] = span.traceparent
+            response.headers["X-Trace-Id"] = span.trace_id
+        return response
+    finally:
+        in_flight.dec()
+        if endpoint in PROFILED_ENDPOINTS:
+            profiling.request_finished()
+        metrics.HTTP_LATENCY.labels(request.method, endpoint).observe(time.perf_counter() - start)
+        metrics.HTTP_REQUESTS.labels(request.method, endpoint, str(status)).inc()
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request, exc: Overloaded):
+    """A full stage queue answers 429, an unavailable backend 503, both with Retry-After."""
+    metrics.record_error(f"admission:{exc.stage}", f"http_{exc.status_code}")
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc), "stage": exc.stage, "retry_after": exc.retry_after},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_handler(request, exc: DeadlineExceeded):
+    """Work that could not even start or finish a partial result within the request deadline."""
+    metrics.record_error("deadline", "http_504")
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
 
 @app.get("/")
 async def root():
@@ -83,77 +280,470 @@ async def liveness_check():
 @app.get("/version")
 async def version_check():
     return {"version": "1.0.0"}
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus scrape endpoint."""
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+@app.get("/stats/tracing")
+async def tracing_stats():
+    """Span exporter in use and its exported/dropped counters."""
+    return tracing.stats()
+@app.get("/stats/gemini")
+async def gemini_stats():
+    """Per-key Gemini counters (requests, retries, rate limits, breaker state)."""
+    require_engines("llm")
+    return get_gemini_pool().stats()
+@app.get("/stats/cache")
+async def cache_stats():
+    """LLM response cache hit rate and size."""
+    return get_llm_cache().stats()
+@app.get("/stats/ollama")
+async def ollama_stats():
+    """Health-check every Ollama replica; returns queue depth, slots, load events and routing counters."""
+    require_engines("llm")
+    return await get_ollama_pool().check_all()
+@app.get("/stats/admission")
+async def admission_stats():
+    """Per-stage concurrency, queue depth, rejections and observed service time."""
+    return admission.stats()
+@app.get("/stats/startup")
+async def startup_stats():
+    """Worker role and the startup time breakdown: server, app import, framework imports, each model, indexes."""
+    return engines.startup_report()
+
+def require_engines(*names: str, local: bool = False):
+    """Endpoints needing an engine this replica neither runs (WORKER_ROLE) nor reaches remotely are 404."""
+    missing = [name for name in names if not (engines.serves(name) if local else engines.available(name))]
+    if missing:
+        raise HTTPException(status_code=404,
+                            detail=f"Not served by this replica (WORKER_ROLE={engines.WORKER_ROLE}, needs {missing})")
+
+def require_admin(x_admin_token: Optional[str]):
+    """Admin endpoints exist only with PROFILING_ENABLED and need X-Admin-Token == ADMIN_TOKEN."""
+    if not profiling.PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not ADMIN_TOKEN or not hmac.compare_digest(x_admin_token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@app.post("/admin/profiling/start", include_in_schema=False)
+async def start_profiling(request: ProfileRequest, x_admin_token: Optional[str] = Header(None)):
+    """Profile the next `requests` requests and/or a `seconds` window."""
+    require_admin(x_admin_token)
+    try:
+        return profiling.start(request.modes, request.requests, request.seconds, request.memory, request.interval)
+    except profiling.ProfilingError as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
+@app.post("/admin/profiling/stop", include_in_schema=False)
+async def stop_profiling(x_admin_token: Optional[str] = Header(None)):
+    require_admin(x_admin_token)
+    try:
+        return profiling.stop()
+    except profiling.ProfilingError as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
+@app.get("/admin/profiling", include_in_schema=False)
+async def profiling_status(x_admin_token: Optional[str] = Header(None)):
+    require_admin(x_admin_token)
+    return profiling.status()
 
-@app.post("/evaluate_essay")
+@app.get("/admin/profiling/artifacts/{name}", include_in_schema=False)
+async def download_profile(name: str, x_admin_token: Optional[str] = Header(None)):
+    """.prof / .folded / .tracemalloc / -top.txt / -memory.json files of finished sessions."""
+    require_admin(x_admin_token)
+    path = profiling.artifact_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Artifact not found")
+    return FileResponse(path, filename=name, media_type="application/octet-stream")
+
+
+
+@app.post("/score")
+async def score_essay(request: ScoreRequest):
+    """BERT overall band only; what llm replicas call on a scoring replica (SCORING_URL)."""
+    require_engines("scoring", local=True)
+    with admit(("bert",)):
+        trace_essay(request.answer)
+        async with get_limiter("bert").slot():
+            overall_score = await asyncio.to_thread(
+                profiling.profiled(engines.scoring().get_overall_score), request.question, request.answer)
+    return {"overall_score": float(overall_score)}
+
+@app.post("/evaluate_essay", response_model=EvaluationResponse)
 async def evaluate_essay(request: EssayEvaluationRequest):    
-    # Get detailed feedback from Mistral model
-    detailed_feedback = await get_feedback(request.question, request.answer)
-    overall_criteria_scores = extract_scores(detailed_feedback)
+    require_engines(*FEEDBACK_ENGINES)
+    reservation = admit(FEEDBACK_STAGES)
+    trace_essay(request.answer)
+    # Get detailed feedback from Mistral model; whatever is finished when the deadline hits is returned
+    token = set_deadline(request.deadline_seconds or REQUEST_DEADLINE_SECONDS)
+    try:
+        # No session is stored for this endpoint; its LLM calls are kept with session_id null
+        with reservation:
+            async with usage.ledger(session_writer, user_id=request.user_id):
+                results, timings = await run_feedback_pipeline(
+                    request.question, request.answer, request.use_cache, partial=True
+                )
+    finally:
+        reset_deadline(token)
+    detailed_feedback = {key: results[key] for key in FEEDBACK_KEYS if key in results}
+    overall_criteria_scores = extract_available_scores(detailed_feedback)
     detailed_feedback = postprocess_feedback(detailed_feedback)
 
-    return {
+    return ORJSONResponse({
+        "status": timings["status"],
+        "stage_status": stage_status(timings),
         "detailed_feedback": detailed_feedback,
-        "overall_criteria_scores": overall_criteria_scores
-    }
+        "overall_criteria_scores": overall_criteria_scores,
+        "metadata": {"pipeline": timings}
+    })
+
+def trace_essay(answer: str) -> None:
+    """Essay size and pipeline version on the request's trace span."""
+    tracing.set_attribute("essay.words", len(answer.split()))
+    tracing.set_attribute("essay.chars", len(answer))
+    tracing.set_attribute("pipeline.version", PIPELINE_VERSION)
+
+def stage_status(timings: dict) -> dict:
+    """Per-stage flags: ok, timeout, skipped (an input timed out), failed or cancelled."""
+    return {name: stage.get("status") for name, stage in timings["stages"].items()}
 
-@app.post("/grammar_correction")
+@app.post("/grammar_correction", response_model=GrammarCorrectionResponse)
 async def grammar_correction(answer: str):
     """Get grammar corrections with error and fix highlights."""
-    result = await get_annotated_fixed_essay(answer)
-    return {
+    require_engines("grammar", local=True)
+    reservation = admit(("grammar",))
+    trace_essay(answer)
+    token = set_deadline(REQUEST_DEADLINE_SECONDS)
+    try:
+        with reservation:
+            async with get_limiter("grammar").slot():
+                result = await asyncio.wait_for(engines.grammar().get_annotated_fixed_essay(answer),
+                                                timeout_for(REQUEST_DEADLINE_SECONDS))
+    except (asyncio.TimeoutError, DeadlineExceeded):
+        raise HTTPException(status_code=504, detail="Grammar correction did not finish before the deadline")
+    finally:
+        reset_deadline(token)
+    return ORJSONResponse({
         "corrected_text": result['corrected_text'],
         "with_errors": result['with_errors'],
         "fixed_only": result['fixed_only']
-    }
+    })
 
-@app.post("/essay_process")
+@app.post("/essay_process", response_model=EssayProcessResponse)
 async def essay_process(request: EssayEvaluationRequest):
     """
     Combined endpoint to run evaluation and grammar correction in one session.
     Stores all results under a shared session_id.
     """
+    require_engines(*ESSAY_ENGINES)
+    with admit(ESSAY_STAGES):
+        return ORJSONResponse(await run_essay_process(request))
+
+@app.post("/jobs/essay_process", status_code=202)
+async def submit_essay_job(request: EssayJobRequest, x_priority: Optional[str] = Header(None)):
+    """
+    Queue an /essay_process run and return its job id immediately.
+    Poll GET /jobs/{job_id}, or pass webhook_url to receive the finished job by POST.
+    Jobs run in the bulk lane unless X-Priority: interactive is sent.
+    """
+    require_engines(*ESSAY_ENGINES)
+    if request.webhook_url:
+        try:
+            await check_webhook_url(request.webhook_url)
+        except InvalidWebhookURL as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    payload = request.model_dump(exclude={"webhook_url"})
+    payload["priority"] = parse_priority(x_priority, BULK)
+    payload["traceparent"] = tracing.traceparent()
+    return await job_queue.submit(payload, request.webhook_url)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Job status (queued, running, succeeded, failed) with the result or error once finished."""
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/sessions/{session_id}")
+async def read_session(session_id: str):
+    """Stored result of a past /essay_process run, without recomputing it."""
+    session = await get_session(session_writer.db, session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return session
+
+@app.get("/sessions")
+async def session_history(user_id: Optional[str] = None, limit: int = 20, cursor: Optional[str] = None):
+    """Newest-first session summaries; pass next_cursor back as cursor for the next page."""
+    try:
+        return await list_sessions(session_writer.db, user_id, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.get("/users/{user_id}/sessions")
+async def user_session_history(user_id: str, limit: int = 20, cursor: Optional[str] = None):
+    return await session_history(user_id, limit, cursor)
+
+@app.get("/sessions/{session_id}/llm_usage")
+async def read_session_usage(session_id: str):
+    """Every LLM call of a session (model, key, tokens, tokens/sec, queue time, latency, retries, cache hit) with totals."""
+    result = await usage.session_usage(session_writer.db, session_id)
+    if not result["calls"]:
+        raise HTTPException(status_code=404, detail="No LLM usage recorded for this session")
+    return result
+
+@app.get("/stats/llm_usage")
+async def llm_usage_trends(days: int = 7, bucket: str = "day", group_by: str = "model", purpose: Optional[str] = None):
+    """Cost and throughput per time bucket, grouped by model, purpose, provider, key or pipeline_version."""
+    try:
+        return await usage.usage_trends(session_writer.db, days, bucket, group_by, purpose)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/stats/dedup")
+async def dedup_stats():
+    return deduplicator.stats()
+
+@app.get("/stats/persistence")
+async def persistence_stats():
+    """Write-behind buffer depth and insert counters."""
+    return session_writer.stats()
+
+@app.get("/stats/jobs")
+async def job_stats():
+    return await asyncio.to_thread(job_queue.stats)
+
+@app.post("/essay_process/stream")
+async def essay_process_stream(request: EssayEvaluationRequest, paragraphs: bool = True):
+    """
+    Server-Sent Events variant of /essay_process. Emits events as each stage finishes:
+    score, grammar_paragraph (if paragraphs=true), grammar, evaluation_feedback,
+    constructive_feedback, then done (with session_id and overall_criteria_scores).
+    A failing stage emits an error event and ends the stream.
+    """
+    require_engines(*ESSAY_ENGINES)
+    reservation = admit(ESSAY_STAGES)
+    events = essay_process_events(request, paragraphs, reservation)
+    # The stream holds the reservation while it runs; a stream that never starts gives it back when collected
+    weakref.finalize(events, reservation.release)
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {orjson.dumps(data, default=str).decode()}\n\n"
+
+async def essay_process_events(request: EssayEvaluationRequest, paragraphs: bool = True,
+                               reservation: admission.Reservation = None):
     session_id = str(uuid.uuid4())
-    #get now
     now = datetime.now(timezone.utc)
-    # Get detailed feedback from Mistral model and grammar corrections
-    detailed_feedback = get_feedback(request.question, request.answer)
-    grammar_result = get_annotated_fixed_essay(request.answer)
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
 
-    feedback, grammar_data = await asyncio.gather(detailed_feedback, grammar_result)
-    overall_criteria_scores = extract_scores(feedback)
-    feedback = postprocess_feedback(feedback)
+    def run_grammar():
+        # Runs in a worker thread; paragraphs are handed to the event loop as they finish
+        original_text = request.answer.strip()
+        if not original_text:
+            return {'corrected_text': '', 'with_errors': '', 'fixed_only': ''}
+        grammar = engines.grammar()
+        corrected_segments = []
+        # Segments alternate with their separators; only real paragraphs are numbered
+        index = 0
+        for segment in grammar.iter_process_document(original_text, max_tokens=64):
+            corrected_segments.append(segment)
+            if paragraphs and segment.strip():
+                loop.call_soon_threadsafe(
+                    events.put_nowait, ("grammar_paragraph", {"index": index, "corrected_text": segment})
+                )
+                index += 1
+        return grammar.build_annotated_result(original_text, "".join(corrected_segments))
 
-    # Store evaluation results in MongoDB
-    evaluations_collection.insert_one({
-        "session_id": session_id,
-        "question": request.question,
-        "answer": request.answer,
-        "detailed_feedback": feedback,
-        "overall_criteria_scores": overall_criteria_scores,
-        "created_at": now
-    })
-    
-    # Store grammar correction results in MongoDB
-    annotation_collection = db.grammar_corrections
-    annotation_collection.insert_one({
+    async def grammar_stage():
+        async with get_limiter("grammar").slot():
+            if engines.serves("grammar"):
+                grammar_data = await asyncio.to_thread(profiling.profiled(run_grammar))
+            else:
+                # A grammar replica answers in one piece: no grammar_paragraph events
+                grammar_data = await engines.remote_annotate(request.answer)
+        await events.put(("grammar", grammar_data))
+        return grammar_data
+
+    async def feedback_stage():
+        async with get_limiter("bert").slot():
+            if engines.serves("scoring"):
+                overall_score = float(await asyncio.to_thread(
+                    profiling.profiled(engines.scoring().get_overall_score), request.question, request.answer))
+            else:
+                overall_score = await engines.remote_score(request.question, request.answer)
+        await events.put(("score", {"overall_score": overall_score}))
+        pool = get_gemini_pool()
+
+        async def evaluation():
+            text = await get_evaluation_mistral(overall_score, request.question, request.answer, pool, request.use_cache)
+            parsed = parse_feedback_json(text, "Evaluation")
+            await events.put(("evaluation_feedback", parsed))
+            return parsed
+
+        async def constructive():
+            text = await get_constructive_feedback(overall_score, request.question, request.answer, pool, request.use_cache)
+            parsed = parse_feedback_json(text, "Constructive")
+            await events.put(("constructive_feedback", parsed))
+            return parsed
+
+        evaluation_feedback, constructive_feedback = await asyncio.gather(evaluation(), constructive())
+        return {
+            "overall_score": overall_score,
+            "evaluation_feedback": evaluation_feedback,
+            "constructive_feedback": constructive_feedback
+        }
+
+    # LLM calls of both stages go to the usage ledger under this session
+    async with usage.ledger(session_writer, session_id, request.user_id):
+        # The stages run under the request deadline; the generator's own context is left alone
+        context = contextvars.copy_context()
+        context.run(set_deadline, request.deadline_seconds or REQUEST_DEADLINE_SECONDS)
+        if reservation is not None:
+            context.run(reservation.activate)
+        tasks = [asyncio.create_task(feedback_stage(), context=context),
+                 asyncio.create_task(grammar_stage(), context=context)]
+        stages = asyncio.gather(*tasks)
+        stages.add_done_callback(lambda _: events.put_nowait(None))
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(events.get(), context.run(remaining))
+                except asyncio.TimeoutError:
+                    raise DeadlineExceeded("Essay processing did not finish before the deadline")
+                if item is None:
+                    break
+                yield sse_event(*item)
+            feedback, grammar_data = stages.result()
+            overall_criteria_scores = extract_scores(feedback)
+            feedback = postprocess_feedback(feedback)
+            await store_session(session_id, now, request, feedback, overall_criteria_scores, grammar_data)
+            yield sse_event("done", {"session_id": session_id, "overall_criteria_scores": overall_criteria_scores})
+        except Exception as e:
+            yield sse_event("error", {"session_id": session_id, "detail": str(e)})
+        finally:
+            # Client disconnected or a stage failed: stop the work nobody will read
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            # After an error, deadline or disconnect nobody reads the gathered result: retrieve its exception
+            stages.add_done_callback(lambda future: future.cancelled() or future.exception())
+            if reservation is not None:
+                reservation.release()
+
+async def run_essay_process(request: EssayEvaluationRequest) -> dict:
+    """
+    /essay_process pipeline with submission deduplication: identical (question, answer)
+    requests coalesce onto one run or get the stored result. use_cache=false always recomputes.
+    The request deadline also bounds waiting for an identical run on another replica.
+    """
+    token = set_deadline(request.deadline_seconds or REQUEST_DEADLINE_SECONDS)
+    try:
+        if not request.use_cache:
+            return await compute_essay_process(request)
+        key = content_hash(request.question, request.answer, user_id=request.user_id)
+        return await deduplicator.run(key, lambda: compute_essay_process(request), load_essay_process)
+    finally:
+        reset_deadline(token)
+
+async def load_essay_process(session_id: str):
+    """A stored session in the /essay_process response shape (for deduplicated hits); None if missing."""
+    session = await get_session(session_writer.db, session_id)
+    if session is None:
+        return None
+    return {
         "session_id": session_id,
-        "original_text": request.answer,
-        "corrected_text": grammar_data['corrected_text'],
-        "with_errors": grammar_data['with_errors'],
-        "fixed_only": grammar_data['fixed_only'],
-        "created_at": now
-    })
-    
+        "status": session.get("status", "complete"),
+        "stage_status": session.get("stage_status", {}),
+        "detailed_feedback": session.get("detailed_feedback", {}),
+        "overall_criteria_scores": session.get("overall_criteria_scores", {}),
+        "corrected_text": session.get("corrected_text"),
+        "with_errors": session.get("with_errors"),
+        "fixed_only": session.get("fixed_only"),
+        # Nothing ran for this request; report when the reused result was computed
+        "metadata": {"computed_at": session.get("created_at")},
+    }
+
+def grammar_stage() -> Stage:
+    """The grammar pipeline stage: CoEdIT on the CPU pool, or the grammar replica (GRAMMAR_URL)."""
+    if engines.serves("grammar"):
+        return Stage("grammar", engines.grammar().annotate_essay, ["answer"], executor="cpu",
+                     limiter=get_limiter("grammar"))
+    return Stage("grammar", engines.remote_annotate, ["answer"], limiter=get_limiter("grammar"))
+
+async def compute_essay_process(request: EssayEvaluationRequest) -> dict:
+    trace_essay(request.answer)
+    session_id = str(uuid.uuid4())
+    #get now
+    now = datetime.now(timezone.utc)
+    # Feedback stages and grammar correction run as one DAG; grammar only needs the answer.
+    # Stages still running at the deadline (set by run_essay_process) or failing are dropped
+    # and the finished ones returned.
+    async with usage.ledger(session_writer, session_id, request.user_id):
+        results, timings = await run_feedback_pipeline(
+            request.question, request.answer, request.use_cache,
+            extra_stages=[grammar_stage()],
+            partial=True
+        )
+    feedback = {key: results[key] for key in FEEDBACK_KEYS if key in results}
+    grammar_data = results.get("grammar")
+    overall_criteria_scores = extract_available_scores(feedback)
+    feedback = postprocess_feedback(feedback)
+    await store_session(session_id, now, request, feedback, overall_criteria_scores, grammar_data,
+                        timings["status"], stage_status(timings))
+
     return {
         "session_id": session_id,
+        "status": timings["status"],
+        "stage_status": stage_status(timings),
         "detailed_feedback": feedback,
         "overall_criteria_scores": overall_criteria_scores,
-        "corrected_text": grammar_data['corrected_text'],
-        "with_errors": grammar_data['with_errors'],
-        "fixed_only": grammar_data['fixed_only']
+        "corrected_text": grammar_data['corrected_text'] if grammar_data else None,
+        "with_errors": grammar_data['with_errors'] if grammar_data else None,
+        "fixed_only": grammar_data['fixed_only'] if grammar_data else None,
+        "metadata": {"pipeline": timings}
     }
 
+async def store_session(session_id: str, now: datetime, request: EssayEvaluationRequest, feedback: dict,
+                        overall_criteria_scores: dict, grammar_data: dict, status: str = "complete",
+                        stages: dict = None) -> None:
+    documents = {
+        # Store evaluation results in MongoDB
+        "evaluations": {
+            "session_id": session_id,
+            "user_id": request.user_id,
+            "question": request.question,
+            "answer": request.answer,
+            "detailed_feedback": feedback,
+            "overall_criteria_scores": overall_criteria_scores,
+            "status": status,
+            "stage_status": stages or {},
+            "trace_id": tracing.current_trace_id(),
+            "created_at": now
+        }
+    }
+    if grammar_data is not None:
+        # Store grammar correction results in MongoDB
+        documents["grammar_corrections"] = {
+            "session_id": session_id,
+            "user_id": request.user_id,
+            "original_text": request.answer,
+            "corrected_text": grammar_data['corrected_text'],
+            "with_errors": grammar_data['with_errors'],
+            "fixed_only": grammar_data['fixed_only'],
+            "trace_id": tracing.current_trace_id(),
+            "created_at": now
+        }
+    await session_writer.write(documents)
+
+engines.app_imported()
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=PORT, reload=True)
\ No newline at end of file
@@ -0,0 +1,118 @@
+"""
+Prometheus metrics.
+HTTP request counts, in-flight gauges and latency histograms per endpoint,
+latency histograms for the DAG pipeline stages, and finer-grained operation
+timings (BERT tokenization/inference, CoEdIT chunks, Ollama generation, Gemini
+calls, JSON parse/repair, MongoDB writes) with error counters by cause, plus
+the Ollama pool's queue depth, per-replica in-flight/health gauges and model
+load events (preloads, and reloads after the server evicted the model).
+Exposed in the text format at GET /metrics. Each observed operation is also a
+tracing span, so the same names show up in traces.
+"""
+
+import asyncio
+import time
+from contextlib import contextmanager
+import httpx
+import tracing
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# LLM stages run for tens of seconds, tokenization for milliseconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 240)
+
+HTTP_REQUESTS = Counter(
+    "ielts_http_requests_total", "HTTP requests by endpoint and status code", ["method", "endpoint", "status"]
+)
+HTTP_IN_FLIGHT = Gauge("ielts_http_requests_in_flight", "HTTP requests being served", ["method", "endpoint"])
+HTTP_LATENCY = Histogram(
+    "ielts_http_request_duration_seconds", "HTTP request latency", ["method", "endpoint"], buckets=LATENCY_BUCKETS
+)
+PIPELINE_STAGE_LATENCY = Histogram(
+    "ielts_pipeline_stage_duration_seconds", "Pipeline stage wall time (including its queue time)",
+    ["stage", "status"], buckets=LATENCY_BUCKETS
+)
+PIPELINE_STAGE_QUEUE = Histogram(
+    "ielts_pipeline_stage_queue_seconds", "Time a ready pipeline stage waited for a slot or thread",
+    ["stage"], buckets=LATENCY_BUCKETS
+)
+OPERATION_LATENCY = Histogram(
+    "ielts_operation_duration_seconds", "Latency of individual model, LLM and database operations",
+    ["operation"], buckets=LATENCY_BUCKETS
+)
+OPERATION_IN_FLIGHT = Gauge("ielts_operation_in_flight", "Operations currently running", ["operation"])
+ERRORS = Counter("ielts_errors_total", "Errors by operation and cause", ["operation", "cause"])
+OLLAMA_QUEUE_DEPTH = Gauge("ielts_ollama_queue_depth", "Generations waiting for a free Ollama replica slot")
+OLLAMA_QUEUED = Counter("ielts_ollama_queued_total", "Generations that had to wait for an Ollama replica slot")
+OLLAMA_QUEUE_WAIT = Histogram(
+    "ielts_ollama_queue_wait_seconds", "Time a generation waited for an Ollama replica slot", buckets=LATENCY_BUCKETS
+)
+OLLAMA_IN_FLIGHT = Gauge("ielts_ollama_in_flight", "Generations running on each Ollama replica", ["replica"])
+OLLAMA_HEALTHY = Gauge("ielts_ollama_replica_healthy", "1 if the Ollama replica passed its last check", ["replica"])
+OLLAMA_MODEL_LOADS = Counter(
+    "ielts_ollama_model_loads_total", "Ollama model loads; reason=reload means the model had been evicted",
+    ["replica", "reason"]
+)
+OLLAMA_LOAD_SECONDS = Counter(
+    "ielts_ollama_model_load_seconds_total", "Time Ollama replicas spent loading the model", ["replica", "reason"]
+)
+
+
+def error_cause(error: BaseException) -> str:
+    """Low-cardinality label for an exception: timeout, connection, http_<code> or the class name."""
+    if isinstance(error, (asyncio.TimeoutError, httpx.TimeoutException)):
+        return "timeout"
+    if isinstance(error, httpx.ConnectError):
+        return "connection"
+    if isinstance(error, httpx.HTTPStatusError):
+        return f"http_{error.response.status_code}"
+    code = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if isinstance(code, int):
+        return f"http_{code}"
+    return type(error).__name__
+
+
+def record_error(operation: str, cause) -> None:
+    ERRORS.labels(operation, cause if isinstance(cause, str) else error_cause(cause)).inc()
+
+
+@contextmanager
+def observe(operation: str, attributes: dict = None):
+    """
+    Time a block (sync or async) as `operation` inside a tracing span of the same
+    name (yielded, for attributes); exceptions are counted by cause and re-raised.
+    """
+    OPERATION_IN_FLIGHT.labels(operation).inc()
+    start = time.perf_counter()
+    try:
+        with tracing.span(operation, attributes) as current:
+            yield current
+    except asyncio.CancelledError:
+        record_error(operation, "cancelled")
+        raise
+    except Exception as e:
+        record_error(operation, e)
+        raise
+    finally:
+        OPERATION_LATENCY.labels(operation).observe(time.perf_counter() - start)
+        OPERATION_IN_FLIGHT.labels(operation).dec()
+
+
+def observe_pipeline_stage(stage: str, timing: dict) -> None:
+    status = timing.get("status", "unknown")
+    if "wall_time" in timing:
+        PIPELINE_STAGE_LATENCY.labels(stage, status).observe(timing["wall_time"])
+    if "queue_time" in timing:
+        PIPELINE_STAGE_QUEUE.labels(stage).observe(timing["queue_time"])
+    if status in ("timeout", "failed"):
+        record_error(f"stage:{stage}", status)
+
+
+def record_ollama_load(replica: str, reason: str, seconds: float) -> None:
+    """Count one Ollama model load (reason is "preload" or "reload")."""
+    OLLAMA_MODEL_LOADS.labels(replica, reason).inc()
+    OLLAMA_LOAD_SECONDS.labels(replica, reason).inc(seconds)
+
+
+def render() -> tuple:
+    """(body, content type) for the /metrics endpoint."""
+    return generate_latest(), CONTENT_TYPE_LATEST
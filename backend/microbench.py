@@ -0,0 +1,419 @@
+"""
+Micro-benchmarks for the CPU hot paths, over the fixed essay corpus in bench_corpus.json:
+BERT tokenization/preprocessing and forward pass (several batch sizes), CoEdIT chunking
+and correction, the HTML diff, LLM JSON parsing and score extraction.
+
+Timing: each benchmark is warmed up, then calibrated to a number of calls per round
+that takes at least --min-time; every round is timed with the GC off, and the
+per-call median, IQR and min over --rounds rounds are reported. torch is pinned to
+--threads intra-op threads so numbers do not depend on what else the machine runs.
+Memory: one extra call per benchmark under tracemalloc (Python heap peak) while a
+thread polls RSS (native allocations, e.g. torch tensors), reported as peak growth.
+
+Usage:
+    python microbench.py                                   # everything, table on stdout
+    python microbench.py --only json,scores --output current.json
+    python microbench.py --output bench_baseline.json      # store a baseline
+    python microbench.py --baseline bench_baseline.json --threshold 0.1   # exit 1 on regression
+    python microbench.py --compare bench_baseline.json current.json       # compare saved results
+
+A benchmark regresses when its median is more than --threshold slower than the
+baseline's and the two interquartile ranges do not overlap (current Q1 above
+baseline Q3), or when its tracemalloc peak grew by more than --memory-threshold.
+Models are imported only for the groups selected, so `--only json,scores` needs neither.
+"""
+
+import argparse
+import gc
+import hashlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from profiling import rss_bytes
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_corpus.json")
+BATCH_SIZES = (1, 2, 4, 8)
+# Python heap growth below this is noise, whatever the ratio
+MEMORY_NOISE_BYTES = 64 * 1024
+
+
+class Benchmark:
+    def __init__(self, name: str, group: str, setup, rounds: int = None, warmup: int = None):
+        """`setup(corpus)` returns the zero-argument callable that is timed."""
+        self.name = name
+        self.group = group
+        self.setup = setup
+        self.rounds = rounds
+        self.warmup = warmup
+
+
+# ===========================
+# Benchmarks
+# ===========================
+def _essay_batch(corpus: dict, size: int) -> tuple:
+    essays = [corpus["essays"][i % len(corpus["essays"])] for i in range(size)]
+    return [e["question"] for e in essays], [e["answer"] for e in essays]
+
+
+def setup_tokenize(corpus: dict):
+    from bert_setup import bert_tokenizer
+    from bert_model import tokenize_inputs_pt
+    questions, answers = _essay_batch(corpus, len(corpus["essays"]))
+    return lambda: tokenize_inputs_pt(questions, answers, bert_tokenizer, max_length=512)
+
+
+def setup_preprocess(corpus: dict):
+    from bert_setup import bert_tokenizer, scaler, device
+    from bert_model import preprocess_inputs_pt
+    essays = corpus["essays"]
+
+    def run():
+        for essay in essays:
+            preprocess_inputs_pt(essay["question"], essay["answer"], bert_tokenizer, scaler, device, max_length=512)
+    return run
+
+
+def setup_forward(batch_size: int):
+    def setup(corpus: dict):
+        import torch
+        from bert_setup import bert_tokenizer, model, scaler
+        from bert_model import tokenize_inputs_pt
+        questions, answers = _essay_batch(corpus, batch_size)
+        encoded = tokenize_inputs_pt(questions, answers, bert_tokenizer, max_length=512)
+        lengths = [[len(q.split()) + len(a.split())] for q, a in zip(questions, answers)]
+        extra = torch.tensor(scaler.transform(lengths), dtype=torch.float32)
+        model.eval()
+
+        def run():
+            with torch.no_grad():
+                model(encoded["input_ids"], encoded["attention_mask"], extra)
+        return run
+    return setup
+
+
+def setup_split_chunks(corpus: dict):
+    from grammar import split_text_into_chunks
+    paragraphs = [p.strip() for essay in corpus["essays"] for p in essay["answer"].split("\n\n") if p.strip()]
+
+    def run():
+        for paragraph in paragraphs:
+            split_text_into_chunks(paragraph, 64)
+    return run
+
+
+def setup_process_document(corpus: dict):
+    from grammar import process_document
+    # Shortest essay: one call is a full CoEdIT generation per chunk
+    essay = min(corpus["essays"], key=lambda e: len(e["answer"]))
+    return lambda: process_document(essay["answer"], 64)
+
+
+def setup_wrap_errors(corpus: dict):
+    from grammar import wrap_errors_and_fixes
+    pairs = [(e["answer"], e["corrected"]) for e in corpus["essays"]]
+
+    def run():
+        for original, corrected in pairs:
+            wrap_errors_and_fixes(original, corrected)
+    return run
+
+
+def setup_read_json(corpus: dict):
+    from handle_json import read_json_from_string
+    outputs = list(corpus["llm_outputs"].values())
+
+    def run():
+        for text in outputs:
+            read_json_from_string(text)
+    return run
+
+
+def setup_extract_scores(corpus: dict):
+    from handle_json import read_json_from_string
+    from caculate_score import extract_scores
+    evaluation = {
+        "overall_score": 6.0,
+        "evaluation_feedback": read_json_from_string(corpus["llm_outputs"]["evaluation"])["parsed"],
+        "constructive_feedback": read_json_from_string(corpus["llm_outputs"]["constructive"])["parsed"],
+    }
+    return lambda: extract_scores(evaluation)
+
+
+BENCHMARKS = [
+    Benchmark("bert.tokenize_inputs_pt", "bert", setup_tokenize),
+    Benchmark("bert.preprocess_inputs_pt", "bert", setup_preprocess),
+    *[Benchmark(f"bert.forward[batch={size}]", "bert", setup_forward(size)) for size in BATCH_SIZES],
+    Benchmark("grammar.split_text_into_chunks", "grammar", setup_split_chunks),
+    Benchmark("grammar.process_document", "grammar", setup_process_document, rounds=3, warmup=1),
+    Benchmark("grammar.wrap_errors_and_fixes", "grammar", setup_wrap_errors),
+    Benchmark("json.read_json_from_string", "json", setup_read_json),
+    Benchmark("scores.extract_scores", "scores", setup_extract_scores),
+]
+
+
+# ===========================
+# Measurement
+# ===========================
+def _timed_round(fn, number: int) -> float:
+    """Seconds per call over `number` back-to-back calls, with the GC off like timeit."""
+    gc.collect()
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            fn()
+        return (time.perf_counter_ns() - start) / 1e9 / number
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def calibrate(fn, min_time: float, max_number: int = 1_000_000) -> int:
+    """Smallest power of two of calls per round that takes at least min_time."""
+    number = 1
+    while number < max_number and _timed_round(fn, number) * number < min_time:
+        number *= 2
+    return number
+
+
+def quartiles(samples: list) -> tuple:
+    if len(samples) < 2:
+        return samples[0], samples[0]
+    q1, _, q3 = statistics.quantiles(samples, n=4, method="inclusive")
+    return q1, q3
+
+
+def time_benchmark(fn, rounds: int, warmup: int, min_time: float) -> dict:
+    for _ in range(warmup):
+        fn()
+    number = calibrate(fn, min_time)
+    samples = [_timed_round(fn, number) for _ in range(rounds)]
+    q1, q3 = quartiles(samples)
+    iqr = q3 - q1
+    return {
+        "number": number,
+        "rounds": rounds,
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "min": min(samples),
+        "max": max(samples),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "q1": q1,
+        "q3": q3,
+        "iqr": iqr,
+        "outliers": sum(1 for s in samples if s < q1 - 1.5 * iqr or s > q3 + 1.5 * iqr),
+        "samples": samples,
+    }
+
+
+def measure_memory(fn, poll_interval: float = 0.001) -> dict:
+    """Peak Python heap (tracemalloc) and peak RSS growth during one call."""
+    gc.collect()
+    baseline_rss = rss_bytes()
+    peak_rss = baseline_rss
+    done = threading.Event()
+
+    def poll():
+        nonlocal peak_rss
+        while not done.wait(poll_interval):
+            peak_rss = max(peak_rss, rss_bytes())
+
+    poller = threading.Thread(target=poll, name="microbench-rss", daemon=True)
+    poller.start()
+    tracemalloc.start()
+    try:
+        fn()
+        _, traced_peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        done.set()
+        poller.join()
+    peak_rss = max(peak_rss, rss_bytes())
+    return {"tracemalloc_peak": traced_peak, "rss_peak_delta": peak_rss - baseline_rss}
+
+
+def pin_threads(threads: int) -> None:
+    """Fix torch's intra-op thread count (0 keeps torch's default)."""
+    if threads <= 0:
+        return
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    import torch
+    torch.set_num_threads(threads)
+
+
+def environment(corpus_path: str, threads: int) -> dict:
+    with open(corpus_path, "rb") as f:
+        corpus_hash = hashlib.sha256(f.read()).hexdigest()[:16]
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                timeout=5, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    env = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "corpus_sha256": corpus_hash,
+        "threads": threads,
+    }
+    if "torch" in sys.modules:
+        torch = sys.modules["torch"]
+        env.update({"torch": torch.__version__, "torch_threads": torch.get_num_threads()})
+    if "transformers" in sys.modules:
+        env["transformers"] = sys.modules["transformers"].__version__
+    return env
+
+
+def select(only: str) -> list:
+    if not only:
+        return BENCHMARKS
+    patterns = [p.strip() for p in only.split(",") if p.strip()]
+    return [b for b in BENCHMARKS if any(p == b.group or p in b.name for p in patterns)]
+
+
+def run_benchmarks(args) -> dict:
+    with open(args.corpus, encoding="utf-8") as f:
+        corpus = json.load(f)
+    benchmarks = select(args.only)
+    if not benchmarks:
+        raise SystemExit(f"No benchmark matches --only {args.only!r}")
+    if any(b.group in ("bert", "grammar") for b in benchmarks):
+        pin_threads(args.threads)
+
+    results = {}
+    for benchmark in benchmarks:
+        print(f"running {benchmark.name} ...", file=sys.stderr, flush=True)
+        fn = benchmark.setup(corpus)
+        result = time_benchmark(fn, benchmark.rounds or args.rounds,
+                                args.warmup if benchmark.warmup is None else benchmark.warmup, args.min_time)
+        if not args.no_memory:
+            result.update(measure_memory(fn))
+        results[benchmark.name] = {"group": benchmark.group, "unit": "seconds", **result}
+    return {"environment": environment(args.corpus, args.threads), "results": results}
+
+
+# ===========================
+# Comparison
+# ===========================
+def compare(baseline: dict, current: dict, threshold: float, memory_threshold: float) -> list:
+    """One row per benchmark in either file; status ok/regressed/improved/new/missing."""
+    rows = []
+    base_results, current_results = baseline["results"], current["results"]
+    for name in list(base_results) + [n for n in current_results if n not in base_results]:
+        base, now = base_results.get(name), current_results.get(name)
+        row = {"name": name, "baseline": base and base["median"], "current": now and now["median"],
+               "change": None, "memory_change": None, "status": "ok", "reasons": []}
+        if now is None:
+            row["status"] = "missing"
+        elif base is None:
+            row["status"] = "new"
+        else:
+            row["change"] = now["median"] / base["median"] - 1 if base["median"] else None
+            if row["change"] is not None and row["change"] > threshold and now["q1"] > base["q3"]:
+                row["reasons"].append(f"median {row['change']:+.1%}")
+            elif row["change"] is not None and row["change"] < -threshold and now["q3"] < base["q1"]:
+                row["status"] = "improved"
+            base_peak, peak = base.get("tracemalloc_peak"), now.get("tracemalloc_peak")
+            if base_peak is not None and peak is not None:
+                row["memory_change"] = peak / base_peak - 1 if base_peak else None
+                if peak - base_peak > MEMORY_NOISE_BYTES and (not base_peak or row["memory_change"] > memory_threshold):
+                    row["reasons"].append(f"tracemalloc peak {base_peak} -> {peak} bytes")
+            if row["reasons"]:
+                row["status"] = "regressed"
+        rows.append(row)
+    return rows
+
+
+def environment_mismatches(baseline: dict, current: dict) -> list:
+    keys = ("python", "machine", "cpu_count", "corpus_sha256", "threads", "torch", "torch_threads")
+    base_env, env = baseline.get("environment", {}), current.get("environment", {})
+    return [f"{k}: {base_env.get(k)} -> {env.get(k)}" for k in keys
+            if k in base_env and k in env and base_env[k] != env[k]]
+
+
+# ===========================
+# Output
+# ===========================
+def _ms(seconds) -> str:
+    return "-" if seconds is None else f"{seconds * 1000:.3f}"
+
+
+def print_results(report: dict) -> None:
+    print(f"{'benchmark':<34}{'calls':>8}{'median ms':>12}{'iqr ms':>10}{'min ms':>10}"
+          f"{'py peak KiB':>13}{'rss +KiB':>10}")
+    for name, r in report["results"].items():
+        py_peak = r.get("tracemalloc_peak")
+        rss = r.get("rss_peak_delta")
+        print(f"{name:<34}{r['number']:>8}{_ms(r['median']):>12}{_ms(r['iqr']):>10}{_ms(r['min']):>10}"
+              f"{'-' if py_peak is None else py_peak // 1024:>13}{'-' if rss is None else rss // 1024:>10}")
+
+
+def print_comparison(rows: list, mismatches: list) -> None:
+    if mismatches:
+        print("\nwarning: baseline was recorded in a different environment: " + "; ".join(mismatches))
+    print(f"\n{'benchmark':<34}{'baseline ms':>13}{'current ms':>12}{'change':>9}{'mem':>9}  status")
+    for row in rows:
+        change = "-" if row["change"] is None else f"{row['change']:+.1%}"
+        memory = "-" if row["memory_change"] is None else f"{row['memory_change']:+.1%}"
+        reasons = f" ({', '.join(row['reasons'])})" if row["reasons"] else ""
+        print(f"{row['name']:<34}{_ms(row['baseline']):>13}{_ms(row['current']):>12}{change:>9}{memory:>9}"
+              f"  {row['status']}{reasons}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", help="comma-separated groups (bert, grammar, json, scores) or name substrings")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--rounds", type=int, default=15, help="timed rounds per benchmark")
+    parser.add_argument("--warmup", type=int, default=3, help="untimed calls before calibration")
+    parser.add_argument("--min-time", type=float, default=0.2, help="minimum seconds per timed round")
+    parser.add_argument("--threads", type=int, default=1, help="torch intra-op threads (0: torch default)")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc/RSS pass")
+    parser.add_argument("--output", help="write the results as JSON (use as a later --baseline)")
+    parser.add_argument("--baseline", help="results JSON to compare this run against")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="compare two saved results files without running anything")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed median slowdown (0.10 = 10%%)")
+    parser.add_argument("--memory-threshold", type=float, default=0.20, help="allowed tracemalloc peak growth")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0], encoding="utf-8") as f:
+            baseline = json.load(f)
+        with open(args.compare[1], encoding="utf-8") as f:
+            current = json.load(f)
+    else:
+        current = run_benchmarks(args)
+        print_results(current)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(current, f, indent=2)
+        if not args.baseline:
+            return
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        # Only what ran this time can be compared
+        baseline["results"] = {k: v for k, v in baseline["results"].items() if k in current["results"]}
+
+    rows = compare(baseline, current, args.threshold, args.memory_threshold)
+    print_comparison(rows, environment_mismatches(baseline, current))
+    regressed = [row["name"] for row in rows if row["status"] == "regressed"]
+    if regressed:
+        print(f"\n{len(regressed)} regression(s): {', '.join(regressed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
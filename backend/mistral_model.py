@@ -1,31 +1,129 @@
-from bert_setup import get_overall_score
 import asyncio
 import httpx
 from dotenv import load_dotenv
 import os
 import json
 import time
-from google import genai
 from handle_json import read_json_from_string
+from gemini_pool import get_gemini_pool
+from llm_cache import get_llm_cache, make_cache_key
+from ollama_pool import get_ollama_pool, OLLAMA_KEEP_ALIVE
+from band_descriptors import descriptor_context, load_band_descriptors
+from pipeline import Pipeline, Stage
+from deadline import check_deadline, timeout_for
+from admission import get_limiter
+import engines
+from metrics import observe, record_error
+import tracing
+import usage
 
 # Load environment variables
 load_dotenv()
 
 # Environment variables with safe defaults
-RETRY_DELAY = int(os.getenv("RETRY_DELAY", "3"))
-MAX_RETRIES = int(os.getenv("MAX_RETRIES", "3"))
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-GEMINI_API_KEY_2 = os.getenv("GEMINI_API_KEY_2")
 BAND_DISCRIPTIOR_FILE = os.getenv("BAND_DISCRIPTIOR_FILE")
+# "snippets": only the descriptor rows for the relevant criteria/bands, "pdf": upload the whole PDF
+BAND_DESCRIPTOR_MODE = os.getenv("BAND_DESCRIPTOR_MODE", "snippets").lower()
 OLLAMA_CHAT_ENDPOINT = os.getenv("OLLAMA_CHAT_ENDPOINT")
 OLLAMA_GEN_ENDPOINT = os.getenv("OLLAMA_GEN_ENDPOINT")
+# "text": markdown sections repaired into JSON by Gemini, "json": schema-constrained Ollama output
+MISTRAL_OUTPUT_MODE = os.getenv("MISTRAL_OUTPUT_MODE", "text").lower()
+MISTRAL_JSON_NUM_PREDICT = int(os.getenv("MISTRAL_JSON_NUM_PREDICT", "1024"))
+# Send the trace context to Gemini as request headers (per-call http_options)
+GEMINI_TRACE_HEADERS = os.getenv("GEMINI_TRACE_HEADERS", "1") == "1"
+# HTTP timeout of one Gemini call (seconds), further capped by the request deadline
+GEMINI_CALL_TIMEOUT = float(os.getenv("GEMINI_CALL_TIMEOUT", "120"))
+# Constructive feedback: one long generation, or one concurrent Gemini call per criterion
+CONSTRUCTIVE_FANOUT = os.getenv("CONSTRUCTIVE_FANOUT", "0") == "1"
+CONSTRUCTIVE_CRITERION_MAX_TOKENS = int(os.getenv("CONSTRUCTIVE_CRITERION_MAX_TOKENS", "768"))
+CONSTRUCTIVE_SUMMARY_MAX_TOKENS = int(os.getenv("CONSTRUCTIVE_SUMMARY_MAX_TOKENS", "256"))
+
+# constructive_feedback criteria keys -> criterion names used in the prompts
+CONSTRUCTIVE_CRITERIA = {
+    "task_response": "Task Response",
+    "coherence_and_cohesion": "Coherence and Cohesion",
+    "lexical_resource": "Lexical Resource",
+    "grammatical_range_and_accuracy": "Grammatical Range and Accuracy",
+}
+
+# Gemini calls per essay (constructive feedback, one per criterion + summary when fanned out,
+# plus the evaluation's JSON repair in text mode); admit() reserves this many gemini slots
+GEMINI_CALLS_PER_ESSAY = (len(CONSTRUCTIVE_CRITERIA) + 1 if CONSTRUCTIVE_FANOUT else 1) + \
+    (0 if MISTRAL_OUTPUT_MODE == "json" else 1)
+
+EVALUATION_CRITERIA = [
+    "Task Achievement",
+    "Coherence and Cohesion",
+    "Lexical Resource",
+    "Grammatical Range and Accuracy",
+]
+
+def _criterion_schema() -> dict:
+    return {
+        "type": "object",
+        "properties": {
+            "feedback": {"type": "string"},
+            "mistakes": {"type": "array", "items": {"type": "string"}},
+            "suggested_band_score": {"type": "number"},
+        },
+        "required": ["feedback", "suggested_band_score"],
+    }
 
-async def PromptMistral(band: float, question: str, essay: str) -> str:
-    PROMPT = """
-    Overall Band Score: 
-
+# JSON schema passed through the Ollama chat `format` field; keys match the Gemini-repaired output
+EVALUATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        **{name: _criterion_schema() for name in EVALUATION_CRITERIA},
+        "Overall Band Score": {
+            "type": "object",
+            "properties": {
+                "summary": {"type": "string"},
+                "overall_band_score": {"type": "number"},
+            },
+            "required": ["summary", "overall_band_score"],
+        },
+    },
+    "required": EVALUATION_CRITERIA + ["Overall Band Score"],
+}
+
+# Uploaded files are scoped to the API key's project, so keep one upload per client.
+# Gemini deletes uploaded files after 48h; re-upload a bit before that.
+UPLOAD_TTL_SECONDS = 47 * 3600
+_uploaded_files = {}
+
+def upload_file_cached(client, path: str):
+    key = (id(client), path)
+    cached = _uploaded_files.get(key)
+    if cached and time.time() - cached[1] < UPLOAD_TTL_SECONDS:
+        return cached[0]
+    uploaded = client.files.upload(file=path)
+    _uploaded_files[key] = (uploaded, time.time())
+    return uploaded
+
+def band_descriptor_part(client, overall_score: float, criteria: list = None):
+    """Band descriptor context for a Gemini call: adjacent-band text snippets, or the uploaded PDF."""
+    if BAND_DESCRIPTOR_MODE == "pdf":
+        return upload_file_cached(client, BAND_DISCRIPTIOR_FILE)
+    return descriptor_context(overall_score, criteria)
+
+def prepare_band_descriptors(pool) -> None:
+    """Get the descriptor context ready before the score is known: upload the PDF for every key, or parse the snippets."""
+    if BAND_DESCRIPTOR_MODE == "pdf":
+        for slot in pool.slots:
+            upload_file_cached(slot.client, BAND_DISCRIPTIOR_FILE)
+    else:
+        load_band_descriptors()
+
+def band_descriptor_cache_part(overall_score: float, criteria: list = None) -> str:
+    if BAND_DESCRIPTOR_MODE == "pdf":
+        return BAND_DISCRIPTIOR_FILE
+    return descriptor_context(overall_score, criteria)
+
+# Prompts are laid out as [instructions + question][band + essay]: the first part is identical
+# for every student answering the same question, so Ollama can reuse its KV cache for it.
+MISTRAL_INSTRUCTIONS = """
     In this task, you are required to evaluate the following essay based on the official IELTS scoring criteria. 
-    Please provide detailed feedback for each of the four criteria, always keeping in mind that the essay received an overall IELTS Writing band score {}. 
+    Please provide detailed feedback for each of the four criteria, always keeping in mind the overall IELTS Writing band score given below. 
 
     ## Task Achievement:
     - Evaluate how well the candidate has addressed the given task.
@@ -51,21 +149,44 @@ async def PromptMistral(band: float, question: str, essay: str) -> str:
     ## Feedback and Additional Comments:
     - Provide constructive feedback highlighting specific strengths and areas for improvement.
     - Suggest strategies for enhancement in weaker areas.
+"""
+
+MISTRAL_JSON_INSTRUCTIONS = (
+    "You are an IELTS Writing Task 2 examiner.\n"
+    "Evaluate the following essay based on the official IELTS scoring criteria, "
+    "keeping in mind the overall IELTS Writing band score given below.\n\n"
+    "For each of Task Achievement, Coherence and Cohesion, Lexical Resource and Grammatical Range and Accuracy:\n"
+    "- write the feedback in 'feedback' (without the numeric score),\n"
+    "- list specific mistakes with their corrections in 'mistakes' (\"mistake -> correction\"),\n"
+    "- put the numeric band score in 'suggested_band_score'.\n"
+    "Summarize strengths and areas for improvement in 'Overall Band Score'.\n"
+    "Respond with JSON only.\n"
+)
+
+def mistral_prompt_prefix(question: str, json_mode: bool = False) -> str:
+    """Shared per-question prefix: instructions followed by the question, no essay-specific text."""
+    instructions = MISTRAL_JSON_INSTRUCTIONS if json_mode else MISTRAL_INSTRUCTIONS
+    return f"{instructions}\n    ## Prompt:\n    {question}\n"
 
-    ## Prompt:
-    {}
+async def PromptMistral(band: float, question: str, essay: str) -> str:
+    SUFFIX = """
+    ## Overall Band Score:
+    The essay received an overall IELTS Writing band score {}.
 
     ## Essay:
     {}
 
     ## Evaluation:
-    {}"""
+    """
 
-    return PROMPT.format(
-        band,
-        question,
-        essay,
-        "",
+    return mistral_prompt_prefix(question) + SUFFIX.format(band, essay)
+
+async def PromptMistralJSON(band: float, question: str, essay: str) -> str:
+    """Prompt variant for schema-constrained output: same criteria, no markdown sections."""
+    return (
+        mistral_prompt_prefix(question, json_mode=True)
+        + f"\nOverall Band Score: {band}\n\n"
+        + f"Essay:\n{essay}\n"
     )
 
 async def create_constructive_feedback_prompt(question: str, essay: str, overall_score: float) -> str:
@@ -117,8 +238,78 @@ async def create_constructive_feedback_prompt(question: str, essay: str, overall
     )
     return prompt
 
-async def get_evaluation_mistral( overall_score: float, question: str , answer: str, client) -> str:
-    evaluation_prompt = await PromptMistral(band=overall_score, question=question, essay=answer)
+async def create_criterion_feedback_prompt(question: str, essay: str, overall_score: float, criterion: str) -> str:
+    """Single-criterion slice of create_constructive_feedback_prompt, used by the fan-out mode."""
+    prompt = (
+        f"You are an IELTS Writing Task 2 examiner.\n"
+        f"Provide a constructive evaluation of the following essay for the {criterion} criterion only, "
+        f"based on the official IELTS scoring criteria.\n\n"
+        f"Question:\n{question}\n\n"
+        f"Essay:\n{essay}\n\n"
+        f"The essay above received an overall IELTS Writing band score of {str(overall_score)}.\n\n"
+        f"Return your evaluation strictly in the following JSON format:\n\n"
+        f"{{\n"
+        f'  "score": <score>,\n'
+        f'  "strengths": [<list of specific strengths>],\n'
+        f'  "areas_for_improvement": [<list of specific areas needing improvement>],\n'
+        f'  "recommendations": [<list of actionable advice>]\n'
+        f"}}\n\n"
+        f"Rules:\n"
+        f"- All keys and strings must use double quotes (\"\") according to strict JSON format.\n"
+        f"- The score must be consistent with the given overall band score.\n"
+        f"- Be specific and cite examples from the essay when possible.\n"
+        f"- Return ONLY the JSON object.\n"
+    )
+    return prompt
+
+async def create_summary_feedback_prompt(question: str, essay: str, overall_score: float) -> str:
+    prompt = (
+        f"You are an IELTS Writing Task 2 examiner.\n"
+        f"Question:\n{question}\n\n"
+        f"Essay:\n{essay}\n\n"
+        f"The essay above received an overall IELTS Writing band score of {str(overall_score)}.\n\n"
+        f"Return strictly the JSON object {{\"summary\": \"<short paragraph summarizing key strengths and improvement directions>\"}} "
+        f"and nothing else.\n"
+    )
+    return prompt
+
+def gemini_config(model: str, config: dict = None):
+    """
+    generate_content config carrying the current trace context as request headers and an
+    HTTP timeout within the request deadline, so a call the pipeline gave up on does not keep
+    its worker thread (and the key's quota) busy. Called inside the pooled call, so the
+    current span is that attempt's gemini_call span.
+    """
+    tracing.set_attribute("llm.model", model)
+    # google-genai takes the timeout in milliseconds
+    http_options = {"timeout": max(int(timeout_for(GEMINI_CALL_TIMEOUT) * 1000), 1)}
+    headers = tracing.propagation_headers() if GEMINI_TRACE_HEADERS else {}
+    if headers:
+        http_options["headers"] = headers
+    return {**(config or {}), "http_options": http_options}
+
+def parses_as_json(text: str) -> bool:
+    """Only responses that parse are cached; a malformed one would be replayed for the whole TTL."""
+    return read_json_from_string(text)["valid_json"]
+
+async def call_gemini(pool, fn, purpose: str, model: str = "gemini-2.5-flash-lite"):
+    """
+    pool.call recorded in the usage ledger. Each attempt takes a Gemini admission slot
+    only once the key pool granted it a token (in lane order), so calls waiting for
+    quota do not hold slots.
+    """
+    with usage.llm_call(purpose, "gemini", model):
+        response = await pool.call(fn, gate=get_limiter("gemini").slot)
+        usage.record_gemini_usage(response)
+        return response
+
+async def get_evaluation_mistral( overall_score: float, question: str , answer: str, pool, use_cache: bool = True) -> str:
+    json_mode = MISTRAL_OUTPUT_MODE == "json"
+    if json_mode:
+        evaluation_prompt = await PromptMistralJSON(band=overall_score, question=question, essay=answer)
+    else:
+        evaluation_prompt = await PromptMistral(band=overall_score, question=question, essay=answer)
+    prompt_prefix = mistral_prompt_prefix(question, json_mode)
     
     payload = {
         "model": "ielts-mistral:latest",
@@ -128,8 +319,14 @@ async def get_evaluation_mistral( overall_score: float, question: str , answer:
         "options": {
             "num_predict": 2048,
             "temperature": 0.7
-        }
+        },
+        "keep_alive": OLLAMA_KEEP_ALIVE
     }
+    if json_mode:
+        # Output is constrained to EVALUATION_SCHEMA, so no Gemini repair pass is needed
+        payload["format"] = EVALUATION_SCHEMA
+        payload["options"]["num_predict"] = MISTRAL_JSON_NUM_PREDICT
+        payload["options"]["temperature"] = 0.2
     #payload = {
             #"model": "ielts-mistral:latest",
             #"prompt": evaluation_prompt,
@@ -138,26 +335,50 @@ async def get_evaluation_mistral( overall_score: float, question: str , answer:
                 #"temperature": 0.7
             #}
         #}
-    timeout = httpx.Timeout(180.0, connect=10.0)
-    try:
-        async with httpx.AsyncClient(timeout=timeout) as http_client:
-            response = await http_client.post(OLLAMA_CHAT_ENDPOINT, json=payload)
-            response.raise_for_status()
-
-            # Ghép nội dung trả về dạng JSON line (stream)
-            evaluation_text = ""
-            for line in response.text.splitlines():
-                try:
-                    data = json.loads(line)
-                    #evaluation_text += data.get("response", "") for generate endpoint
-                    #evaluation_text += data["message"]["content"] for chat endpoint
-                    evaluation_text += data["message"]["content"]
-                except Exception:
-                    continue
-
-    except httpx.HTTPError as e:
-        print(f"Error calling Ollama: {e}")
-        return "Failed to get feedback from Ollama."
+    cache = get_llm_cache()
+    ollama_key = make_cache_key(
+        payload["model"],
+        payload["messages"],
+        {**payload["options"], "format": payload.get("format")},
+    )
+    evaluation_text = await cache.get(ollama_key, use_cache)
+    if evaluation_text is not None:
+        usage.record_cache_hit("evaluation", "ollama", payload["model"])
+    else:
+        # Never wait on Ollama past the request deadline
+        timeout = httpx.Timeout(timeout_for(180.0), connect=10.0)
+        try:
+            async with httpx.AsyncClient(timeout=timeout) as http_client:
+                # Least-loaded healthy replica, with failover on connection errors. Essays for the
+                # same question stick to one replica, whose slots can reuse the cached shared prefix.
+                with usage.llm_call("evaluation", "ollama", payload["model"]):
+                    async with get_limiter("ollama").slot():
+                        with observe("ollama_generation", {"llm.model": payload["model"]}):
+                            response = await get_ollama_pool().post_chat(
+                                payload, http_client, affinity_key=prompt_prefix
+                            )
+
+                # Ghép nội dung trả về dạng JSON line (stream)
+                evaluation_text = ""
+                for line in response.text.splitlines():
+                    try:
+                        data = json.loads(line)
+                        #evaluation_text += data.get("response", "") for generate endpoint
+                        #evaluation_text += data["message"]["content"] for chat endpoint
+                        evaluation_text += data["message"]["content"]
+                    except Exception:
+                        continue
+
+        except httpx.HTTPError as e:
+            check_deadline("Ollama evaluation")
+            print(f"Error calling Ollama: {e}")
+            return "Failed to get feedback from Ollama."
+        # Free-form output is repaired below, so only JSON-mode output has to parse
+        if not json_mode or parses_as_json(evaluation_text):
+            await cache.set(ollama_key, payload["model"], evaluation_text, use_cache)
+
+    if json_mode:
+        return evaluation_text
 
     gemini_prompt = (
             f"You are a strict JSON fixer and formatter.\n"
@@ -177,62 +398,165 @@ async def get_evaluation_mistral( overall_score: float, question: str , answer:
             f"- Do NOT include any top-level keys other than:'Task Achievement', 'Coherence and Cohesion', 'Lexical Resource', 'Grammatical Range and Accuracy', and 'Overall Band Score'."
         )
 
-    def run_gemini():
+    def run_gemini(client):
         return client.models.generate_content(
             model="gemini-2.5-flash-lite",#gemini-2.5-flash
-            contents=gemini_prompt
+            contents=gemini_prompt,
+            config=gemini_config("gemini-2.5-flash-lite")
         )
 
-    gemini_response = await asyncio.to_thread(run_gemini)
-    corrected_json = gemini_response.text
+    gemini_key = make_cache_key("gemini-2.5-flash-lite", gemini_prompt)
+    corrected_json = await cache.get(gemini_key, use_cache)
+    if corrected_json is not None:
+        usage.record_cache_hit("json_repair", "gemini", "gemini-2.5-flash-lite")
+    else:
+        with observe("json_repair"):
+            gemini_response = await call_gemini(pool, run_gemini, "json_repair")
+        corrected_json = gemini_response.text
+        if parses_as_json(corrected_json):
+            await cache.set(gemini_key, "gemini-2.5-flash-lite", corrected_json, use_cache)
     return corrected_json
 
-async def get_constructive_feedback(overall_score: float, question: str , answer: str, client, band_descriptors) -> str:
-    constructive_prompt = await create_constructive_feedback_prompt(question, answer, overall_score)
+async def run_constructive_part(prompt: str, max_output_tokens: int, pool, overall_score: float,
+                                criteria: list = None, use_cache: bool = True) -> dict:
+    """One fan-out Gemini call with the band descriptors as context; returns the parsed JSON object (ValueError otherwise)."""
+    cache = get_llm_cache()
+    config = {"max_output_tokens": max_output_tokens, "response_mime_type": "application/json"}
+    cache_key = make_cache_key(
+        "gemini-2.5-flash-lite", [band_descriptor_cache_part(overall_score, criteria), prompt], config
+    )
+    purpose = f"constructive_{criteria[0]}" if criteria else "constructive_summary"
+    text = await cache.get(cache_key, use_cache)
+    cached = text is not None
+    if cached:
+        usage.record_cache_hit(purpose, "gemini", "gemini-2.5-flash-lite")
+    else:
+        def run_gemini(client):
+            band_descriptors = band_descriptor_part(client, overall_score, criteria)
+            return client.models.generate_content(
+                model="gemini-2.5-flash-lite",
+                contents=[band_descriptors, prompt],
+                config=gemini_config("gemini-2.5-flash-lite", config)
+            )
+
+        response = await call_gemini(pool, run_gemini, purpose)
+        text = response.text
+    result = read_json_from_string(text)
+    if not result["valid_json"]:
+        raise ValueError(f"Constructive JSON parse error: {result['error']}")
+    if not isinstance(result["parsed"], dict):
+        raise ValueError(f"Constructive JSON parse error: expected an object, got {type(result['parsed']).__name__}")
+    if not cached:
+        await cache.set(cache_key, "gemini-2.5-flash-lite", text, use_cache)
+    return result["parsed"]
+
+async def get_constructive_feedback_fanout(overall_score: float, question: str , answer: str, pool, use_cache: bool = True) -> str:
+    """
+    Issue the four criterion prompts and the summary prompt concurrently, each with a
+    small output budget, and assemble them into the get_constructive_feedback JSON shape.
+    """
+    criterion_prompts = [
+        await create_criterion_feedback_prompt(question, answer, overall_score, name)
+        for name in CONSTRUCTIVE_CRITERIA.values()
+    ]
+    summary_prompt = await create_summary_feedback_prompt(question, answer, overall_score)
+
+    with observe("constructive_fanout"):
+        results = await asyncio.gather(
+            *(
+                run_constructive_part(p, CONSTRUCTIVE_CRITERION_MAX_TOKENS, pool, overall_score, [key], use_cache)
+                for key, p in zip(CONSTRUCTIVE_CRITERIA.keys(), criterion_prompts)
+            ),
+            run_constructive_part(summary_prompt, CONSTRUCTIVE_SUMMARY_MAX_TOKENS, pool, overall_score, None,
+                                  use_cache),
+        )
+
+    constructive = {
+        "criteria": dict(zip(CONSTRUCTIVE_CRITERIA.keys(), results[:4])),
+        "overall_feedback": {"summary": results[4].get("summary", "")},
+    }
+    return json.dumps(constructive, ensure_ascii=False)
 
-    def run_gemini():
-        start_time = time.time()  # Start the timer
-        result = client.models.generate_content(
+async def get_constructive_feedback(overall_score: float, question: str , answer: str, pool, use_cache: bool = True) -> str:
+    if CONSTRUCTIVE_FANOUT:
+        return await get_constructive_feedback_fanout(overall_score, question, answer, pool, use_cache)
+    constructive_prompt = await create_constructive_feedback_prompt(question, answer, overall_score)
+    cache = get_llm_cache()
+    cache_key = make_cache_key("gemini-2.5-flash-lite", [band_descriptor_cache_part(overall_score), constructive_prompt])
+    cached_text = await cache.get(cache_key, use_cache)
+    if cached_text is not None:
+        usage.record_cache_hit("constructive", "gemini", "gemini-2.5-flash-lite")
+        return cached_text
+
+    def run_gemini(client):
+        band_descriptors = band_descriptor_part(client, overall_score)
+        # Latency is recorded per attempt by the pool (ielts_operation_duration_seconds{operation="gemini_call"})
+        return client.models.generate_content(
             model="gemini-2.5-flash-lite",#gemini-2.5-flash
-            contents=[band_descriptors, constructive_prompt]
+            contents=[band_descriptors, constructive_prompt],
+            config=gemini_config("gemini-2.5-flash-lite")
         )
-        end_time = time.time()  # End the timer
-        print(f"run_gemini execution time: {end_time - start_time:.2f} seconds")  # Log the execution time
-        return result
 
-    constructive_response = await asyncio.to_thread(run_gemini)
+    constructive_response = await call_gemini(pool, run_gemini, "constructive")
     constructive_text = constructive_response.text
+    if parses_as_json(constructive_text):
+        await cache.set(cache_key, "gemini-2.5-flash-lite", constructive_text, use_cache)
     return constructive_text
 
 
-async def get_feedback(question: str, answer: str) -> dict:
+def feedback_stages(pool, use_cache: bool = True) -> list:
     """
-    Compute overall score and return merged evaluation + constructive feedback.
+    Pipeline stages for the feedback: the BERT score on the CPU pool (or from the
+    scoring replica, see engines.py), the descriptor context in parallel with it,
+    then the Mistral evaluation and Gemini constructive feedback as soon as the
+    score is known. Inputs: question, answer.
     """
-    # 1. Compute IELTS score
-    overall_score = float(get_overall_score(question, answer))
-
-    # 2. Initialize clients
-    client = genai.Client(api_key=GEMINI_API_KEY)
-    client_2 = genai.Client(api_key=GEMINI_API_KEY_2)
-    band_descriptors = client.files.upload(file=BAND_DISCRIPTIOR_FILE)
-
-    evaluation_task = get_evaluation_mistral(overall_score, question, answer, client_2) # sau nhớ xóa await
-    constructive_task = get_constructive_feedback(overall_score, question, answer, client, band_descriptors)
-
-    evaluation_text, constructive_text = await asyncio.gather(evaluation_task, constructive_task)
-
-    # 5. Parse and merge
-    eval_res = read_json_from_string(evaluation_text)
-    const_res = read_json_from_string(constructive_text)
-
-    if not eval_res["valid_json"]:
-        raise ValueError(f"Evaluation JSON parse error: {eval_res['error']}")
-    if not const_res["valid_json"]:
-        raise ValueError(f"Constructive JSON parse error: {const_res['error']}")
+    def score(question, answer):
+        return float(engines.scoring().get_overall_score(question, answer))
+
+    async def evaluation(overall_score, question, answer):
+        text = await get_evaluation_mistral(overall_score, question, answer, pool, use_cache)
+        return parse_feedback_json(text, "Evaluation")
+
+    async def constructive(overall_score, band_descriptors, question, answer):
+        text = await get_constructive_feedback(overall_score, question, answer, pool, use_cache)
+        return parse_feedback_json(text, "Constructive")
+
+    if engines.serves("scoring"):
+        score_stage = Stage("overall_score", score, ["question", "answer"], executor="cpu", limiter=get_limiter("bert"))
+    else:
+        score_stage = Stage("overall_score", engines.remote_score, ["question", "answer"], limiter=get_limiter("bert"))
+    return [
+        score_stage,
+        Stage("band_descriptors", lambda: prepare_band_descriptors(pool), executor="io"),
+        Stage("evaluation_feedback", evaluation, ["overall_score", "question", "answer"]),
+        Stage("constructive_feedback", constructive, ["overall_score", "band_descriptors", "question", "answer"]),
+    ]
+
+FEEDBACK_KEYS = ("overall_score", "evaluation_feedback", "constructive_feedback")
+
+async def run_feedback_pipeline(question: str, answer: str, use_cache: bool = True, extra_stages: list = (),
+                                partial: bool = False) -> tuple:
+    """
+    Run the feedback stages (plus any extra_stages, which may depend on question/answer
+    or on feedback stages). Returns (results by stage name, per-stage timings).
+    With partial=True, stages cut off by the request deadline or failing are missing from the results.
+    """
+    pipeline = Pipeline(feedback_stages(get_gemini_pool(), use_cache) + list(extra_stages))
+    return await pipeline.run({"question": question, "answer": answer}, partial=partial)
 
-    return {
-        "overall_score": overall_score,
-        "evaluation_feedback": eval_res["parsed"],
-        "constructive_feedback": const_res["parsed"]
-    }
\ No newline at end of file
+async def get_feedback(question: str, answer: str, use_cache: bool = True) -> dict:
+    """
+    Compute overall score and return merged evaluation + constructive feedback.
+    use_cache=False bypasses the LLM response cache for this call.
+    """
+    results, _ = await run_feedback_pipeline(question, answer, use_cache)
+    return {key: results[key] for key in FEEDBACK_KEYS}
+
+def parse_feedback_json(text: str, label: str):
+    with observe("json_parse"):
+        result = read_json_from_string(text)
+    if not result["valid_json"]:
+        record_error("json_parse", "invalid_json")
+        raise ValueError(f"{label} JSON parse error: {result['error']}")
+    return result["parsed"]
\ No newline at end of file
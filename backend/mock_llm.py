@@ -0,0 +1,307 @@
+"""
+Local stand-ins for Ollama and Gemini, for load tests on a single offline box.
+
+Ollama: POST /api/chat streams NDJSON chunks like the real server (or one JSON
+object with "stream": false), with prompt_eval_count / eval_count / eval_duration
+in the final line; POST /api/generate (preload) and GET /api/tags (health) answer
+at once. A GPU is emulated by --ollama-parallel concurrent generations, each
+taking time-to-first-token plus output tokens at --ollama-tps.
+
+Gemini: POST /v1beta/models/{model}:generateContent and the resumable
+/upload/v1beta/files protocol used by client.files.upload. Responses are canned
+JSON in the shape mistral_model.py asks for (JSON repair, constructive feedback,
+per-criterion and summary fan-out), with usageMetadata.
+
+Latencies are distributions: "const:2", "uniform:1,3", "normal:2,0.5",
+"lognormal:<median>,<sigma>" or "exp:<mean>". Failure rates inject HTTP errors.
+
+Usage:
+    python mock_llm.py --ollama-port 11435 --gemini-port 8089
+then start the backend with
+    OLLAMA_CHAT_ENDPOINT=http://localhost:11435/api/chat
+    GEMINI_BASE_URL=http://localhost:8089 GEMINI_API_KEYS=mock1,mock2 GEMINI_RPM_PER_KEY=100000
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+EVALUATION_CRITERIA = [
+    "Task Achievement",
+    "Coherence and Cohesion",
+    "Lexical Resource",
+    "Grammatical Range and Accuracy",
+]
+CONSTRUCTIVE_CRITERIA = [
+    "task_response",
+    "coherence_and_cohesion",
+    "lexical_resource",
+    "grammatical_range_and_accuracy",
+]
+
+EVALUATION_JSON = json.dumps({
+    **{
+        name: {
+            "feedback": f"Mock feedback for {name}: the essay is adequate with some room for improvement.",
+            "mistakes": ["mock mistake -> mock correction"],
+            "suggested_band_score": 6.0,
+        }
+        for name in EVALUATION_CRITERIA
+    },
+    "Overall Band Score": {"summary": "Mock summary of the evaluation.", "overall_band_score": 6.0},
+})
+
+EVALUATION_TEXT = "\n".join(
+    f"## {name}:\nMock feedback for {name}: the essay is adequate with some room for improvement. Band 6.0\n"
+    for name in EVALUATION_CRITERIA
+) + "\n## Feedback and Additional Comments:\nMock summary of the evaluation."
+
+
+def criterion_feedback() -> dict:
+    return {
+        "score": 6.0,
+        "strengths": ["mock strength"],
+        "areas_for_improvement": ["mock area for improvement"],
+        "recommendations": ["mock recommendation"],
+    }
+
+
+CONSTRUCTIVE_JSON = json.dumps({
+    "criteria": {name: criterion_feedback() for name in CONSTRUCTIVE_CRITERIA},
+    "overall_feedback": {"summary": "Mock constructive summary."},
+})
+CRITERION_JSON = json.dumps(criterion_feedback())
+SUMMARY_JSON = json.dumps({"summary": "Mock constructive summary."})
+
+
+def parse_distribution(spec: str):
+    """Distribution spec -> function returning a non-negative sample."""
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    samplers = {
+        "const": lambda v: lambda: v[0],
+        "uniform": lambda v: lambda: random.uniform(v[0], v[1]),
+        "normal": lambda v: lambda: random.gauss(v[0], v[1]),
+        "lognormal": lambda v: lambda: random.lognormvariate(math.log(v[0]), v[1]),
+        "exp": lambda v: lambda: random.expovariate(1.0 / v[0]),
+    }
+    if kind not in samplers:
+        raise argparse.ArgumentTypeError(f"unknown distribution {spec!r}")
+    sampler = samplers[kind](values)
+    return lambda: max(sampler(), 0.0)
+
+
+def estimate_tokens(text: str) -> int:
+    return max(len(text) // 4, 1)
+
+
+# ===========================
+# Ollama
+# ===========================
+def create_ollama_app(args) -> FastAPI:
+    app = FastAPI(title="Mock Ollama")
+    gpu = asyncio.Semaphore(args.ollama_parallel)
+    counters = {"requests": 0, "errors": 0, "queued": 0}
+
+    def chunk(model: str, content: str, done: bool = False, **extra) -> bytes:
+        line = {"model": model, "created_at": datetime.now(timezone.utc).isoformat(),
+                "message": {"role": "assistant", "content": content}, "done": done, **extra}
+        return (json.dumps(line) + "\n").encode()
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": args.ollama_model}]}
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        payload = await request.json()
+        return {"model": payload.get("model"), "response": "", "done": True, "load_duration": 0}
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        payload = await request.json()
+        counters["requests"] += 1
+        if random.random() < args.ollama_error_rate:
+            counters["errors"] += 1
+            return JSONResponse({"error": "mock failure"}, status_code=500)
+        model = payload.get("model", args.ollama_model)
+        prompt = "".join(m.get("content", "") for m in payload.get("messages", []))
+        num_predict = payload.get("options", {}).get("num_predict", 2048)
+        content = EVALUATION_JSON if payload.get("format") else EVALUATION_TEXT
+        prompt_tokens = estimate_tokens(prompt)
+        output_tokens = min(int(args.ollama_output_tokens()), num_predict)
+        prefill = prompt_tokens / args.ollama_prefill_tps
+        decode = output_tokens / args.ollama_tps
+
+        if gpu.locked():
+            counters["queued"] += 1
+        await gpu.acquire()
+        start = time.perf_counter()
+
+        def final_line() -> dict:
+            total = time.perf_counter() - start
+            return {"done_reason": "stop", "total_duration": int(total * 1e9), "load_duration": 1_000_000,
+                    "prompt_eval_count": prompt_tokens, "prompt_eval_duration": int(prefill * 1e9),
+                    "eval_count": output_tokens, "eval_duration": int(decode * 1e9)}
+
+        if payload.get("stream") is False:
+            try:
+                await asyncio.sleep(args.ollama_ttft() + prefill + decode)
+            finally:
+                gpu.release()
+            return {"model": model, "created_at": datetime.now(timezone.utc).isoformat(),
+                    "message": {"role": "assistant", "content": content}, "done": True, **final_line()}
+
+        async def stream():
+            try:
+                await asyncio.sleep(args.ollama_ttft() + prefill)
+                pieces = max(min(output_tokens // 8, len(content)), 1)
+                step = math.ceil(len(content) / pieces) if content else 0
+                for i in range(pieces):
+                    await asyncio.sleep(decode / pieces)
+                    yield chunk(model, content[i * step:(i + 1) * step])
+                yield chunk(model, "", done=True, **final_line())
+            finally:
+                gpu.release()
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    @app.get("/mock/stats")
+    async def stats():
+        return {**counters, "parallel": args.ollama_parallel}
+
+    return app
+
+
+# ===========================
+# Gemini
+# ===========================
+def gemini_error(code: int, status: str) -> JSONResponse:
+    return JSONResponse({"error": {"code": code, "message": f"mock {status}", "status": status}}, status_code=code)
+
+
+def gemini_text(prompt: str) -> str:
+    """Canned answer matching the prompt built in mistral_model.py."""
+    if "strict JSON fixer" in prompt:
+        return EVALUATION_JSON
+    if "criterion only" in prompt:
+        return CRITERION_JSON
+    if '{"summary"' in prompt:
+        return SUMMARY_JSON
+    return CONSTRUCTIVE_JSON
+
+
+def create_gemini_app(args) -> FastAPI:
+    app = FastAPI(title="Mock Gemini")
+    counters = {"requests": 0, "errors": 0, "rate_limited": 0, "uploads": 0}
+    uploads = {}
+
+    @app.post("/{version}/models/{model_action}")
+    async def generate_content(version: str, model_action: str, request: Request):
+        model, _, action = model_action.partition(":")
+        if action != "generateContent":
+            return gemini_error(404, "NOT_FOUND")
+        payload = await request.json()
+        counters["requests"] += 1
+        await asyncio.sleep(args.gemini_latency())
+        if random.random() < args.gemini_429_rate:
+            counters["rate_limited"] += 1
+            return gemini_error(429, "RESOURCE_EXHAUSTED")
+        if random.random() < args.gemini_error_rate:
+            counters["errors"] += 1
+            return gemini_error(503, "UNAVAILABLE")
+        prompt = "".join(
+            part.get("text", "") for content in payload.get("contents", []) for part in content.get("parts", [])
+        )
+        text = gemini_text(prompt)
+        prompt_tokens = estimate_tokens(prompt)
+        output_tokens = estimate_tokens(text)
+        return {
+            "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP",
+                            "index": 0}],
+            "usageMetadata": {"promptTokenCount": prompt_tokens, "candidatesTokenCount": output_tokens,
+                              "totalTokenCount": prompt_tokens + output_tokens},
+            "modelVersion": model,
+        }
+
+    @app.post("/upload/{version}/files")
+    async def upload(version: str, request: Request, upload_id: str = None):
+        command = request.headers.get("x-goog-upload-command", "")
+        if upload_id is None:
+            # Start of a resumable upload: hand out the URL the data is sent to
+            upload_id = uuid.uuid4().hex
+            body = await request.body()
+            metadata = json.loads(body or b"{}").get("file", {})
+            uploads[upload_id] = {"size": 0, "mimeType": metadata.get("mimeType") or "application/pdf"}
+            url = f"{str(request.base_url).rstrip('/')}/upload/{version}/files?upload_id={upload_id}"
+            return Response(headers={"x-goog-upload-url": url, "x-goog-upload-status": "active"})
+        state = uploads.get(upload_id)
+        if state is None:
+            return gemini_error(404, "NOT_FOUND")
+        state["size"] += len(await request.body())
+        if "finalize" not in command:
+            return Response(headers={"x-goog-upload-status": "active"})
+        await asyncio.sleep(args.gemini_upload_latency())
+        counters["uploads"] += 1
+        name = f"files/{upload_id[:12]}"
+        now = datetime.now(timezone.utc).isoformat()
+        file = {"name": name, "mimeType": state["mimeType"], "sizeBytes": str(state["size"]),
+                "createTime": now, "updateTime": now, "state": "ACTIVE",
+                "uri": f"{str(request.base_url).rstrip('/')}/{version}/{name}"}
+        return JSONResponse({"file": file}, headers={"x-goog-upload-status": "final"})
+
+    @app.get("/mock/stats")
+    async def stats():
+        return counters
+
+    return app
+
+
+async def serve(args) -> None:
+    servers = [
+        uvicorn.Server(uvicorn.Config(create_ollama_app(args), host=args.host, port=args.ollama_port,
+                                      log_level="warning")),
+        uvicorn.Server(uvicorn.Config(create_gemini_app(args), host=args.host, port=args.gemini_port,
+                                      log_level="warning")),
+    ]
+    print(f"Mock Ollama on http://{args.host}:{args.ollama_port}/api/chat, "
+          f"mock Gemini on http://{args.host}:{args.gemini_port}")
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--ollama-port", type=int, default=11435)
+    parser.add_argument("--gemini-port", type=int, default=8089)
+    parser.add_argument("--seed", type=int)
+    ollama = parser.add_argument_group("Ollama")
+    ollama.add_argument("--ollama-model", default="ielts-mistral:latest")
+    ollama.add_argument("--ollama-parallel", type=int, default=1, help="concurrent generations (OLLAMA_NUM_PARALLEL)")
+    ollama.add_argument("--ollama-ttft", type=parse_distribution, default="lognormal:0.3,0.3",
+                        help="time to first token, seconds")
+    ollama.add_argument("--ollama-output-tokens", type=parse_distribution, default="normal:600,150")
+    ollama.add_argument("--ollama-tps", type=float, default=40.0, help="decode tokens per second")
+    ollama.add_argument("--ollama-prefill-tps", type=float, default=1500.0, help="prompt tokens per second")
+    ollama.add_argument("--ollama-error-rate", type=float, default=0.0)
+    gemini = parser.add_argument_group("Gemini")
+    gemini.add_argument("--gemini-latency", type=parse_distribution, default="lognormal:1.5,0.4", help="seconds")
+    gemini.add_argument("--gemini-upload-latency", type=parse_distribution, default="const:0.5", help="seconds")
+    gemini.add_argument("--gemini-error-rate", type=float, default=0.0, help="share of calls answered 503")
+    gemini.add_argument("--gemini-429-rate", type=float, default=0.0, help="share of calls answered 429")
+    args = parser.parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+    asyncio.run(serve(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""
+Ollama replica pool.
+Routes each chat generation to the healthy Ollama replica with the fewest
+in-flight requests and fails over to the next replica on connection errors.
+Replicas are health-checked through /api/tags.
+
+In-flight generations per replica are capped at OLLAMA_NUM_PARALLEL (the
+server's parallel slots); extra requests wait in the pool's own queue, whose
+depth and wait time are reported by stats() and exported as Prometheus metrics
+along with every model load (preloads, and reloads after an eviction). The model is preloaded and pinned
+in memory with keep_alive so idle periods do not trigger a reload.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from urllib.parse import urlsplit
+import httpx
+from dotenv import load_dotenv
+import metrics
+import tracing
+import usage
+
+load_dotenv()
+
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "ielts-mistral:latest")
+# "-1" keeps the model loaded indefinitely; any Ollama duration ("30m", "24h") works too
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "-1")
+# Must match the server's OLLAMA_NUM_PARALLEL so requests queue here, not inside Ollama
+OLLAMA_NUM_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", "1"))
+# A generation whose load_duration exceeds this (seconds) is counted as a model load
+OLLAMA_LOAD_EVENT_THRESHOLD = float(os.getenv("OLLAMA_LOAD_EVENT_THRESHOLD", "0.5"))
+
+# Comma separated list of chat endpoints; falls back to the single OLLAMA_CHAT_ENDPOINT
+OLLAMA_CHAT_ENDPOINTS = os.getenv("OLLAMA_CHAT_ENDPOINTS", "")
+OLLAMA_CHAT_ENDPOINT = os.getenv("OLLAMA_CHAT_ENDPOINT")
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "15"))
+# How many more in-flight requests the affinity replica may have than the least-loaded one
+OLLAMA_AFFINITY_SLACK = int(os.getenv("OLLAMA_AFFINITY_SLACK", "1"))
+
+
+def load_chat_endpoints() -> list:
+    endpoints = [e.strip() for e in OLLAMA_CHAT_ENDPOINTS.split(",") if e.strip()]
+    if not endpoints and OLLAMA_CHAT_ENDPOINT:
+        endpoints = [OLLAMA_CHAT_ENDPOINT]
+    return endpoints
+
+
+def base_url(endpoint: str) -> str:
+    """http://ollama:11434/api/chat -> http://ollama:11434"""
+    parts = urlsplit(endpoint)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+class OllamaReplica:
+    def __init__(self, chat_endpoint: str, slots: int = OLLAMA_NUM_PARALLEL):
+        self.chat_endpoint = chat_endpoint
+        self.base_url = base_url(chat_endpoint)
+        self.slots = max(slots, 1)
+        self.in_flight = 0
+        self.healthy = True
+        self.last_checked = 0.0
+        self.counters = {"requests": 0, "failures": 0, "failovers": 0, "model_loads": 0, "load_seconds": 0.0,
+                         "affinity_hits": 0}
+
+    def stats(self) -> dict:
+        return {**self.counters, "in_flight": self.in_flight, "slots": self.slots, "healthy": self.healthy}
+
+
+class OllamaPool:
+    """Least-outstanding-requests router over a list of Ollama replicas."""
+
+    def __init__(self, chat_endpoints: list, health_interval: float = OLLAMA_HEALTH_INTERVAL):
+        self.replicas = [OllamaReplica(e) for e in chat_endpoints]
+        self.health_interval = health_interval
+        self._slot_free = asyncio.Condition()
+        self.queue_depth = 0
+        self.queue_counters = {"queued": 0, "max_queue_depth": 0, "total_wait": 0.0}
+        # Gauges read the live values at scrape time, so they never drift from stats()
+        metrics.OLLAMA_QUEUE_DEPTH.set_function(lambda: self.queue_depth)
+        for replica in self.replicas:
+            metrics.OLLAMA_IN_FLIGHT.labels(replica.base_url).set_function(lambda r=replica: r.in_flight)
+            metrics.OLLAMA_HEALTHY.labels(replica.base_url).set_function(lambda r=replica: float(r.healthy))
+
+    async def check_health(self, replica: OllamaReplica, client: httpx.AsyncClient) -> bool:
+        try:
+            response = await client.get(f"{replica.base_url}/api/tags", timeout=5.0)
+            replica.healthy = response.status_code == 200
+        except httpx.HTTPError:
+            replica.healthy = False
+        replica.last_checked = time.monotonic()
+        return replica.healthy
+
+    async def check_all(self) -> dict:
+        async with httpx.AsyncClient() as client:
+            await asyncio.gather(*(self.check_health(r, client) for r in self.replicas))
+        return self.stats()
+
+    async def _refresh_stale(self, client: httpx.AsyncClient) -> None:
+        """Re-probe unhealthy replicas whose last check is older than the interval."""
+        now = time.monotonic()
+        stale = [r for r in self.replicas if not r.healthy and now - r.last_checked > self.health_interval]
+        if stale:
+            await asyncio.gather(*(self.check_health(r, client) for r in stale))
+
+    def candidate_replicas(self, tried: set) -> list:
+        """Untried healthy replicas by in-flight count; unhealthy ones only as a last resort."""
+        untried = [r for r in self.replicas if r not in tried]
+        healthy = sorted((r for r in untried if r.healthy), key=lambda r: r.in_flight)
+        return healthy or [r for r in untried if not r.healthy]
+
+    def affinity_replica(self, affinity_key: str):
+        """Stable replica choice for a key (e.g. the question prefix), so its KV cache is reused."""
+        if not affinity_key or not self.replicas:
+            return None
+        digest = hashlib.sha256(affinity_key.encode("utf-8")).digest()
+        return self.replicas[int.from_bytes(digest[:8], "big") % len(self.replicas)]
+
+    def pick_free(self, candidates: list, affinity):
+        free = [r for r in candidates if r.in_flight < r.slots]
+        if not free:
+            return None
+        if affinity in free and affinity.in_flight <= free[0].in_flight + OLLAMA_AFFINITY_SLACK:
+            affinity.counters["affinity_hits"] += 1
+            return affinity
+        return free[0]
+
+    async def acquire(self, tried: set, affinity_key: str = None):
+        """Wait for a free slot on the best untried replica; None once all were tried."""
+        affinity = self.affinity_replica(affinity_key)
+        start = time.monotonic()
+        async with self._slot_free:
+            self.queue_depth += 1
+            self.queue_counters["max_queue_depth"] = max(self.queue_counters["max_queue_depth"], self.queue_depth)
+            queued = False
+            try:
+                while True:
+                    candidates = self.candidate_replicas(tried)
+                    if not candidates:
+                        return None
+                    replica = self.pick_free(candidates, affinity)
+                    if replica:
+                        replica.in_flight += 1
+                        self.queue_counters["total_wait"] += time.monotonic() - start
+                        metrics.OLLAMA_QUEUE_WAIT.observe(time.monotonic() - start)
+                        usage.add_queue_time(time.monotonic() - start)
+                        return replica
+                    if not queued:
+                        queued = True
+                        self.queue_counters["queued"] += 1
+                        metrics.OLLAMA_QUEUED.inc()
+                    await self._slot_free.wait()
+            finally:
+                self.queue_depth -= 1
+
+    async def release(self, replica: OllamaReplica) -> None:
+        async with self._slot_free:
+            replica.in_flight -= 1
+            self._slot_free.notify_all()
+
+    def record_load(self, replica: OllamaReplica, response: httpx.Response) -> None:
+        """
+        Count model (re)loads reported in the final NDJSON line's load_duration, and
+        put its token counts on the current trace span and usage record.
+        """
+        lines = response.text.strip().splitlines()
+        try:
+            final = json.loads(lines[-1])
+            load_seconds = final.get("load_duration", 0) / 1e9
+        except (IndexError, ValueError, AttributeError):
+            return
+        tracing.set_attribute("llm.prompt_tokens", final.get("prompt_eval_count", 0))
+        tracing.set_attribute("llm.output_tokens", final.get("eval_count", 0))
+        tracing.set_attribute("llm.load_seconds", round(load_seconds, 3))
+        usage.record(prompt_tokens=final.get("prompt_eval_count", 0), output_tokens=final.get("eval_count", 0),
+                     generation_seconds=final.get("eval_duration", 0) / 1e9 or None,
+                     load_seconds=round(load_seconds, 3))
+        if load_seconds > OLLAMA_LOAD_EVENT_THRESHOLD:
+            replica.counters["model_loads"] += 1
+            replica.counters["load_seconds"] += load_seconds
+            metrics.record_ollama_load(replica.base_url, "reload", load_seconds)
+            print(f"Ollama replica {replica.base_url} loaded the model in {load_seconds:.1f}s")
+
+    def seconds_until_available(self):
+        """
+        None while a replica is healthy or due for a re-check (the next request
+        re-checks it), else seconds until the earliest re-check.
+        """
+        if not self.replicas:
+            return self.health_interval
+        now = time.monotonic()
+        waits = [0.0 if r.healthy else r.last_checked + self.health_interval - now for r in self.replicas]
+        soonest = min(waits)
+        return None if soonest <= 0 else soonest
+
+    async def post_chat(self, payload: dict, client: httpx.AsyncClient, affinity_key: str = None) -> httpx.Response:
+        """
+        POST payload to the least-loaded replica with a free slot, preferring the
+        affinity replica for affinity_key. Connection errors mark the replica
+        unhealthy and the request fails over to the next one; HTTP status errors
+        are raised to the caller unchanged.
+        """
+        if not self.replicas:
+            raise httpx.ConnectError("No Ollama endpoint configured")
+        await self._refresh_stale(client)
+        last_error = None
+        tried = set()
+        while True:
+            replica = await self.acquire(tried, affinity_key)
+            if replica is None:
+                raise last_error
+            tried.add(replica)
+            replica.counters["requests"] += 1
+            if len(tried) > 1:
+                replica.counters["failovers"] += 1
+            try:
+                tracing.set_attribute("ollama.replica", replica.base_url)
+                usage.record(key=replica.base_url, retries=len(tried) - 1)
+                # The trace context travels with the request for proxies/collectors in front of Ollama
+                response = await client.post(replica.chat_endpoint, json=payload, headers=tracing.propagation_headers())
+                response.raise_for_status()
+                self.record_load(replica, response)
+                return response
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError) as e:
+                replica.counters["failures"] += 1
+                replica.healthy = False
+                replica.last_checked = time.monotonic()
+                last_error = e
+                print(f"Ollama replica {replica.base_url} unreachable ({e}); failing over")
+            finally:
+                await self.release(replica)
+
+    async def preload(self, model: str = OLLAMA_MODEL, keep_alive: str = OLLAMA_KEEP_ALIVE) -> None:
+        """Load the model on every replica and pin it with keep_alive (empty generate request)."""
+        payload = {"model": model, "keep_alive": keep_alive, "stream": False}
+        timeout = httpx.Timeout(300.0, connect=10.0)
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            async def load(replica):
+                start = time.monotonic()
+                try:
+                    response = await client.post(f"{replica.base_url}/api/generate", json=payload)
+                    response.raise_for_status()
+                    replica.healthy = True
+                    replica.counters["model_loads"] += 1
+                    replica.counters["load_seconds"] += time.monotonic() - start
+                    metrics.record_ollama_load(replica.base_url, "preload", time.monotonic() - start)
+                    print(f"Preloaded {model} on {replica.base_url} in {time.monotonic() - start:.1f}s")
+                except httpx.HTTPError as e:
+                    replica.healthy = False
+                    print(f"Failed to preload {model} on {replica.base_url}: {e}")
+                replica.last_checked = time.monotonic()
+            await asyncio.gather(*(load(r) for r in self.replicas))
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            **self.queue_counters,
+            "replicas": {r.base_url: r.stats() for r in self.replicas},
+        }
+
+
+_pool = None
+
+
+def get_ollama_pool() -> OllamaPool:
+    """Process-wide pool built lazily from the environment."""
+    global _pool
+    if _pool is None:
+        _pool = OllamaPool(load_chat_endpoints())
+    return _pool
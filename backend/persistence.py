@@ -0,0 +1,131 @@
+"""
+Non-blocking persistence of evaluation and grammar correction documents.
+Uses PyMongo's async client so inserts never block the event loop. With
+MONGO_WRITE_BEHIND=1, documents are buffered in a bounded queue and
+bulk-inserted in batches by a background flusher that retries failed batches
+and drains the buffer on shutdown.
+"""
+
+import asyncio
+import os
+import time
+from collections import defaultdict
+from dotenv import load_dotenv
+from pymongo import AsyncMongoClient
+from pymongo.errors import BulkWriteError, PyMongoError
+from metrics import observe
+
+load_dotenv()
+
+MONGO_URI = os.getenv("MONGO_URI")
+MONGO_WRITE_BEHIND = os.getenv("MONGO_WRITE_BEHIND", "0") == "1"
+# Maximum buffered documents; when full, writes go straight to MongoDB instead
+MONGO_WRITE_BUFFER_MAX = int(os.getenv("MONGO_WRITE_BUFFER_MAX", "1000"))
+MONGO_WRITE_BATCH_SIZE = int(os.getenv("MONGO_WRITE_BATCH_SIZE", "50"))
+MONGO_WRITE_FLUSH_INTERVAL = float(os.getenv("MONGO_WRITE_FLUSH_INTERVAL", "1.0"))
+MONGO_WRITE_RETRIES = int(os.getenv("MONGO_WRITE_RETRIES", "3"))
+
+
+class SessionWriter:
+    """Writes documents to named collections, directly or through the write-behind buffer."""
+
+    def __init__(self, uri: str = MONGO_URI, write_behind: bool = MONGO_WRITE_BEHIND,
+                 buffer_max: int = MONGO_WRITE_BUFFER_MAX, batch_size: int = MONGO_WRITE_BATCH_SIZE):
+        self.client = AsyncMongoClient(uri)
+        self.db = self.client.ielts_writing_evaluation
+        self.write_behind = write_behind
+        self.batch_size = batch_size
+        self.buffer = asyncio.Queue(maxsize=buffer_max)
+        self._flusher = None
+        self._stopping = asyncio.Event()
+        self.counters = {"written": 0, "buffered": 0, "direct_overflow": 0, "batches": 0, "retries": 0, "dropped": 0}
+
+    async def _insert_many(self, collection: str, documents: list) -> None:
+        """insert_many with retries; duplicates from a partially applied batch are ignored."""
+        for attempt in range(MONGO_WRITE_RETRIES + 1):
+            try:
+                with observe("mongo_write", {"collection": collection, "batch_size": len(documents)}):
+                    await self.db[collection].insert_many(documents, ordered=False)
+                self.counters["written"] += len(documents)
+                return
+            except BulkWriteError as e:
+                # Only duplicate-key errors (11000) mean the documents are already stored
+                if all(err.get("code") == 11000 for err in e.details.get("writeErrors", [])):
+                    self.counters["written"] += len(documents)
+                    return
+                error = e
+            except PyMongoError as e:
+                error = e
+            if attempt < MONGO_WRITE_RETRIES:
+                self.counters["retries"] += 1
+                await asyncio.sleep(min(2 ** attempt, 30))
+        self.counters["dropped"] += len(documents)
+        print(f"Dropping {len(documents)} document(s) for {collection} after retries: {error}")
+
+    def _buffer(self, items: list) -> bool:
+        """Queue (collection, document) pairs for the flusher; False when write-behind is off or full."""
+        if not self.write_behind or self._flusher is None:
+            return False
+        if self.buffer.qsize() + len(items) > self.buffer.maxsize:
+            # Buffer full: fall back to a direct write rather than growing memory
+            self.counters["direct_overflow"] += 1
+            return False
+        for item in items:
+            self.buffer.put_nowait(item)
+            self.counters["buffered"] += 1
+        return True
+
+    async def write(self, documents: dict) -> None:
+        """
+        Persist {collection: document}. With write-behind the call returns as soon
+        as the documents are buffered; otherwise the inserts run concurrently.
+        """
+        if self._buffer(list(documents.items())):
+            return
+        await asyncio.gather(*(self._insert_many(c, [d]) for c, d in documents.items()))
+
+    async def write_many(self, collection: str, documents: list) -> None:
+        """Persist several documents of one collection, buffered like write()."""
+        if not documents or self._buffer([(collection, d) for d in documents]):
+            return
+        await self._insert_many(collection, documents)
+
+    async def _flush_batch(self) -> None:
+        batch = defaultdict(list)
+        count = 0
+        while count < self.batch_size and not self.buffer.empty():
+            collection, document = self.buffer.get_nowait()
+            batch[collection].append(document)
+            count += 1
+        if count:
+            self.counters["batches"] += 1
+            await asyncio.gather(*(self._insert_many(c, docs) for c, docs in batch.items()))
+            for _ in range(count):
+                self.buffer.task_done()
+
+    async def _flush_loop(self) -> None:
+        while not self._stopping.is_set():
+            deadline = time.monotonic() + MONGO_WRITE_FLUSH_INTERVAL
+            # Flush early when a full batch is waiting
+            while (self.buffer.qsize() < self.batch_size and time.monotonic() < deadline
+                   and not self._stopping.is_set()):
+                await asyncio.sleep(0.05)
+            await self._flush_batch()
+
+    def start(self) -> None:
+        if self.write_behind and self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        """Stop the flusher and write out everything still buffered."""
+        if self._flusher is not None:
+            # Let the flusher finish its current batch instead of cancelling it mid-insert
+            self._stopping.set()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        while not self.buffer.empty():
+            await self._flush_batch()
+        await self.client.close()
+
+    def stats(self) -> dict:
+        return {**self.counters, "write_behind": self.write_behind, "buffer_depth": self.buffer.qsize()}
@@ -0,0 +1,196 @@
+"""
+Small declarative DAG executor for the essay pipeline.
+Each Stage names the inputs it needs (pipeline inputs or other stages' outputs).
+A stage starts as soon as all of its inputs are ready, on its executor:
+  - "loop": async function awaited on the event loop (I/O bound: Ollama, Gemini)
+  - "cpu":  sync function run on the shared CPU thread pool (BERT, CoEdIT)
+  - "io":   sync function run on the default thread pool (blocking I/O such as uploads)
+A stage may carry an admission limiter (see admission.py); it then waits for a
+slot in that stage's bounded queue before running.
+Per-stage queue time (inputs ready -> stage actually running) and wall time are
+recorded and returned with the results.
+Under a request deadline (see deadline.py) every stage is bounded by the remaining
+budget: stages still running when it is spent are cancelled and marked "timeout",
+their dependents are "skipped", and with partial=True the finished results are
+returned instead of an error. With partial=True a stage that raises is handled
+the same way (marked "failed", dependents skipped, the rest still returned).
+While an on-demand profiling session is active (see profiling.py), thread-pool
+stages are profiled on their worker thread and per-stage memory deltas recorded.
+"""
+
+import asyncio
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from deadline import DeadlineExceeded, remaining
+from metrics import error_cause, observe_pipeline_stage
+import profiling
+import tracing
+
+load_dotenv()
+
+# torch already parallelizes inside an op; a few model calls at a time is enough. Keep it at
+# least the BERT + grammar admission limits so ordering is decided by the (priority-aware) limiters
+PIPELINE_CPU_WORKERS = int(os.getenv("PIPELINE_CPU_WORKERS", "3"))
+cpu_executor = ThreadPoolExecutor(max_workers=PIPELINE_CPU_WORKERS, thread_name_prefix="pipeline-cpu")
+
+EXECUTORS = ("loop", "cpu", "io")
+
+OK = "ok"
+FAILED = "failed"
+TIMEOUT = "timeout"
+SKIPPED = "skipped"
+
+
+class StageUnavailable(Exception):
+    """Output of a stage that timed out or was skipped."""
+
+
+class Stage:
+    def __init__(self, name: str, fn, inputs: list = None, executor: str = "loop", limiter=None):
+        if executor not in EXECUTORS:
+            raise ValueError(f"Unknown executor {executor!r} for stage {name!r}")
+        self.name = name
+        self.fn = fn
+        self.inputs = inputs or []
+        self.executor = executor
+        self.limiter = limiter
+
+
+class Pipeline:
+    def __init__(self, stages: list):
+        self.stages = {stage.name: stage for stage in stages}
+        self._validate()
+
+    def _validate(self) -> None:
+        """Reject cycles; unknown input names are checked against the run() inputs later."""
+        visiting, done = set(), set()
+
+        def visit(name):
+            if name in done or name not in self.stages:
+                return
+            if name in visiting:
+                raise ValueError(f"Pipeline cycle through stage {name!r}")
+            visiting.add(name)
+            for dep in self.stages[name].inputs:
+                visit(dep)
+            visiting.discard(name)
+            done.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    async def _execute(self, stage: Stage, kwargs: dict, timing: dict):
+        ready = time.perf_counter()
+        with tracing.span(f"stage {stage.name}", {"stage.executor": stage.executor}) as current:
+            try:
+                if stage.limiter is None:
+                    return await self._dispatch(stage, kwargs, timing, ready)
+                async with stage.limiter.slot():
+                    return await self._dispatch(stage, kwargs, timing, ready)
+            finally:
+                current.set_attribute("stage.queue_time", timing.get("queue_time", 0.0))
+
+    async def _dispatch(self, stage: Stage, kwargs: dict, timing: dict, ready: float):
+        def timed_call():
+            started = time.perf_counter()
+            timing["queue_time"] = round(started - ready, 4)
+            return stage.fn(**kwargs)
+
+        with profiling.stage_memory(stage.name):
+            if stage.executor == "loop":
+                timing["queue_time"] = round(time.perf_counter() - ready, 4)
+                result = await stage.fn(**kwargs)
+            elif stage.executor == "cpu":
+                # run_in_executor does not carry context variables (the deadline) into the thread
+                context = contextvars.copy_context()
+                result = await asyncio.get_running_loop().run_in_executor(
+                    cpu_executor, context.run, profiling.profiled(timed_call))
+            else:
+                result = await asyncio.to_thread(profiling.profiled(timed_call))
+        timing["wall_time"] = round(time.perf_counter() - ready, 4)
+        return result
+
+    async def run(self, inputs: dict, partial: bool = False) -> tuple:
+        """
+        Run every stage; returns (results, timings) where results holds the inputs
+        and each finished stage's output by name. The first failing stage cancels
+        the rest and its exception is raised. Stages cut off by the deadline raise
+        DeadlineExceeded. With partial=True, timed-out and failed stages (and their
+        dependents) are left out of the results instead.
+        """
+        for stage in self.stages.values():
+            missing = [d for d in stage.inputs if d not in self.stages and d not in inputs]
+            if missing:
+                raise ValueError(f"Stage {stage.name!r} needs unknown inputs {missing}")
+
+        loop = asyncio.get_running_loop()
+        outputs = {name: loop.create_future() for name in self.stages}
+        for name, value in inputs.items():
+            if name not in outputs:
+                outputs[name] = loop.create_future()
+                outputs[name].set_result(value)
+        timings = {name: {"executor": stage.executor} for name, stage in self.stages.items()}
+        start = time.perf_counter()
+
+        async def run_stage(stage: Stage):
+            timing = timings[stage.name]
+            try:
+                kwargs = {dep: await outputs[dep] for dep in stage.inputs}
+            except StageUnavailable:
+                timing["status"] = SKIPPED
+                outputs[stage.name].set_exception(StageUnavailable(stage.name))
+                return
+            timing["started_at"] = round(time.perf_counter() - start, 4)
+            try:
+                result = await asyncio.wait_for(self._execute(stage, kwargs, timing), remaining())
+            except (asyncio.TimeoutError, DeadlineExceeded):
+                timing["status"] = TIMEOUT
+                timing["wall_time"] = round(time.perf_counter() - start - timing["started_at"], 4)
+                outputs[stage.name].set_exception(StageUnavailable(stage.name))
+                return
+            except asyncio.CancelledError:
+                timing["status"] = "cancelled"
+                raise
+            except BaseException as e:
+                timing["status"] = FAILED
+                if partial and isinstance(e, Exception):
+                    # Keep what the other stages produce; the failure shows in the stage status
+                    timing["error"] = error_cause(e)
+                    timing["wall_time"] = round(time.perf_counter() - start - timing["started_at"], 4)
+                    outputs[stage.name].set_exception(StageUnavailable(stage.name))
+                    return
+                if not outputs[stage.name].done():
+                    outputs[stage.name].set_exception(e)
+                raise
+            timing["status"] = OK
+            outputs[stage.name].set_result(result)
+
+        tasks = [asyncio.create_task(run_stage(stage), name=f"stage:{name}") for name, stage in self.stages.items()]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            # Futures of failed stages are consumed by their dependents; silence the rest
+            for future in outputs.values():
+                if future.done() and not future.cancelled():
+                    future.exception()
+            for name, timing in timings.items():
+                observe_pipeline_stage(name, timing)
+        results = {
+            name: future.result() for name, future in outputs.items()
+            if future.done() and not future.cancelled() and future.exception() is None
+        }
+        unfinished = [name for name in self.stages if name not in results]
+        if unfinished and not partial:
+            raise DeadlineExceeded(f"Pipeline stages {unfinished} did not finish before the deadline")
+        summary = {
+            "status": "partial" if unfinished else "complete",
+            "total_time": round(time.perf_counter() - start, 4),
+            "stages": timings,
+        }
+        return results, summary
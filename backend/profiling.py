@@ -0,0 +1,304 @@
+"""
+On-demand profiling for production investigations.
+Off unless PROFILING_ENABLED=true, and then only driven through the admin
+endpoints (X-Admin-Token must match ADMIN_TOKEN). One session runs at a time,
+for the next N requests or a time window, and may combine:
+  - "cprofile": deterministic profile of the event loop thread plus every
+    pipeline/worker thread call made while the session is active, merged into a
+    single .prof file (pstats, snakeviz, `python -m pstats`)
+  - "sample": low-overhead stack sampling of all threads every SAMPLE_INTERVAL,
+    written as collapsed stacks (.folded: flamegraph.pl, speedscope)
+  - memory: a tracemalloc snapshot (.tracemalloc, load with
+    tracemalloc.Snapshot.load) with a top-allocations text summary, and per-stage
+    RSS / traced memory deltas (-memory.json)
+Profiles include everything the process ran during the session, so concurrent
+requests show up in the same artifact.
+While no session is active the hooks cost one attribute check.
+"""
+
+import asyncio
+import cProfile
+import json
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "600"))
+SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+TRACEMALLOC_FRAMES = int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", "10"))
+MODES = ("cprofile", "sample")
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+class ProfilingError(Exception):
+    pass
+
+
+def rss_bytes() -> int:
+    """Current resident set size (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class StackSampler:
+    """Background thread counting the collapsed stack of every other thread."""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def write(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class ProfileSession:
+    def __init__(self, modes: list, requests: int = None, seconds: float = None, memory: bool = False,
+                 interval: float = SAMPLE_INTERVAL):
+        self.id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:6]
+        self.modes = modes
+        self.request_limit = requests
+        self.seconds = min(seconds or PROFILE_MAX_SECONDS, PROFILE_MAX_SECONDS)
+        self.memory = memory
+        self.started_at = time.time()
+        self.requests_done = 0
+        self.artifacts = []
+        self.stage_memory = {}
+        self._lock = threading.Lock()
+        self._thread_profiles = []
+        self._loop_profiler = cProfile.Profile() if "cprofile" in modes else None
+        self._sampler = StackSampler(interval) if "sample" in modes else None
+        self._owns_tracemalloc = False
+
+    def start(self) -> None:
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self._owns_tracemalloc = True
+        if self._sampler is not None:
+            self._sampler.start()
+        if self._loop_profiler is not None:
+            # Called on the event loop thread: profiles every coroutine step from here on
+            self._loop_profiler.enable()
+
+    def run_profiled(self, fn, *args, **kwargs):
+        """Run a worker-thread call under its own profiler, merged into the session's .prof."""
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profiler.disable()
+            with self._lock:
+                self._thread_profiles.append(profiler)
+
+    def record_stage(self, stage: str, rss_delta: int, traced_delta: int, seconds: float) -> None:
+        with self._lock:
+            entry = self.stage_memory.setdefault(
+                stage, {"count": 0, "rss_delta_total": 0, "rss_delta_max": 0, "traced_delta_total": 0,
+                        "traced_delta_max": 0, "seconds_total": 0.0})
+            entry["count"] += 1
+            entry["rss_delta_total"] += rss_delta
+            entry["rss_delta_max"] = max(entry["rss_delta_max"], rss_delta)
+            entry["traced_delta_total"] += traced_delta
+            entry["traced_delta_max"] = max(entry["traced_delta_max"], traced_delta)
+            entry["seconds_total"] = round(entry["seconds_total"] + seconds, 4)
+
+    def stop(self) -> list:
+        """Stop collecting and write the artifacts; returns their file names."""
+        if self._loop_profiler is not None:
+            self._loop_profiler.disable()
+        if self._sampler is not None:
+            self._sampler.stop()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, self.id)
+
+        if self._loop_profiler is not None:
+            stats = pstats.Stats(self._loop_profiler)
+            with self._lock:
+                if self._thread_profiles:
+                    stats.add(*self._thread_profiles)
+            stats.dump_stats(base + ".prof")
+            self.artifacts.append(self.id + ".prof")
+        if self._sampler is not None:
+            self._sampler.write(base + ".folded")
+            self.artifacts.append(self.id + ".folded")
+        if self.memory:
+            if tracemalloc.is_tracing():
+                snapshot = tracemalloc.take_snapshot()
+                snapshot.dump(base + ".tracemalloc")
+                with open(base + "-top.txt", "w", encoding="utf-8") as f:
+                    for stat in snapshot.statistics("lineno")[:50]:
+                        f.write(f"{stat}\n")
+                self.artifacts += [self.id + ".tracemalloc", self.id + "-top.txt"]
+            if self._owns_tracemalloc:
+                tracemalloc.stop()
+            with open(base + "-memory.json", "w", encoding="utf-8") as f:
+                json.dump({"rss_bytes": rss_bytes(), "stages": self.stage_memory}, f, indent=2)
+            self.artifacts.append(self.id + "-memory.json")
+        return self.artifacts
+
+    def status(self) -> dict:
+        return {
+            "id": self.id,
+            "modes": self.modes,
+            "memory": self.memory,
+            "request_limit": self.request_limit,
+            "requests_done": self.requests_done,
+            "seconds": self.seconds,
+            "elapsed": round(time.time() - self.started_at, 3),
+            "samples": self._sampler.samples if self._sampler is not None else None,
+        }
+
+
+_session = None
+_timer = None
+_last = None
+
+
+def active() -> bool:
+    return _session is not None
+
+
+def start(modes: list, requests: int = None, seconds: float = None, memory: bool = False,
+          interval: float = SAMPLE_INTERVAL) -> dict:
+    """Begin a session on the event loop thread; it ends after `requests` requests or `seconds`."""
+    global _session, _timer
+    if not PROFILING_ENABLED:
+        raise ProfilingError("Profiling is disabled (PROFILING_ENABLED)")
+    if _session is not None:
+        raise ProfilingError(f"Profiling session {_session.id} is already running")
+    unknown = [mode for mode in modes if mode not in MODES]
+    if unknown or not (modes or memory):
+        raise ProfilingError(f"Choose modes from {list(MODES)} and/or memory=true")
+    if requests is not None and requests < 1:
+        raise ProfilingError("requests must be at least 1")
+    session = ProfileSession(modes, requests, seconds, memory, interval)
+    session.start()
+    _session = session
+    # The time window also bounds a request-count session, so a forgotten one cannot run forever
+    _timer = asyncio.get_running_loop().call_later(session.seconds, stop)
+    return session.status()
+
+
+def stop() -> dict:
+    """End the running session and write its artifacts."""
+    global _session, _timer, _last
+    session = _session
+    if session is None:
+        raise ProfilingError("No profiling session is running")
+    _session = None
+    if _timer is not None:
+        _timer.cancel()
+        _timer = None
+    session.stop()
+    _last = {**session.status(), "artifacts": session.artifacts}
+    return _last
+
+
+def status() -> dict:
+    return {
+        "enabled": PROFILING_ENABLED,
+        "active": _session.status() if _session is not None else None,
+        "last": _last,
+        "artifacts": list_artifacts(),
+    }
+
+
+def request_finished() -> None:
+    """Count a served pipeline request towards the session's request limit."""
+    session = _session
+    if session is None or session.request_limit is None:
+        return
+    session.requests_done += 1
+    if session.requests_done >= session.request_limit:
+        stop()
+
+
+def profiled(fn):
+    """`fn` wrapped to be profiled on its worker thread while a cProfile session is active."""
+    session = _session
+    if session is None or session._loop_profiler is None:
+        return fn
+    return lambda *args, **kwargs: session.run_profiled(fn, *args, **kwargs)
+
+
+@contextmanager
+def _measure_stage(session: ProfileSession, stage: str):
+    rss_before = rss_bytes()
+    traced_before = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        traced_after = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        session.record_stage(stage, rss_bytes() - rss_before, traced_after - traced_before,
+                             time.perf_counter() - start)
+
+
+def stage_memory(stage: str):
+    """
+    Context manager recording the process RSS (and traced memory) delta of a
+    stage while a memory session is active. Deltas of concurrent stages overlap.
+    """
+    session = _session
+    if session is None or not session.memory:
+        return nullcontext()
+    return _measure_stage(session, stage)
+
+
+def list_artifacts() -> list:
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    return sorted(os.listdir(PROFILE_DIR), reverse=True)
+
+
+def artifact_path(name: str):
+    """Path of a downloadable artifact, or None (names are plain file names inside PROFILE_DIR)."""
+    if os.path.basename(name) != name or name not in list_artifacts():
+        return None
+    return os.path.join(PROFILE_DIR, name)
@@ -0,0 +1,92 @@
+"""
+Payload size and serialization time report for /essay_process responses.
+Compares FastAPI's default path (jsonable_encoder + json.dumps) with orjson,
+and the size and cost of gzip/brotli compression on top.
+
+Usage:
+    python serialization_report.py responses.json   # list of saved /essay_process responses
+    python serialization_report.py --mongo 20       # latest stored sessions
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import time
+from dotenv import load_dotenv
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pymongo import AsyncMongoClient, DESCENDING
+from compression import GZIP_LEVEL, BROTLI_QUALITY, brotli
+from sessions import get_session
+
+load_dotenv()
+
+
+def timed(fn, repeat: int) -> tuple:
+    """(last result, mean milliseconds per call)"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - start) * 1000 / repeat
+
+
+def measure(payload: dict, repeat: int = 50) -> dict:
+    # Before: FastAPI validates/encodes the returned dict, then Starlette's json.dumps
+    default_body, default_ms = timed(lambda: JSONResponse(jsonable_encoder(payload)).body, repeat)
+    # After: the handler returns ORJSONResponse, serialized once by orjson
+    orjson_body, orjson_ms = timed(lambda: ORJSONResponse(payload).body, repeat)
+    gzip_body, gzip_ms = timed(lambda: gzip.compress(orjson_body, compresslevel=GZIP_LEVEL), repeat)
+    report = {
+        "default_json_bytes": len(default_body),
+        "default_json_ms": round(default_ms, 3),
+        "orjson_bytes": len(orjson_body),
+        "orjson_ms": round(orjson_ms, 3),
+        "gzip_bytes": len(gzip_body),
+        "gzip_ms": round(gzip_ms, 3),
+    }
+    if brotli is not None:
+        br_body, br_ms = timed(lambda: brotli.compress(orjson_body, quality=BROTLI_QUALITY), repeat)
+        report.update({"brotli_bytes": len(br_body), "brotli_ms": round(br_ms, 3)})
+    return report
+
+
+def load_from_mongo(limit: int) -> list:
+    async def fetch():
+        client = AsyncMongoClient(os.getenv("MONGO_URI"))
+        db = client.ielts_writing_evaluation
+        ids = await db.evaluations.find({}, {"session_id": 1}).sort("created_at", DESCENDING) \
+            .limit(limit).to_list(length=limit)
+        sessions = [await get_session(db, doc["session_id"]) for doc in ids]
+        await client.close()
+        return [s for s in sessions if s]
+
+    return asyncio.run(fetch())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", help="JSON file with a list of /essay_process responses")
+    parser.add_argument("--mongo", type=int, metavar="N", help="use the N latest stored sessions")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    if args.mongo:
+        payloads = load_from_mongo(args.mongo)
+    elif args.path:
+        with open(args.path, encoding="utf-8") as f:
+            payloads = json.load(f)
+    else:
+        parser.error("pass a responses file or --mongo N")
+
+    reports = [measure(payload, args.repeat) for payload in payloads]
+    for i, report in enumerate(reports):
+        print(f"essay {i}: " + ", ".join(f"{k}={v}" for k, v in report.items()))
+    if reports:
+        keys = reports[0].keys()
+        mean = {k: round(sum(r[k] for r in reports) / len(reports), 3) for k in keys}
+        print("mean: " + ", ".join(f"{k}={v}" for k, v in mean.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Session retrieval from MongoDB.
+Indexes for lookups by session_id and for history listings, plus read helpers
+used by the /sessions endpoints. History pages use keyset pagination on
+(created_at, session_id) with an opaque cursor, so deep pages cost the same as
+the first one.
+"""
+
+import asyncio
+import base64
+from datetime import datetime
+from pymongo import ASCENDING, DESCENDING
+
+# Summary fields returned by history listings (no essay text or HTML)
+HISTORY_PROJECTION = {
+    "_id": 0,
+    "session_id": 1,
+    "user_id": 1,
+    "question": 1,
+    "overall_criteria_scores": 1,
+    "created_at": 1,
+}
+MAX_PAGE_SIZE = 100
+
+
+async def ensure_indexes(db) -> None:
+    await asyncio.gather(
+        db.evaluations.create_index("session_id"),
+        db.evaluations.create_index([("created_at", DESCENDING), ("session_id", DESCENDING)]),
+        db.evaluations.create_index(
+            [("user_id", ASCENDING), ("created_at", DESCENDING), ("session_id", DESCENDING)],
+            partialFilterExpression={"user_id": {"$type": "string"}},
+        ),
+        db.grammar_corrections.create_index("session_id"),
+        db.grammar_corrections.create_index("created_at"),
+    )
+
+
+def encode_cursor(document: dict) -> str:
+    raw = f"{document['created_at'].isoformat()}|{document['session_id']}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Raises ValueError for a malformed cursor."""
+    raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+    created_at, session_id = raw.split("|", 1)
+    return datetime.fromisoformat(created_at), session_id
+
+
+async def get_session(db, session_id: str):
+    """Stored evaluation and grammar correction for a session, shaped like /essay_process; None if missing."""
+    evaluation, grammar = await asyncio.gather(
+        db.evaluations.find_one({"session_id": session_id}, {"_id": 0}),
+        db.grammar_corrections.find_one({"session_id": session_id}, {"_id": 0, "session_id": 0, "created_at": 0}),
+    )
+    if evaluation is None and grammar is None:
+        return None
+    result = {"session_id": session_id, **(evaluation or {})}
+    if grammar:
+        result.update({
+            "corrected_text": grammar.get("corrected_text"),
+            "with_errors": grammar.get("with_errors"),
+            "fixed_only": grammar.get("fixed_only"),
+        })
+    return result
+
+
+async def list_sessions(db, user_id: str = None, limit: int = 20, cursor: str = None) -> dict:
+    """Newest-first page of session summaries, with next_cursor for the following page."""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    query = {}
+    if user_id is not None:
+        query["user_id"] = user_id
+    if cursor:
+        created_at, session_id = decode_cursor(cursor)
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "session_id": {"$lt": session_id}},
+        ]
+    documents = await db.evaluations.find(query, HISTORY_PROJECTION) \
+        .sort([("created_at", DESCENDING), ("session_id", DESCENDING)]) \
+        .limit(limit + 1) \
+        .to_list(length=limit + 1)
+    has_more = len(documents) > limit
+    documents = documents[:limit]
+    return {
+        "items": documents,
+        "next_cursor": encode_cursor(documents[-1]) if has_more else None,
+    }
@@ -0,0 +1,277 @@
+"""
+Lightweight request tracing.
+Spans follow the W3C trace context model (32-hex trace id, 16-hex span id,
+`traceparent` header) and are kept in a context variable, so they nest across
+pipeline tasks and worker threads. Finished spans are batched by a background
+thread and handed to a pluggable exporter chosen with TRACE_EXPORTER:
+  - "none" (default): ids are still generated and propagated, nothing exported
+  - "file": OTLP/JSON lines appended to TRACE_FILE; works offline and can be
+    replayed into an OpenTelemetry Collector with its otlpjsonfile receiver
+  - "otlp": OTLP/HTTP JSON POSTed to TRACE_OTLP_ENDPOINT (a collector's /v1/traces)
+  - "console": one line per span on stdout
+  - "package.module:Class": any class with export(spans) and shutdown()
+"""
+
+import contextvars
+import importlib
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "ielts-backend")
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none").strip()
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACE_SAMPLE_RATIO = float(os.getenv("TRACE_SAMPLE_RATIO", "1.0"))
+TRACE_FLUSH_INTERVAL = float(os.getenv("TRACE_FLUSH_INTERVAL", "2.0"))
+TRACE_BATCH_SIZE = int(os.getenv("TRACE_BATCH_SIZE", "256"))
+TRACE_QUEUE_MAX = int(os.getenv("TRACE_QUEUE_MAX", "10000"))
+
+TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "sampled", "start_ns", "end_ns",
+                 "attributes", "status", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: str = None, sampled: bool = True,
+                 attributes: dict = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.status = "ok"
+        self.error = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name, "trace_id": self.trace_id, "span_id": self.span_id,
+            "parent_id": self.parent_id, "start_ns": self.start_ns, "end_ns": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3) if self.end_ns else None,
+            "status": self.status, "error": self.error, "attributes": self.attributes,
+        }
+
+
+def parse_traceparent(header: str):
+    """(trace_id, parent span id, sampled) from a W3C traceparent header, or None."""
+    match = TRACEPARENT_RE.match((header or "").strip().lower())
+    if not match or match.group(1) == "0" * 32:
+        return None
+    return match.group(1), match.group(2), match.group(3) == "01"
+
+
+# ===========================
+# Exporters
+# ===========================
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(spans: list) -> dict:
+    """ExportTraceServiceRequest in the OTLP/JSON encoding."""
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+        "scopeSpans": [{
+            "scope": {"name": "ielts.tracing"},
+            "spans": [{
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                **({"parentSpanId": span.parent_id} if span.parent_id else {}),
+                "name": span.name,
+                "kind": 1,
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns),
+                "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in span.attributes.items()],
+                "status": {"code": 2, "message": span.error or ""} if span.status == "error" else {"code": 1},
+            } for span in spans],
+        }],
+    }]}
+
+
+class FileExporter:
+    def __init__(self, path: str = TRACE_FILE):
+        self.path = path
+
+    def export(self, spans: list) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(to_otlp(spans), ensure_ascii=False) + "\n")
+
+    def shutdown(self) -> None:
+        pass
+
+
+class OTLPHttpExporter:
+    def __init__(self, endpoint: str = TRACE_OTLP_ENDPOINT):
+        self.endpoint = endpoint
+        self.client = httpx.Client(timeout=5.0)
+
+    def export(self, spans: list) -> None:
+        response = self.client.post(self.endpoint, json=to_otlp(spans))
+        response.raise_for_status()
+
+    def shutdown(self) -> None:
+        self.client.close()
+
+
+class ConsoleExporter:
+    def export(self, spans: list) -> None:
+        for span in spans:
+            print(f"[trace] {json.dumps(span.to_dict(), ensure_ascii=False, default=str)}")
+
+    def shutdown(self) -> None:
+        pass
+
+
+def load_exporter(spec: str):
+    if spec in ("", "none"):
+        return None
+    builtin = {"file": FileExporter, "otlp": OTLPHttpExporter, "console": ConsoleExporter}
+    if spec in builtin:
+        return builtin[spec]()
+    module_name, _, class_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+class BatchSpanProcessor:
+    """Buffers finished spans (from the event loop or worker threads) and exports them from one thread."""
+
+    def __init__(self, exporter, flush_interval: float = TRACE_FLUSH_INTERVAL, batch_size: int = TRACE_BATCH_SIZE):
+        self.exporter = exporter
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=TRACE_QUEUE_MAX)
+        self.counters = {"exported": 0, "dropped": 0, "export_errors": 0}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def on_end(self, span: Span) -> None:
+        try:
+            self.queue.put_nowait(span)
+        except queue.Full:
+            self.counters["dropped"] += 1
+
+    def _drain(self) -> None:
+        while not self.queue.empty():
+            batch = []
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                self.exporter.export(batch)
+                self.counters["exported"] += len(batch)
+            except Exception as e:
+                self.counters["export_errors"] += 1
+                self.counters["dropped"] += len(batch)
+                print(f"Trace export failed: {e}")
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self._drain()
+
+    def shutdown(self) -> None:
+        self._stop.set()
+        self._thread.join(timeout=self.flush_interval + 1)
+        self._drain()
+        self.exporter.shutdown()
+
+
+_exporter = load_exporter(TRACE_EXPORTER)
+_processor = BatchSpanProcessor(_exporter) if _exporter is not None else None
+
+
+# ===========================
+# Span API
+# ===========================
+def current_span():
+    return _current_span.get()
+
+
+def current_trace_id():
+    span = _current_span.get()
+    return span.trace_id if span else None
+
+
+def traceparent():
+    span = _current_span.get()
+    return span.traceparent if span else None
+
+
+def propagation_headers() -> dict:
+    """Headers carrying the current trace context to a downstream HTTP call."""
+    header = traceparent()
+    return {"traceparent": header} if header else {}
+
+
+def set_attribute(key: str, value) -> None:
+    span = _current_span.get()
+    if span is not None:
+        span.set_attribute(key, value)
+
+
+@contextmanager
+def span(name: str, attributes: dict = None, parent: str = None):
+    """
+    Open a child of the current span (or of `parent`, a traceparent header, or a
+    new trace). Usable around sync and async code; the span is current inside the block.
+    """
+    parent_span = _current_span.get()
+    remote = parse_traceparent(parent) if parent else None
+    if remote:
+        trace_id, parent_id, sampled = remote
+    elif parent_span is not None:
+        trace_id, parent_id, sampled = parent_span.trace_id, parent_span.span_id, parent_span.sampled
+    else:
+        trace_id, parent_id, sampled = os.urandom(16).hex(), None, random.random() < TRACE_SAMPLE_RATIO
+    current = Span(name, trace_id, parent_id, sampled, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = "error"
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end_ns = time.time_ns()
+        if _processor is not None and current.sampled:
+            _processor.on_end(current)
+
+
+def stats() -> dict:
+    if _processor is None:
+        return {"exporter": "none"}
+    return {"exporter": TRACE_EXPORTER, "queued": _processor.queue.qsize(), **_processor.counters}
+
+
+def shutdown() -> None:
+    """Flush buffered spans; called on application shutdown."""
+    if _processor is not None:
+        _processor.shutdown()
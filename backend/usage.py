@@ -0,0 +1,214 @@
+"""
+LLM usage and latency ledger.
+Every Ollama/Gemini call made while serving a request (including answers served
+from the LLM response cache) becomes one record: purpose, model, key or replica,
+prompt/output tokens, tokens/sec, queue time, total latency, retries, cache hit
+and estimated cost. Records collect in a context variable during the request
+and are written to the `llm_usage` collection under the request's session_id,
+where the aggregation helpers below turn them into cost and throughput trends.
+
+Pools and limiters add what they know to the call in progress with record()
+and add_queue_time(), the same way they put attributes on the trace span.
+"""
+
+import contextvars
+import os
+import time
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from pymongo import ASCENDING, DESCENDING
+from dedup import PIPELINE_VERSION
+from metrics import error_cause
+import tracing
+
+load_dotenv()
+
+LLM_USAGE_COLLECTION = "llm_usage"
+
+
+def load_prices(spec: str) -> dict:
+    """"model:input:output,..." (USD per million tokens) -> {model: (input, output)}."""
+    prices = {}
+    for item in spec.split(","):
+        parts = item.strip().rsplit(":", 2)
+        if len(parts) == 3:
+            prices[parts[0]] = (float(parts[1]), float(parts[2]))
+    return prices
+
+
+# Local Ollama models cost nothing per token unless priced here
+LLM_PRICES = load_prices(os.getenv("LLM_PRICES", "gemini-2.5-flash-lite:0.10:0.40"))
+
+BUCKETS = ("hour", "day", "week", "month")
+GROUP_FIELDS = {"model": "$model", "purpose": "$purpose", "provider": "$provider", "key": "$key",
+                "pipeline_version": "$pipeline_version"}
+
+_ledger = contextvars.ContextVar("llm_usage_ledger", default=None)
+_call = contextvars.ContextVar("llm_usage_call", default=None)
+
+
+def estimate_cost(model: str, prompt_tokens: int, output_tokens: int) -> float:
+    input_price, output_price = LLM_PRICES.get(model, (0.0, 0.0))
+    return round((prompt_tokens * input_price + output_tokens * output_price) / 1e6, 8)
+
+
+def record(**fields) -> None:
+    """Set fields on the LLM call in progress (no-op outside llm_call)."""
+    call = _call.get()
+    if call is not None:
+        call.update(fields)
+
+
+def add_queue_time(seconds: float) -> None:
+    """Add time spent waiting for a limiter slot, replica slot or key token to the call in progress."""
+    call = _call.get()
+    if call is not None:
+        call["queue_time"] += seconds
+
+
+@contextmanager
+def llm_call(purpose: str, provider: str, model: str):
+    """
+    Ledger record for one logical LLM call (retries and failovers included), yielded
+    so the caller can mark cache hits. Kept only inside a request's ledger().
+    """
+    call = {
+        "purpose": purpose, "provider": provider, "model": model, "key": None, "status": "ok",
+        "cache_hit": False, "prompt_tokens": 0, "output_tokens": 0, "generation_seconds": None,
+        "queue_time": 0.0, "retries": 0, "created_at": datetime.now(timezone.utc),
+    }
+    token = _call.set(call)
+    start = time.perf_counter()
+    try:
+        yield call
+    except BaseException as e:
+        call["status"] = "error"
+        call["error"] = error_cause(e)
+        raise
+    finally:
+        _call.reset(token)
+        call["latency"] = round(time.perf_counter() - start, 4)
+        call["queue_time"] = round(call["queue_time"], 4)
+        generation = call["generation_seconds"]
+        call["generation_seconds"] = round(generation, 4) if generation else None
+        call["tokens_per_second"] = (round(call["output_tokens"] / generation, 2)
+                                     if generation and call["output_tokens"] else None)
+        call["cost_usd"] = 0.0 if call["cache_hit"] else \
+            estimate_cost(model, call["prompt_tokens"], call["output_tokens"])
+        ledger_records = _ledger.get()
+        if ledger_records is not None:
+            ledger_records.append(call)
+
+
+def record_cache_hit(purpose: str, provider: str, model: str) -> None:
+    """Ledger record for a call answered from the LLM response cache."""
+    with llm_call(purpose, provider, model) as call:
+        call["cache_hit"] = True
+
+
+def record_gemini_usage(response) -> None:
+    """Token counts from a generate_content response's usage_metadata (thinking tokens bill as output)."""
+    metadata = getattr(response, "usage_metadata", None)
+    if metadata is None:
+        return
+    record(prompt_tokens=metadata.prompt_token_count or 0,
+           output_tokens=(metadata.candidates_token_count or 0) + (getattr(metadata, "thoughts_token_count", 0) or 0))
+
+
+@asynccontextmanager
+async def ledger(writer, session_id: str = None, user_id: str = None):
+    """
+    Collect the LLM calls made inside the block (including its pipeline tasks) and
+    write them to llm_usage through `writer` (a SessionWriter), also when the block fails.
+    """
+    calls = []
+    token = _ledger.set(calls)
+    trace_id = tracing.current_trace_id()
+    try:
+        yield calls
+    finally:
+        _ledger.reset(token)
+        if calls:
+            documents = [
+                {**call, "session_id": session_id, "user_id": user_id, "trace_id": trace_id,
+                 "pipeline_version": PIPELINE_VERSION}
+                for call in calls
+            ]
+            await writer.write_many(LLM_USAGE_COLLECTION, documents)
+
+
+# ===========================
+# Queries
+# ===========================
+async def ensure_indexes(db) -> None:
+    await db[LLM_USAGE_COLLECTION].create_index("session_id")
+    await db[LLM_USAGE_COLLECTION].create_index([("created_at", DESCENDING), ("model", ASCENDING)])
+
+
+def _totals_stage(group_id) -> dict:
+    return {"$group": {
+        "_id": group_id,
+        "calls": {"$sum": 1},
+        "cache_hits": {"$sum": {"$cond": ["$cache_hit", 1, 0]}},
+        "errors": {"$sum": {"$cond": [{"$eq": ["$status", "error"]}, 1, 0]}},
+        "retries": {"$sum": "$retries"},
+        "prompt_tokens": {"$sum": "$prompt_tokens"},
+        "output_tokens": {"$sum": "$output_tokens"},
+        "cost_usd": {"$sum": "$cost_usd"},
+        "avg_latency": {"$avg": {"$cond": ["$cache_hit", None, "$latency"]}},
+        "p95_latency": {"$percentile": {"input": {"$cond": ["$cache_hit", None, "$latency"]},
+                                        "p": [0.95], "method": "approximate"}},
+        "avg_queue_time": {"$avg": "$queue_time"},
+        "avg_tokens_per_second": {"$avg": "$tokens_per_second"},
+    }}
+
+
+def _round_fields(document: dict) -> dict:
+    p95 = document.pop("p95_latency", None)
+    document["p95_latency"] = p95[0] if p95 else None
+    for field in ("cost_usd", "avg_latency", "p95_latency", "avg_queue_time", "avg_tokens_per_second"):
+        if isinstance(document.get(field), float):
+            document[field] = round(document[field], 6 if field == "cost_usd" else 3)
+    document["cache_hit_rate"] = round(document["cache_hits"] / document["calls"], 3) if document["calls"] else None
+    return document
+
+
+async def session_usage(db, session_id: str) -> dict:
+    """Every ledger record of a session, oldest first, with totals."""
+    calls = await db[LLM_USAGE_COLLECTION].find({"session_id": session_id}, {"_id": 0}) \
+        .sort("created_at", ASCENDING).to_list(length=None)
+    totals = await db[LLM_USAGE_COLLECTION].aggregate(
+        [{"$match": {"session_id": session_id}}, _totals_stage(None), {"$project": {"_id": 0}}]
+    )
+    totals = await totals.to_list(length=1)
+    return {"session_id": session_id, "calls": calls, "totals": _round_fields(totals[0]) if totals else None}
+
+
+async def usage_trends(db, days: int = 7, bucket: str = "day", group_by: str = "model",
+                       purpose: str = None) -> dict:
+    """
+    Calls, tokens, cost, latency (avg/p95), queue time, tokens/sec and cache hit
+    rate per time bucket and group (model, purpose, provider, key or pipeline_version).
+    Raises ValueError for an unknown bucket or group.
+    """
+    if bucket not in BUCKETS:
+        raise ValueError(f"bucket must be one of {list(BUCKETS)}")
+    if group_by not in GROUP_FIELDS:
+        raise ValueError(f"group_by must be one of {list(GROUP_FIELDS)}")
+    match = {"created_at": {"$gte": datetime.now(timezone.utc) - timedelta(days=days)}}
+    if purpose:
+        match["purpose"] = purpose
+    cursor = await db[LLM_USAGE_COLLECTION].aggregate([
+        {"$match": match},
+        _totals_stage({
+            "bucket": {"$dateTrunc": {"date": "$created_at", "unit": bucket}},
+            "group": GROUP_FIELDS[group_by],
+        }),
+        {"$sort": {"_id.bucket": ASCENDING, "_id.group": ASCENDING}},
+    ])
+    rows = []
+    async for document in cursor:
+        key = document.pop("_id")
+        rows.append({"bucket": key["bucket"], group_by: key["group"], **_round_fields(document)})
+    return {"days": days, "bucket": bucket, "group_by": group_by, "items": rows}
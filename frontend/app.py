@@ -233,10 +233,14 @@ def render_overall_score(evaluation: Dict[str, Any]) -> None:
     overall_score = overall_criteria_scores.get("overall_score")
     criteria_scores = overall_criteria_scores.get("criteria_scores")
 
-    if not criteria_scores:
+    if not criteria_scores and overall_score is None:
         st.warning("No criteria scores available.")
         return
 
+    # Partial results: some stages ran out of time or failed, the rest is still shown
+    if evaluation.get("status") == "partial":
+        st.warning("Some feedback could not be completed; showing the results that are available.")
+
     st.markdown("## 📊 Your IELTS Score")
     
     _, col, _ = st.columns([1, 1, 1])
@@ -251,6 +255,9 @@ def render_overall_score(evaluation: Dict[str, Any]) -> None:
         )
     
     st.markdown("---")
+    if not criteria_scores:
+        st.info("Criteria scores are not available for this result.")
+        return
     st.markdown("### Criteria Breakdown")
     cols = st.columns(4)
     for col, (backend_key, score) in zip(cols, criteria_scores.items()):
@@ -302,37 +309,43 @@ def render_criterion(
             "criteria_scores": criteria_scores
         }
 
-    score = overall_criteria_scores["criteria_scores"][criteria_config["constructive_key"]]
+    # Partial results may lack the criteria scores
+    score = (overall_criteria_scores.get("criteria_scores") or {}).get(criteria_config["constructive_key"])
     
     # Score display with progress bar
     col1, col2 = st.columns([1, 3])
     with col1:
-        st.metric(label="Score", value=f"{score}")
+        st.metric(label="Score", value=f"{score}" if score is not None else "-")
     with col2:
-        st.progress(min(int(score * 10), 100) / 100)
+        if score is not None:
+            st.progress(min(int(score * 10), 100) / 100)
+        else:
+            st.caption("Score not available")
     
     st.markdown("---")
     
-    # Extract feedback components
+    # Extract feedback components; either feedback part may be missing from a partial result
     try:
-        strengths = feedback["constructive_feedback"]["criteria"][
+        constructive_entry = (feedback.get("constructive_feedback") or {}).get("criteria", {}).get(
             criteria_config["constructive_key"]
-        ].get("strengths", [])
+        ) or {}
+        strengths = constructive_entry.get("strengths", [])
+        improvements = constructive_entry.get("areas_for_improvement", [])
         
         # evaluation_feedback may be keyed by display names in new payload
-        evaluation_block = feedback.get("evaluation_feedback", {})
+        evaluation_block = feedback.get("evaluation_feedback") or {}
         eval_key = criteria_config["feedback_key"]
         display_key = CRITERIA_DISPLAY_NAMES.get(criteria_config["constructive_key"], eval_key)
         evaluation_entry = evaluation_block.get(eval_key) or evaluation_block.get(display_key) or {}
         evaluation = evaluation_entry.get("feedback", "")
-        
-        improvements = feedback["constructive_feedback"]["criteria"][
-            criteria_config["constructive_key"]
-        ].get("areas_for_improvement", [])
-    except (KeyError, TypeError):
+    except (AttributeError, TypeError):
         st.warning(f"Unable to parse feedback for {title}")
         return
     
+    if not (strengths or evaluation or improvements):
+        st.info(f"Feedback for {title} is not available.")
+        return
+    
     # Display feedback in columns
     c1, c2, c3 = st.columns(3)
     